@@ -1,8 +1,10 @@
 import argparse
 import os
 import sys
-from typing import Sequence, TextIO
+from typing import Callable, Sequence, TextIO
 
+import compy.batch
+import compy.cache
 import compy.common
 from compy.state import CompilerState
 import compy.syntax
@@ -10,41 +12,106 @@ import compy.pipeline
 
 SUFFIX = '.compy'
 
-def main(args: Sequence[str] | None = None, stdout: TextIO = sys.stdout, stderr: TextIO = sys.stderr):
+def run_executable(path: str): # pragma: no cover
+    print('=====Running executable=====', flush=True)
+    os.execl(path, path)
+
+def main(args: Sequence[str] | None = None, stdout: TextIO = sys.stdout, stderr: TextIO = sys.stderr,
+         run_executable: Callable[[str], None] = run_executable):
     # print('Argv: ', sys.argv)
     # print('Main: ', args)
     parser = argparse.ArgumentParser(prog=__name__,
                                     description='A compiler')
-    parser.add_argument('source', help='The source code to compile')
+    parser.add_argument('source', nargs='+', help='The source code to compile (files or directories with --batch)')
     parser.add_argument('--debug-pipeline', action='store_true')
     parser.add_argument('--debug-asm', action='store_true')
     parser.add_argument('--debug-obj', action='store_true')
+    parser.add_argument('--debug-peephole', action='store_true', help='Print how many times each peephole rule applied')
+    parser.add_argument('--time-passes', action='store_true',
+                        help='Print the passes that ran (fused visitors together) with their wall and CPU time and the size of their result')
+    parser.add_argument('--time-passes-json', metavar='PATH', help='Also append the pass timings to PATH as one JSON object per line')
+    parser.add_argument('--trace-memory', action='store_true', help='Also record the peak memory of each pass (slows down compilation)')
+    parser.add_argument('--profile-passes', metavar='DIR', help='Also write a cProfile dump of each pass into DIR')
     parser.add_argument('--debug-children', action='store_true', help='Debugging AST Node children calculation')
     parser.add_argument('-r', '--run', action='store_true', help='If present, also runs the compiled executable (with no arguments) after compilation. ' +
                                                                  'Do not use this option if calling main() from another program since it uses exec()')
-    parser.add_argument('-o', '--output', help='The path to the output executable')
+    parser.add_argument('-o', '--output', help='The path to the output executable (the output directory with --batch)')
+    parser.add_argument('--batch', action='store_true', help='Compile many sources in parallel, each next to its source unless -o is given')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes with --batch (default: number of cores)')
+    parser.add_argument('--runtime-abi', choices=[abi.value for abi in compy.common.RuntimeAbi],
+                        default=compy.common.RuntimeAbi.POINTER.value,
+                        help='How objects are passed to runtime functions: by address, or as value/type register pairs')
+    parser.add_argument('--assembler', choices=[kind.value for kind in compy.common.AssemblerKind],
+                        default=compy.common.AssemblerKind.BUILTIN.value,
+                        help='Assemble in-process, with nasm, or with both and fail if the objects differ')
+    parser.add_argument('--runtime-profile', choices=[profile.value for profile in compy.common.RuntimeProfile],
+                        default=compy.common.RuntimeProfile.DEBUG.value,
+                        help='How the runtime is built: unoptimized, -O2, or -O2 as a single translation unit')
+    parser.add_argument('--profile-lines', action='store_true',
+                        help='Count the executions and runtime calls of each line, reported at exit to the file named by COMPY_PROFILE')
+    parser.add_argument('--debug-info', action='store_true',
+                        help='Emit DWARF line tables, so that debuggers and profilers map the code back to the source lines')
+    parser.add_argument('--link', choices=[mode.value for mode in compy.common.LinkMode],
+                        default=compy.common.LinkMode.DYNAMIC.value,
+                        help='Link dynamically, or statically with only the runtime functions the program calls (faster to start)')
+    parser.add_argument('--no-cache', action='store_true', help='Always compile, without reading or writing the executable cache')
+    parser.add_argument('--cache-stats', action='store_true', help='Print executable cache statistics after compilation')
     options = parser.parse_args(args)
-    source: str = options.source
+    if not options.batch and len(options.source) != 1:
+        parser.error('multiple sources require --batch')
+    if options.batch and options.run:
+        parser.error('--run cannot be used with --batch')
     # debug flags
     d_pipeline: bool = options.debug_pipeline
     d_asm: bool = options.debug_asm
     d_obj: bool = options.debug_obj
     d_children: bool = options.debug_children
+    d_peephole: bool = options.debug_peephole
+    timing = compy.common.PassTimingOptions(json_path=options.time_passes_json, trace_memory=options.trace_memory,
+                                            profile_dir=options.profile_passes)
+    timing.enabled = options.time_passes or timing.json_path is not None or timing.trace_memory or timing.profile_dir is not None
     compy.syntax.debug_ast_children = d_children
+    if d_children: # pragma: no cover
+        compy.syntax.regenerate_traversals()
     run: bool = options.run
     out_path: str | None = options.output
+    compile_options = compy.common.CompileOptions(compy.common.RuntimeAbi(options.runtime_abi),
+                                                  compy.common.AssemblerKind(options.assembler),
+                                                  compy.common.RuntimeProfile(options.runtime_profile),
+                                                  options.profile_lines, options.debug_info,
+                                                  compy.common.LinkMode(options.link))
+    flags = compy.common.DebugFlags(d_pipeline, d_asm, d_obj, d_peephole, timing)
+    # Debug outputs are only produced by actually compiling
+    use_cache = not (options.no_cache or flags.any() or d_children)
+    exe_cache = compy.cache.ExecutableCache.default()
+
+    if options.batch:
+        sources = compy.batch.collect_sources(options.source, SUFFIX)
+        jobs = compy.batch.make_jobs(sources, SUFFIX, out_path, flags, compile_options, use_cache)
+        if out_path is not None:
+            os.makedirs(out_path, exist_ok=True)
+        try:
+            compy.batch.run_batch(jobs, stdout, stderr, options.jobs)
+        finally:
+            if options.cache_stats:
+                print(exe_cache.stats(), file=stdout)
+        return
 
+    source: str = options.source[0]
     if not source.endswith(SUFFIX): # pragma: no cover
         raise compy.common.UserError(f'Source file "{source}" does not end in {SUFFIX}')
     prefix = source[:-len(SUFFIX)]
     if out_path is None: # pragma: no cover
         out_path = prefix + '.out'
-    flags = compy.common.DebugFlags(d_pipeline, d_asm, d_obj)
-    info = compy.common.CompilerInfo(source, prefix, out_path, flags, stdout, stderr, CompilerState())
-    compy.pipeline.run(info)
+    info = compy.common.CompilerInfo(source, prefix, out_path, flags, stdout, stderr, CompilerState(), compile_options)
+    if use_cache:
+        compy.cache.run_cached(info, compy.pipeline.run, exe_cache)
+    else:
+        compy.pipeline.run(info)
+    if options.cache_stats:
+        print(exe_cache.stats(), file=stdout)
     if run: # pragma: no cover
-        print('=====Running executable=====')
-        os.execl(info.out_path, info.out_path)
+        run_executable(info.out_path)
 
 def start(): # pragma: no cover
     try:
@@ -1,7 +1,8 @@
 # ANF: Convert expressions to A-Normal Form
 
 from dataclasses import dataclass, field
-from compy.common import CompiledFunction
+import sys
+from compy.common import CompiledFunction, Walk, trampoline
 from compy.state import CompilerState
 from compy.syntax import Binding, ConstLiteral, Expression, ImmConstLiteral, Name, NewScope, Node, Scope, ScopeInformation, Statement, VarInfo, mk_exprscope
 
@@ -11,31 +12,27 @@ IMM = Name | ImmConstLiteral
 def anf(comp_state: CompilerState, funcs: list[CompiledFunction]):
     for func in funcs:
         anf_state = ANFState()
-        def visit(node: Node) -> Node:
+        def visit(node: Node) -> Walk[Node]:
             binds = BindingsBuilder(comp_state, anf_state)
-            for field in node.child_fields():
-                need_imm = field.need_imm
-                def process(cnode: Node) -> Node:
-                    cnode = visit(cnode)
-                    if need_imm:
-                        return imm(binds.process_imm_expr(coerce_expr(cnode)))
-                    else:
-                        return cnode
-                match field.get():
-                    case Node() as child:
-                        field.set(process(child))
-                    case nodes:
-                        field.set(map(process, nodes))
+            def process(cnode: Node, need_imm: bool) -> Walk[Node]:
+                cnode = yield visit(cnode)
+                if need_imm:
+                    return imm(binds.process_imm_expr(coerce_expr(cnode)))
+                else:
+                    return cnode
+            yield from node.rewrite_children(process)
             if (bindings := binds.bindings):
                 match node:
                     case Expression():
-                        return mk_exprscope(node.span, bindings, node, info=ScopeInformation())
+                        scope = mk_exprscope(node.span, bindings, node, info=ScopeInformation())
+                        scope.static_type = node.static_type
+                        return scope
                     case Statement():
                         return NewScope(span=node.span, body=Scope(bindings + [node], info=ScopeInformation()))
                     case _: # pragma: no cover
                         assert False, 'Cannot ANF something that is neither an expression or statement'
             return node
-        visit(func.body)
+        trampoline(visit(func.body))
 
 def coerce_expr(node: Node) -> Expression:
     assert isinstance(node, Expression)
@@ -47,7 +44,7 @@ class ANFState:
 
     def get_var_name(self) -> str:
         self.next_ctr += 1
-        return f'$anf{self.next_ctr}'
+        return sys.intern(f'$anf{self.next_ctr}')
 
 @dataclass
 class BindingsBuilder:
@@ -63,12 +60,12 @@ class BindingsBuilder:
                 return self.comp_state.const_pool.pool(expr)
             case _:
                 var_name = self.anf_state.get_var_name()
-                info = VarInfo(origin_function_id=-1, mutable=False)
+                info = VarInfo(origin_function_id=-1, mutable=False, static_type=expr.static_type)
                 self.bindings.append(Binding(span=expr.span, mutable=False,
                     name=var_name,
                     init_val=expr,
                     info=info))
-                return Name(span=expr.span, name=var_name, info=info)
+                return Name(span=expr.span, name=var_name, info=info, static_type=expr.static_type)
 
 # Allow type checker to help catch errors
 def imm(ex: IMM) -> Expression:
@@ -1,11 +1,14 @@
-from dataclasses import dataclass
+from collections import Counter
+from dataclasses import dataclass, field
 from enum import Enum
 import os
 import subprocess
 import tempfile
-from typing import Iterable, TextIO
+from typing import Callable, Iterable, Sequence, TextIO, overload
 
-from compy.common import CompilerInfo
+from compy.common import AssemblerKind, CompilerInfo, LinkMode, UserError
+from compy.passes import PassManager
+from compy.runtime_build import runtime_obj_path
 
 
 EOL = '\n'
@@ -17,12 +20,19 @@ class Operand:
 
 class Reg(Operand, Enum):
     RAX = 'rax'
+    RBX = 'rbx'
     RCX = 'rcx'
     RDX = 'rdx'
     RDI = 'rdi'
     RSI = 'rsi'
     R8 = 'r8'
     R9 = 'r9'
+    R10 = 'r10'
+    R11 = 'r11'
+    R12 = 'r12'
+    R13 = 'r13'
+    R14 = 'r14'
+    R15 = 'r15'
     RBP = 'rbp'
     RSP = 'rsp'
 
@@ -77,8 +87,9 @@ class MemRegOffset(MemOperand):
 @dataclass
 class MemRel(MemOperand):
     sym: Symbol
+    offset: int = 0
     def address(self) -> str:
-        return 'rel ' + self.sym.name
+        return 'rel ' + self.sym.name + offset_suffix(self.offset)
 
 class AsmLine:
     def assemble(self) -> str:
@@ -92,6 +103,14 @@ class Label(AsmLine):
     def assemble(self) -> str:
         return self.label + ':'
 
+# The code that follows comes from a line of the source (--debug-info)
+@dataclass
+class LineMarker(AsmLine):
+    lineno: int
+    path: str
+    def assemble(self) -> str:
+        return f'%line {self.lineno}+0 {self.path}'
+
 @dataclass
 class Instruction(AsmLine):
     mnemonic: str
@@ -134,12 +153,33 @@ def add(op1: Operand, op2: Operand):
 def sub(op1: Operand, op2: Operand):
     return Instruction('sub', [op1, op2])
 
+def xor(op1: Operand, op2: Operand):
+    return Instruction('xor', [op1, op2])
+
+def imul(op1: Operand, op2: Operand):
+    return Instruction('imul', [op1, op2])
+
 def jne(dst: Operand):
     return Instruction('jne', [dst])
 
 def je(dst: Operand):
     return Instruction('je', [dst])
 
+def jl(dst: Operand):
+    return Instruction('jl', [dst])
+
+def jle(dst: Operand):
+    return Instruction('jle', [dst])
+
+def jg(dst: Operand):
+    return Instruction('jg', [dst])
+
+def jge(dst: Operand):
+    return Instruction('jge', [dst])
+
+def jo(dst: Operand):
+    return Instruction('jo', [dst])
+
 def jmp(dst: Operand):
     return Instruction('jmp', [dst])
 
@@ -164,15 +204,239 @@ def dq(val: Const):
 def db_s(vals: Iterable[Const]):
     return Instruction('db', list(vals))
 
+# Reserves quad words (in .bss)
+def resq(count: Const):
+    return Instruction('resq', [count])
+
 # Instructions end
 
-def output(dst: TextIO, lines: list[AsmLine]):
-    dst.writelines(line.asm_line() for line in lines)
+# Peephole optimization
+
+# Replaces some lines starting at an index: returns the number of lines replaced
+# and their replacement, or None if the rule does not apply there
+PeepholeResult = tuple[int, list[AsmLine]] | None
+PeepholeRule = Callable[[Sequence[AsmLine], int], PeepholeResult]
+
+# Conditional jumps and their negations
+INVERSE_JUMPS = {
+    'je': 'jne', 'jne': 'je',
+    'jl': 'jge', 'jge': 'jl',
+    'jg': 'jle', 'jle': 'jg',
+}
+# Instructions that overwrite flags without reading them
+FLAG_WRITERS = {'cmp', 'add', 'sub', 'xor', 'imul', 'neg', 'call'}
+
+def is_instr(line: AsmLine, *mnemonics: str) -> bool:
+    return isinstance(line, Instruction) and line.mnemonic in mnemonics
+
+def reads_reg(op: Operand, reg: Reg) -> bool:
+    return op == reg or (isinstance(op, MemRegOffset) and op.reg == reg)
+
+# A memory operand whose address depends on a register, which a move of that register can change
+def based_on(op: Operand, reg: Operand) -> bool:
+    return isinstance(op, MemRegOffset) and op.reg == reg
+
+def rule_self_move(lines: Sequence[AsmLine], i: int) -> PeepholeResult:
+    match lines[i]:
+        case Instruction('mov', [dst, src]) if dst == src:
+            return 1, []
+
+def rule_store_load(lines: Sequence[AsmLine], i: int) -> PeepholeResult:
+    # The second move copies back a value that is already there
+    match lines[i:i + 2]:
+        case [Instruction('mov', [dst, src]) as first, Instruction('mov', [dst2, src2])] \
+                if dst == src2 and src == dst2 and not based_on(dst, src) and not based_on(src, dst):
+            return 2, [first]
+
+def rule_dead_move(lines: Sequence[AsmLine], i: int) -> PeepholeResult:
+    # A register overwritten before it is read
+    match lines[i:i + 2]:
+        case [Instruction('mov', [Reg() as dst, _]), Instruction('mov', [dst2, src2]) as second] \
+                if dst == dst2 and not reads_reg(src2, dst):
+            return 2, [second]
+
+def rule_jump_to_next(lines: Sequence[AsmLine], i: int) -> PeepholeResult:
+    match lines[i]:
+        case Instruction('jmp', [Symbol(target)]):
+            j = i + 1
+            while j < len(lines) and isinstance(line := lines[j], Label):
+                if line.label == target:
+                    return 1, []
+                j += 1
+
+def rule_jump_over_jump(lines: Sequence[AsmLine], i: int) -> PeepholeResult:
+    # jcc L1; jmp L2; L1: => jncc L2; L1:
+    match lines[i:i + 3]:
+        case [Instruction(jcc, [Symbol(skip)]), Instruction('jmp', [target]), Label(label) as after] \
+                if jcc in INVERSE_JUMPS and skip == label:
+            return 3, [Instruction(INVERSE_JUMPS[jcc], [target]), after]
+
+def rule_unreachable(lines: Sequence[AsmLine], i: int) -> PeepholeResult:
+    match lines[i:i + 2]:
+        case [first, Instruction()] if is_instr(first, 'jmp', 'ret'):
+            return 2, [first]
+
+def rule_zero_idiom(lines: Sequence[AsmLine], i: int) -> PeepholeResult:
+    match lines[i]:
+        case Instruction('mov', [Reg() as dst, Const(0)]):
+            # xor also clobbers the flags, which must not be read before being set again
+            for j in range(i + 1, len(lines)):
+                line = lines[j]
+                if is_instr(line, *FLAG_WRITERS, 'ret'):
+                    return 1, [xor(dst, dst)]
+                if not is_instr(line, 'mov', 'lea', 'push', 'pop'):
+                    return None
+
+def rule_nop_stack_adjust(lines: Sequence[AsmLine], i: int) -> PeepholeResult:
+    match lines[i]:
+        case Instruction('add' | 'sub', [Reg.RSP, Const(0)]):
+            return 1, []
+
+PEEPHOLE_RULES: dict[str, PeepholeRule] = {
+    'self_move': rule_self_move,
+    'store_load': rule_store_load,
+    'dead_move': rule_dead_move,
+    'jump_to_next': rule_jump_to_next,
+    'jump_over_jump': rule_jump_over_jump,
+    'unreachable': rule_unreachable,
+    'zero_idiom': rule_zero_idiom,
+    'nop_stack_adjust': rule_nop_stack_adjust,
+}
+# Mnemonics of the instructions each rule can start at, rules not listed are tried at every line
+PEEPHOLE_FIRST: dict[str, set[str]] = {
+    'self_move': {'mov'},
+    'store_load': {'mov'},
+    'dead_move': {'mov'},
+    'jump_to_next': {'jmp'},
+    'jump_over_jump': set(INVERSE_JUMPS),
+    'unreachable': {'jmp', 'ret'},
+    'zero_idiom': {'mov'},
+    'nop_stack_adjust': {'add', 'sub'},
+}
+
+# The lines rewritten by the peephole optimizer, as a gap buffer at the current line:
+# rewrites and small moves of the current line take constant time instead of shifting a whole list
+class LineBuffer(Sequence[AsmLine]):
+    def __init__(self, lines: Iterable[AsmLine]):
+        self.before: list[AsmLine] = []
+        self.after: list[AsmLine] = list(lines)
+        self.after.reverse() # The current line is last
+
+    def __len__(self) -> int:
+        return len(self.before) + len(self.after)
+
+    @overload
+    def __getitem__(self, index: int) -> AsmLine: ...
+    @overload
+    def __getitem__(self, index: slice) -> list[AsmLine]: ...
+    def __getitem__(self, index: int | slice) -> AsmLine | list[AsmLine]:
+        before, after = self.before, self.after
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1 and start >= len(before): # Ex. a window at the current line
+                return after[max(len(before) + len(after) - stop, 0):len(before) + len(after) - start][::-1]
+            return [self[i] for i in range(start, stop, step)]
+        if index < len(before):
+            return before[index]
+        after_index = len(after) - 1 - (index - len(before))
+        if after_index < 0:
+            raise IndexError(index)
+        return after[after_index]
+
+    def current(self) -> int:
+        return len(self.before)
+
+    def move_to(self, index: int):
+        while len(self.before) > index:
+            self.after.append(self.before.pop())
+        while len(self.before) < index:
+            self.before.append(self.after.pop())
+
+    # Replaces `count` lines starting at the current one
+    def replace(self, count: int, replacement: list[AsmLine]):
+        del self.after[len(self.after) - count:]
+        self.after.extend(reversed(replacement))
+
+    def to_list(self) -> list[AsmLine]:
+        return self.before + self.after[::-1]
 
-RUNTIME_OBJ = 'runtime.o'
+@dataclass
+class Peephole:
+    rules: dict[str, PeepholeRule] = field(default_factory=lambda: dict(PEEPHOLE_RULES))
+    # Number of times each rule applied
+    hits: Counter[str] = field(default_factory=Counter)
+    # Rules to try by mnemonic of the current line (None for other lines)
+    dispatch: dict[str | None, list[tuple[str, PeepholeRule]]] = field(default_factory=dict, init=False)
+
+    # Longest window looked back at after a rewrite so that rewrites can cascade
+    BACKTRACK = 2
+
+    def candidates(self, line: AsmLine) -> list[tuple[str, PeepholeRule]]:
+        mnemonic = line.mnemonic if isinstance(line, Instruction) else None
+        if (rules := self.dispatch.get(mnemonic)) is None:
+            rules = self.dispatch[mnemonic] = [(name, rule) for name, rule in self.rules.items()
+                                               if name not in PEEPHOLE_FIRST or mnemonic in PEEPHOLE_FIRST[name]]
+        return rules
+
+    def run(self, lines: list[AsmLine]) -> list[AsmLine]:
+        # Line markers are set aside so that rewrites still apply across lines of the source
+        markers = [(i, line) for i, line in enumerate(lines) if isinstance(line, LineMarker)]
+        if markers:
+            code = [line for line in lines if not isinstance(line, LineMarker)]
+            return restore_markers(self.rewrite(code), code, [(i - n, marker) for n, (i, marker) in enumerate(markers)])
+        return self.rewrite(lines)
+
+    def rewrite(self, lines: list[AsmLine]) -> list[AsmLine]:
+        buffer = LineBuffer(lines)
+        while (i := buffer.current()) < len(buffer):
+            for name, rule in self.candidates(buffer[i]):
+                if (rewrite := rule(buffer, i)) is not None:
+                    count, replacement = rewrite
+                    buffer.replace(count, replacement)
+                    self.hits[name] += 1
+                    buffer.move_to(max(i - self.BACKTRACK, 0))
+                    break
+            else:
+                buffer.move_to(i + 1)
+        return buffer.to_list()
+
+    def report(self) -> str:
+        return '\n'.join(f'{name}: {self.hits[name]}' for name in self.rules)
+
+# Puts each marker back before the line it preceded in `code` (given by its index there),
+# or the first line after it that is still in `rewritten`
+def restore_markers(rewritten: list[AsmLine], code: list[AsmLine], markers: list[tuple[int, LineMarker]]) -> list[AsmLine]:
+    kept = {id(line) for line in rewritten}
+    anchored: dict[int, list[LineMarker]] = {}
+    trailing: list[LineMarker] = []
+    for i, marker in markers:
+        while i < len(code) and id(code[i]) not in kept:
+            i += 1
+        if i < len(code):
+            anchored.setdefault(id(code[i]), []).append(marker)
+        else:
+            trailing.append(marker)
+    result: list[AsmLine] = []
+    for line in rewritten:
+        if (before := anchored.pop(id(line), None)) is not None:
+            result += before
+        result.append(line)
+    return result + trailing
+
+# Lines serialized together into one write
+OUTPUT_CHUNK = 4096
+
+def output(dst: TextIO, lines: list[AsmLine]):
+    for start in range(0, len(lines), OUTPUT_CHUNK):
+        dst.write(''.join([line.asm_line() for line in lines[start:start + OUTPUT_CHUNK]]))
 
-def build(info: CompilerInfo, lines: list[AsmLine]):
+def build(info: CompilerInfo, lines: list[AsmLine], passes: PassManager):
+    # The encoder depends on this module
+    from compy.elf import read_elf, write_elf
+    from compy.encoder import assemble, compare_objects
     oprint = info.print
+    assembler = info.options.assembler
+    runtime = runtime_obj_path(info.options.runtime_profile)
     def run_cmd(args: list[str]):
         oprint('+ ' + ' '.join(args))
         subprocess.check_call(args)
@@ -181,9 +445,25 @@ def build(info: CompilerInfo, lines: list[AsmLine]):
             return info.src_prefix if debug else (tmpdir + '/compy')
         nasm_file = prefix(info.debug_flags.asm) + '.nasm'
         obj_file = prefix(info.debug_flags.obj) + '.o'
-        with open(nasm_file, 'w') as nasm:
-            output(nasm, lines)
-        oprint('#### Running build commands...')
-        run_cmd(['nasm', '-f', 'elf64', '-o', obj_file, nasm_file])
-        run_cmd(['gcc', '-o', info.out_path, obj_file, os.path.dirname(__file__) + '/../runtime/' + RUNTIME_OBJ])
+        def assemble_object():
+            if assembler != AssemblerKind.BUILTIN or info.debug_flags.asm:
+                with open(nasm_file, 'w') as nasm:
+                    output(nasm, lines)
+            oprint('#### Running build commands...')
+            if assembler == AssemblerKind.BUILTIN:
+                oprint('+ (built-in assembler) -o ' + obj_file)
+                with open(obj_file, 'wb') as obj:
+                    obj.write(write_elf(assemble(lines)))
+            else:
+                debug = ['-g', '-F', 'dwarf'] if info.options.debug_info else []
+                run_cmd(['nasm', '-f', 'elf64', *debug, '-o', obj_file, nasm_file])
+            if assembler == AssemblerKind.COMPARE:
+                with open(obj_file, 'rb') as obj:
+                    diffs = compare_objects(assemble(lines), read_elf(obj.read()))
+                if diffs:
+                    raise UserError('Built-in assembler output differs from nasm:\n' + '\n'.join(diffs))
+        passes.time('assemble', assemble_object, lambda _: os.path.getsize(obj_file), 'bytes')
+        static = ['-static', '-Wl,--gc-sections'] if info.options.link == LinkMode.STATIC else []
+        passes.time('link', lambda: run_cmd(['gcc', *static, '-o', info.out_path, obj_file, runtime]),
+                    lambda _: os.path.getsize(info.out_path), 'bytes')
         oprint('#### Build commands ran successfully...')
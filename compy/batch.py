@@ -0,0 +1,92 @@
+# Compile many sources at once on a process pool
+# Each worker runs the whole pipeline for one file, so the front end of some files
+# overlaps with the assembler/linker subprocesses of others
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+import io
+import os
+import subprocess
+from typing import TextIO
+
+import compy.cache
+from compy.common import CompileOptions, CompilerInfo, DebugFlags, UserError
+import compy.pipeline
+from compy.state import CompilerState
+
+@dataclass
+class BatchJob:
+    src_path: str
+    src_prefix: str
+    out_path: str
+    flags: DebugFlags
+    options: CompileOptions
+    use_cache: bool
+
+@dataclass
+class BatchResult:
+    job: BatchJob
+    stdout: str
+    stderr: str # Includes the report_error diagnostics
+    error: str | None # None on success
+
+def collect_sources(paths: list[str], suffix: str) -> list[str]:
+    sources: list[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                sources.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(suffix))
+        elif path.endswith(suffix):
+            sources.append(path)
+        else:
+            raise UserError(f'Source file "{path}" does not end in {suffix}')
+    return sources
+
+def make_jobs(sources: list[str], suffix: str, out_dir: str | None,
+              flags: DebugFlags, options: CompileOptions, use_cache: bool) -> list[BatchJob]:
+    jobs: list[BatchJob] = []
+    out_paths: set[str] = set()
+    for source in sources:
+        prefix = source[:-len(suffix)]
+        out_path = prefix + '.out' if out_dir is None else os.path.join(out_dir, os.path.basename(prefix) + '.out')
+        if out_path in out_paths:
+            raise UserError(f'Multiple sources would be compiled to "{out_path}"')
+        out_paths.add(out_path)
+        jobs.append(BatchJob(source, prefix, out_path, flags, options, use_cache))
+    return jobs
+
+def compile_job(job: BatchJob) -> BatchResult:
+    stdout, stderr = io.StringIO(), io.StringIO()
+    info = CompilerInfo(job.src_path, job.src_prefix, job.out_path, job.flags, stdout, stderr, CompilerState(), job.options)
+    error = None
+    # Exceptions are returned as text since compile errors cannot always be pickled
+    try:
+        if job.use_cache:
+            compy.cache.run_cached(info, compy.pipeline.run, compy.cache.ExecutableCache.default())
+        else:
+            compy.pipeline.run(info)
+    except (UserError, OSError, subprocess.CalledProcessError) as e:
+        error = str(e)
+    return BatchResult(job, stdout.getvalue(), stderr.getvalue(), error)
+
+def run_batch(jobs: list[BatchJob], stdout: TextIO, stderr: TextIO, workers: int | None = None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    failures = 0
+    with ProcessPoolExecutor(max_workers=min(workers, max(len(jobs), 1))) as pool:
+        futures = [pool.submit(compile_job, job) for job in jobs]
+        # Report in completion order, so that slow files do not hold back the others
+        for future in as_completed(futures):
+            result = future.result()
+            if result.job.flags.any(): # Otherwise only the build commands
+                stdout.write(result.stdout)
+            stderr.write(result.stderr)
+            if result.error is None:
+                print(f'OK {result.job.src_path} -> {result.job.out_path}', file=stdout)
+            else:
+                failures += 1
+                print(f'FAILED {result.job.src_path}: {result.error}', file=stderr)
+    print(f'{len(jobs) - failures} of {len(jobs)} files compiled', file=stdout)
+    if failures:
+        raise UserError(f'{failures} of {len(jobs)} files failed to compile')
@@ -0,0 +1,151 @@
+# Content-addressed cache of compiled executables
+# Keyed by the source, the compiler itself, the compile options and the runtime build
+
+from dataclasses import dataclass
+import fcntl
+from functools import cache
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable
+
+from compy.common import CompilerInfo
+from compy.runtime_build import runtime_key
+
+CACHE_DIR_ENV = 'COMPY_CACHE_DIR'
+CACHE_SIZE_ENV = 'COMPY_CACHE_SIZE' # In bytes
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+ENTRY_SUFFIX = '.out'
+STATS_FILE = 'stats.json'
+
+def default_cache_dir() -> str:
+    if (path := os.environ.get(CACHE_DIR_ENV)):
+        return path
+    xdg_cache = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(xdg_cache, 'compy')
+
+def file_hash(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+# Changes whenever any module of the compiler changes
+def compute_compiler_hash() -> str:
+    digest = hashlib.sha256()
+    package = os.path.dirname(__file__)
+    for name in sorted(os.listdir(package)):
+        if name.endswith('.py'):
+            digest.update(name.encode() + b'\0' + file_hash(os.path.join(package, name)).encode())
+    return digest.hexdigest()
+
+compiler_hash = cache(compute_compiler_hash)
+
+def cache_key(info: CompilerInfo) -> str:
+    digest = hashlib.sha256()
+    # The runtime sources can change at any time, so they are hashed on every compilation
+    parts = [file_hash(info.src_path), compiler_hash(), repr(info.options), runtime_key(info.options.runtime_profile)]
+    if info.options.debug_info: # The debug info names the source file and the working directory
+        parts += [info.src_path, os.getcwd()]
+    for part in parts:
+        digest.update(part.encode() + b'\0')
+    return digest.hexdigest()
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    entries: int
+    size: int # Bytes
+
+    def __str__(self) -> str:
+        return f'Cache hits: {self.hits}, misses: {self.misses}, entries: {self.entries}, size: {self.size} bytes'
+
+@dataclass
+class ExecutableCache:
+    directory: str
+    max_size: int # Least recently used entries are evicted beyond this total size
+
+    @staticmethod
+    def default() -> 'ExecutableCache':
+        return ExecutableCache(default_cache_dir(), int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE)))
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def entries(self) -> list[os.DirEntry[str]]:
+        try:
+            return [entry for entry in os.scandir(self.directory) if entry.name.endswith(ENTRY_SUFFIX)]
+        except FileNotFoundError:
+            return []
+
+    # Place the cached executable at `out_path`, returns False on a miss
+    def fetch(self, key: str, out_path: str) -> bool:
+        entry = self.entry_path(key)
+        try:
+            os.utime(entry) # Most recently used
+        except FileNotFoundError:
+            self.record('misses')
+            return False
+        remove_output(out_path)
+        try:
+            os.link(entry, out_path)
+        except OSError: # Ex. on another file system
+            shutil.copy2(entry, out_path)
+        self.record('hits')
+        return True
+
+    def store(self, key: str, exe_path: str):
+        os.makedirs(self.directory, exist_ok=True)
+        # Copy then rename, so that concurrent compilations never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        shutil.copy2(exe_path, tmp_path)
+        os.replace(tmp_path, self.entry_path(key))
+        self.evict()
+
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.max_size:
+                break
+            total -= entry.stat().st_size
+            os.unlink(entry.path)
+
+    def record(self, counter: str):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, STATS_FILE), 'a+') as stats_file:
+            fcntl.flock(stats_file, fcntl.LOCK_EX)
+            stats_file.seek(0)
+            counts = json.loads(stats_file.read() or '{}')
+            counts[counter] = counts.get(counter, 0) + 1
+            stats_file.seek(0)
+            stats_file.truncate()
+            json.dump(counts, stats_file)
+
+    def stats(self) -> CacheStats:
+        try:
+            with open(os.path.join(self.directory, STATS_FILE)) as stats_file:
+                counts = json.loads(stats_file.read() or '{}')
+        except FileNotFoundError:
+            counts = {}
+        entries = self.entries()
+        return CacheStats(counts.get('hits', 0), counts.get('misses', 0), len(entries),
+                          sum(entry.stat().st_size for entry in entries))
+
+# The output may be a hard link to a cache entry, which must not be overwritten in place
+def remove_output(out_path: str):
+    try:
+        os.unlink(out_path)
+    except FileNotFoundError:
+        pass
+
+def run_cached(info: CompilerInfo, run: Callable[[CompilerInfo], None], exe_cache: ExecutableCache):
+    key = cache_key(info)
+    if exe_cache.fetch(key, info.out_path):
+        info.print(f'Using cached executable {key[:16]}')
+        return
+    remove_output(info.out_path)
+    run(info)
+    exe_cache.store(key, info.out_path)
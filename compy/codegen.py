@@ -1,24 +1,30 @@
-from dataclasses import dataclass
-from typing import Iterable, List
+from dataclasses import dataclass, field, replace
+import gc
+from typing import Callable, Iterable
 
 from compy.anf import IMM
-from compy.asm import (AsmLine, Const, Label, MemOperand, MemRel, Operand, Reg, Symbol,
-                       WordSize, add, call, cmp, extern, global_, je, jmp, jne, lea,
-                       mov, pop, push, ret, section, sub)
-from compy.common import (MAIN, CompiledFunction, CompilerInfo, PrimType, SourceSpan, concat,
-                          unwrap)
-from compy.runtime import RUNTIME_SYMBOLS
-from compy.stack import op_stack
+from compy.asm import (AsmLine, Const, Instruction, Label, LineMarker, MemOperand, MemRegOffset, MemRel, Operand,
+                       Reg, Symbol, WordSize, add, call, cmp, dq, extern, global_, imul, je, jg, jge, jl,
+                       jle, jmp, jne, jo, lea, mov, pop, push, resq, ret, section, sub, xor)
+from compy.common import (MAIN, CompiledFunction, CompileOptions, CompilerInfo, PrimType, RuntimeAbi,
+                          SpanTable, Walk, trampoline, unwrap)
+from compy.runtime import REGPASS_SUFFIX, REGPASS_SYMBOLS
+from compy.stack import REG_SIZE, SIZE_UNTYPED, op_stack
 from compy.syntax import (IMM_EXPR, IMM_EXPRS, Assignment, Binding, BinOp,
                           ConstLiteral, EvalExpr, Expression, ExprScope,
-                          GetType, IfExpr, IfStmt, ImmConstLiteral, Input, Name, NewScope, NoOp, Prim1,
+                          GetType, IfExpr, IfStmt, ImmConstLiteral, Input, Name, NewScope, Node, NoOp, Prim1,
                           Prim2, Print, RuntimeCall, Scope, Statement, StringLiteral, UnaryOp, VarInfo, While)
 
 CODE = Iterable[AsmLine]
+# Code of constructs that nest, as a walk (see trampoline) yielding AsmLines and the walks of nested constructs
+NESTED_CODE = Walk[None]
 
 RVAL = Reg.RAX
 RTYPE = Reg.RDX
 
+# Caller-saved and not used to pass arguments
+RSCRATCH = Reg.R11
+
 # Registers used to pass arguments on the calling convention
 RPARAMS = [Reg.RDI, Reg.RSI, Reg.RDX, Reg.RCX, Reg.R8, Reg.R9]
 
@@ -26,15 +32,74 @@ RPARAMS = [Reg.RDI, Reg.RSI, Reg.RDX, Reg.RCX, Reg.R8, Reg.R9]
 EXTRACT_BOOL = 'extract_bool'
 PRINT_VARARGS = 'print_variadic'
 INPUT = 'eval_input'
+# With --profile-lines, for each line: the number of times it started executing and of runtime calls made by it
+LINE_COUNTS = 'compy_line_counts'
+LINE_COUNTS_SIZE = 'compy_line_counts_size' # Number of lines in the table
+LINE_COUNT_SIZE = 16
+# Runtime functions with a register ABI wrapper
+REGPASS = {op.symbol() for op in UnaryOp} | {op.symbol() for op in BinOp} | REGPASS_SYMBOLS
 
 @dataclass
 class CodegenState:
+    options: CompileOptions = field(default_factory=CompileOptions)
+    spans: SpanTable = field(default_factory=SpanTable)
     label_num: int = 0
+    # Rarely executed code (slow paths), placed after the current function's body
+    cold: list[AsmLine] = field(default_factory=list)
+    # Stack space used by variables of the current function
+    frame_base: int = 0
+    # Scratch slots (below variables) needed by the current function to pass objects held in registers
+    scratch_slots: int = 0
+    # Highest line with a counter, with --profile-lines
+    last_counted_line: int = 0
+    # Of the source, and line of the code emitted last, with --debug-info
+    src_path: str = ''
+    marked_line: int | None = None
+    # Runtime functions called by the program, the only ones declared extern
+    externs: set[str] = field(default_factory=set)
+
+    def lineno(self, node: Node) -> int:
+        return self.spans.lineno(node.span)
 
     def new_label(self) -> str:
         self.label_num += 1
         return f'_compy_label_{self.label_num}'
 
+    # Increments the counter of `lineno` (at `offset` in its entry) with --profile-lines
+    def count(self, lineno: int, offset: int) -> CODE:
+        if not self.options.profile_lines:
+            return []
+        self.last_counted_line = max(self.last_counted_line, lineno)
+        return [ add(MemRel(Symbol(LINE_COUNTS), LINE_COUNT_SIZE * lineno + offset), Const(1)) ]
+
+    def count_line(self, lineno: int) -> CODE:
+        return self.count(lineno, 0)
+
+    def count_call(self, lineno: int) -> CODE:
+        return self.count(lineno, 8)
+
+    # Marks the start of the code of another line with --debug-info
+    def mark_line(self, lineno: int) -> CODE:
+        if not self.options.debug_info or lineno == self.marked_line:
+            return []
+        self.marked_line = lineno
+        return [ LineMarker(lineno, self.src_path) ]
+
+    def add_cold(self, lines: CODE):
+        # Placed after the code of other lines
+        if self.options.debug_info and self.marked_line is not None:
+            self.cold.append(LineMarker(self.marked_line, self.src_path))
+        self.cold.extend(lines)
+
+    def take_cold(self) -> list[AsmLine]:
+        cold, self.cold = self.cold, []
+        self.marked_line = None
+        return cold
+
+    def scratch_slot(self, index: int) -> int:
+        self.scratch_slots = max(self.scratch_slots, index + 1)
+        return -(self.frame_base + SIZE_UNTYPED * (index + 1))
+
 @dataclass
 class AddrOf:
     mem_op: MemOperand
@@ -43,10 +108,17 @@ class AddrOf:
 class Direct:
     op: Operand
 
+# An object not in memory (Ex. in registers or a stack slot without the type word),
+# stored into a scratch slot to pass its address (unless passed in registers with the register ABI)
+@dataclass
+class Spill:
+    val: Operand
+    ty: Operand
+
 NULL = Const(0)
 NULL_ARG = Direct(NULL)
 
-ARG = Direct | AddrOf
+ARG = Direct | AddrOf | Spill
 
 def op_type(ty: PrimType):
     return Const(ty.code())
@@ -56,12 +128,27 @@ def op_var_val(stack_offset: int):
 def op_var_type(stack_offset: int):
     return op_stack(stack_offset, offset=8)
 
+def var_val_op(info: VarInfo) -> Operand:
+    if info.regs is not None:
+        return info.regs[0]
+    return op_var_val(info.get_stack_offset())
+def var_type_op(info: VarInfo) -> Operand:
+    if info.static_type is not None:
+        return op_type(info.static_type)
+    if info.regs is not None:
+        return info.regs[1]
+    return op_var_type(info.get_stack_offset())
+
 # Assign from return registers to variable
 def assign(info: VarInfo) -> CODE:
-    return [ mov(op_var_val(info.get_stack_offset()), RVAL), mov(op_var_type(info.get_stack_offset()), RTYPE) ]
+    if info.static_type is None:
+        return [ mov(var_val_op(info), RVAL), mov(var_type_op(info), RTYPE) ]
+    return [ mov(var_val_op(info), RVAL) ]
 # Read variable content into return registers
-def read_var_at(stack_offset: int) -> CODE:
-    return [ mov(RVAL, op_var_val(stack_offset)), mov(RTYPE, op_var_type(stack_offset)) ]
+def read_var(name: Name) -> CODE:
+    info = unwrap(name.info)
+    ty = op_type(name.static_type) if name.static_type is not None else var_type_op(info)
+    return [ mov(RVAL, var_val_op(info)), mov(RTYPE, ty) ]
 # Load a `None` value into return registers
 def load_none() -> CODE:
     return [ mov(RVAL, Const(0)), mov(RTYPE, op_type(PrimType.NONE)) ]
@@ -81,8 +168,32 @@ def imm_op(imm: IMM_EXPR) -> MemOperand:
     assert isinstance(imm, IMM), 'Expected an immediate'
     return _imm_op(imm)
 
+# Operands to the value and type words of an immediate
+def imm_val_op(imm: IMM_EXPR) -> Operand:
+    assert isinstance(imm, IMM), 'Expected an immediate'
+    match imm:
+        case Name(info=info):
+            return var_val_op(unwrap(info))
+        case ImmConstLiteral(symbol=sym):
+            return MemRel(Symbol(sym))
+
+def imm_type_op(imm: IMM_EXPR) -> Operand:
+    assert isinstance(imm, IMM), 'Expected an immediate'
+    if imm.static_type is not None:
+        return op_type(imm.static_type)
+    match imm:
+        case Name(info=info):
+            return var_type_op(unwrap(info))
+        case ImmConstLiteral(symbol=sym):
+            return MemRel(Symbol(sym), offset=8)
+
 def imm2arg(imm: IMM_EXPR) -> ARG:
-    return AddrOf(imm_op(imm))
+    match imm:
+        case Name(info=VarInfo() as info) if info.regs is not None or info.static_type is not None:
+            # Not a complete object in memory
+            return Spill(var_val_op(info), var_type_op(info))
+        case _:
+            return AddrOf(imm_op(imm))
 
 def imms2args(imms: IMM_EXPRS) -> list[ARG]:
     return [imm2arg(imm) for imm in imms]
@@ -93,11 +204,56 @@ def load_into(reg: Reg, arg: ARG) -> AsmLine:
             return mov(reg, op)
         case AddrOf(op):
             return lea(reg, op)
+        case Spill(): # pragma: no cover
+            assert False, 'Spill arguments should be stored to scratch slots first'
+
+# Store `Spill` arguments to scratch slots and pass their addresses instead
+def spill_args(args: list[ARG]) -> tuple[CODE, list[ARG]]:
+    code: list[AsmLine] = []
+    resolved: list[ARG] = []
+    num_spilled = 0
+    for arg in args:
+        match arg:
+            case Spill(val=val, ty=ty):
+                slot = _state.scratch_slot(num_spilled)
+                num_spilled += 1
+                if isinstance(val, MemOperand): # No memory to memory moves
+                    code.append(mov(RSCRATCH, val))
+                    val = RSCRATCH
+                code += [ mov(op_var_val(slot), val), mov(op_var_type(slot), ty) ]
+                resolved.append(AddrOf(op_stack(slot, size=WordSize.NONE)))
+            case _:
+                resolved.append(arg)
+    return code, resolved
+
+# Pass each object as its value and type words for the register ABI
+def unpack_arg(arg: ARG) -> list[ARG]:
+    match arg:
+        case Spill(val=val, ty=ty):
+            return [ Direct(val), Direct(ty) ]
+        case AddrOf(mem_op=MemRegOffset() | MemRel() as mem_op):
+            val_op = replace(mem_op, size=WordSize.QWORD)
+            return [ Direct(val_op), Direct(replace(val_op, offset=val_op.offset + 8)) ]
+        case _:
+            return [ arg ]
 
 def call_runtime_func(sym_name: str, variadic: bool, args: list[ARG]) -> CODE:
+    # The location of the call is always the first argument
+    match args:
+        case [Direct(Const(lineno)), *_]:
+            counter = _state.count_call(lineno)
+        case _: # pragma: no cover
+            assert False, f'Call of {sym_name} without a location'
+    if _state.options.runtime_abi == RuntimeAbi.REG and sym_name in REGPASS:
+        sym_name += REGPASS_SUFFIX
+        args = [unpacked for arg in args for unpacked in unpack_arg(arg)]
+    _state.externs.add(sym_name)
+    spills, args = spill_args(args)
+    yield from spills
     code: CODE = [
         *(load_into(param_reg, arg) for param_reg, arg in zip(RPARAMS, args)),
         *([ mov(Reg.RAX, Const(0)) ] if variadic else []),
+        *counter,
         call(Symbol(sym_name)),
     ]
     if len(args) > len(RPARAMS):
@@ -105,10 +261,9 @@ def call_runtime_func(sym_name: str, variadic: bool, args: list[ARG]) -> CODE:
         pad = bool(len(extra_args) % 2)
         if pad:
             yield sub(Reg.RSP, Const(8))
-        yield from concat([
-            load_into(Reg.RAX, arg),
-            push(Reg.RAX)
-        ] for arg in extra_args[::-1])
+        for arg in reversed(extra_args):
+            yield load_into(Reg.RAX, arg)
+            yield push(Reg.RAX)
         yield from code
         yield add(Reg.RSP, (Const((len(extra_args) + pad) * 8)))
     else:
@@ -117,133 +272,309 @@ def call_runtime_func(sym_name: str, variadic: bool, args: list[ARG]) -> CODE:
 def extract_bool(lineno: int) -> CODE:
     assert RPARAMS[0] != RVAL
     assert RPARAMS[2] == RTYPE
-    return [mov(RPARAMS[0], Const(lineno)), mov(RPARAMS[1], RVAL), call(Symbol(EXTRACT_BOOL))]
+    _state.externs.add(EXTRACT_BOOL)
+    return [mov(RPARAMS[0], Const(lineno)), mov(RPARAMS[1], RVAL), *_state.count_call(lineno), call(Symbol(EXTRACT_BOOL))]
 
-def compile_if_common(test: CODE, body: CODE, orelse: CODE, lineno: int) -> CODE:
-    label_false = _state.new_label()
+# Integer operations with an inline fast path, the runtime function is only called
+# on a type tag mismatch or overflow (to panic with the usual message)
+INLINE_ARITH2 = {BinOp.ADD: add, BinOp.SUB: sub, BinOp.MUL: imul}
+INLINE_ARITH1 = {UnaryOp.ADD1: add, UnaryOp.SUB1: sub}
+
+def check_int(imm: IMM_EXPR, label_slow: str) -> CODE:
+    return [ cmp(imm_type_op(imm), op_type(PrimType.INT)), jne(Symbol(label_slow)) ]
+
+def compile_int_arith(instr: Callable[[Operand, Operand], Instruction], operands: list[IMM_EXPR],
+                      rhs: Operand, slow: CODE) -> CODE:
+    if any(imm.static_type not in {PrimType.INT, None} for imm in operands):
+        return slow # Always a type error
+    label_slow = _state.new_label()
     label_end = _state.new_label()
+    _state.add_cold([ Label(label_slow), *slow, jmp(Symbol(label_end)) ])
     return [
-        *test,
-        *extract_bool(lineno),
+        *(line for imm in operands if imm.static_type is None for line in check_int(imm, label_slow)),
+        mov(RVAL, imm_val_op(operands[0])),
+        instr(RVAL, rhs),
+        jo(Symbol(label_slow)),
+        mov(RTYPE, op_type(PrimType.INT)),
+        Label(label_end),
+    ]
+
+# Compile a condition into a 0/1 value in RVAL
+def compile_test(test: Expression, lineno: int) -> NESTED_CODE:
+    yield compile_expr(test)
+    if test.static_type != PrimType.BOOL:
+        yield from extract_bool(lineno)
+
+# Conditional jumps taken when an integer comparison holds, and when it does not
+COMPARE_JUMPS = {
+    BinOp.LT: (jl, jge),
+    BinOp.GT: (jg, jle),
+    BinOp.LE: (jle, jg),
+    BinOp.GE: (jge, jl),
+}
+
+def jump_on(truth: bool, jump_if: bool, target: str) -> CODE:
+    return [ jmp(Symbol(target)) ] if truth == jump_if else []
+
+def compare(lhs: Operand, rhs: Operand) -> CODE:
+    # cmp takes at most one memory operand and no immediate on the left
+    if isinstance(lhs, Reg) or (isinstance(lhs, MemOperand) and isinstance(rhs, Const)):
+        return [ cmp(lhs, rhs) ]
+    return [ mov(RVAL, lhs), cmp(RVAL, rhs) ]
+
+def is_anf_temp(name: Name, info: VarInfo) -> bool:
+    return name.info is info and info.origin_function_id == -1
+
+def compile_compare_branch(test: Prim2, target: str, jump_if: bool) -> CODE:
+    left, right = test.left, test.right
+    jump_true, jump_false = COMPARE_JUMPS[test.op]
+    fast = [ *compare(imm_val_op(left), imm_val_op(right)), (jump_true if jump_if else jump_false)(Symbol(target)) ]
+    # Both ints: no tag check, so the runtime comparison is never needed
+    if left.static_type is not None and right.static_type is not None:
+        return fast
+    label_slow = _state.new_label()
+    label_end = _state.new_label()
+    _state.add_cold([
+        Label(label_slow),
+        *call_runtime_func(test.op.symbol(), False, [Direct(Const(_state.lineno(test))), *imms2args([left, right])]),
         cmp(RVAL, Const(0)),
-        je(Symbol(label_false)),
-        *body,
+        (jne if jump_if else je)(Symbol(target)),
         jmp(Symbol(label_end)),
-        Label(label_false),
-        *orelse,
-        Label(label_end)
+    ])
+    return [
+        *(line for imm in (left, right) if imm.static_type is None for line in check_int(imm, label_slow)),
+        *fast,
+        Label(label_end),
     ]
 
+def compile_equal_branch(test: Prim2, target: str, jump_if: bool) -> CODE:
+    left, right = test.left, test.right
+    # Same representation (see is_identical in the runtime)
+    compare_val = compare(imm_val_op(left), imm_val_op(right))
+    if left.static_type is not None and right.static_type is not None:
+        if left.static_type != right.static_type:
+            return jump_on(False, jump_if, target)
+        return [ *compare_val, (je if jump_if else jne)(Symbol(target)) ]
+    compare_type = compare(imm_type_op(left), imm_type_op(right))
+    if not jump_if:
+        return [ *compare_val, jne(Symbol(target)), *compare_type, jne(Symbol(target)) ]
+    label_end = _state.new_label()
+    return [ *compare_val, jne(Symbol(label_end)), *compare_type, je(Symbol(target)), Label(label_end) ]
+
+# Jump to `target` if `test` evaluates to `jump_if`, fall through otherwise
+# Comparisons are fused with the jump instead of materializing a boolean object first
+def compile_branch(test: Expression, target: str, jump_if: bool, lineno: int) -> NESTED_CODE:
+    match test:
+        case ConstLiteral() if test.type() == PrimType.BOOL:
+            yield from jump_on(bool(test.val()), jump_if, target)
+        case Prim2(op=op, left=left, right=right) if op in COMPARE_JUMPS and \
+                all(imm.static_type in {PrimType.INT, None} for imm in (left, right)):
+            yield from compile_compare_branch(test, target, jump_if)
+        case Prim2(op=BinOp.EQ | BinOp.IS):
+            yield from compile_equal_branch(test, target, jump_if)
+        case Prim1(op=UnaryOp.NOT, ex1=inside) if inside.static_type == PrimType.BOOL:
+            yield from [ cmp(imm_val_op(inside), Const(0)), (je if jump_if else jne)(Symbol(target)) ]
+        case ExprScope(scope=Scope(statements=[*prefix, Binding(info=info, init_val=inner),
+                                               EvalExpr(expr=Prim1(op=UnaryOp.NOT, ex1=Name() as name))])) \
+                if inner.static_type == PrimType.BOOL and is_anf_temp(name, unwrap(info)):
+            # `not` of a condition, the temporary holding the condition is never read otherwise
+            for st in prefix:
+                yield compile_statement(st)
+            yield compile_branch(inner, target, not jump_if, lineno)
+        case ExprScope(scope=Scope(statements=[*prefix, EvalExpr(expr=last)])):
+            for st in prefix:
+                yield compile_statement(st)
+            yield compile_branch(last, target, jump_if, lineno)
+        case IfExpr(test=cond, body=body, orelse=orelse):
+            # Short-circuiting `and` / `or` have a constant branch
+            cond_lineno = _state.lineno(test)
+            label_end = _state.new_label()
+            if isinstance(orelse, ConstLiteral) and orelse.type() == PrimType.BOOL:
+                label_else = target if bool(orelse.val()) == jump_if else label_end
+                yield compile_branch(cond, label_else, False, cond_lineno)
+                yield compile_branch(body, target, jump_if, lineno)
+            elif isinstance(body, ConstLiteral) and body.type() == PrimType.BOOL:
+                label_then = target if bool(body.val()) == jump_if else label_end
+                yield compile_branch(cond, label_then, True, cond_lineno)
+                yield compile_branch(orelse, target, jump_if, lineno)
+            else:
+                label_else = _state.new_label()
+                yield compile_branch(cond, label_else, False, cond_lineno)
+                yield compile_branch(body, target, jump_if, lineno)
+                yield from [ jmp(Symbol(label_end)), Label(label_else) ]
+                yield compile_branch(orelse, target, jump_if, lineno)
+            yield Label(label_end)
+        case _:
+            yield compile_test(test, lineno)
+            yield from [ cmp(RVAL, Const(0)), (jne if jump_if else je)(Symbol(target)) ]
+
+def compile_if_common(test: Expression, body: NESTED_CODE, orelse: NESTED_CODE, lineno: int) -> NESTED_CODE:
+    label_false = _state.new_label()
+    label_end = _state.new_label()
+    yield compile_branch(test, label_false, False, lineno)
+    yield body
+    yield from [ jmp(Symbol(label_end)), Label(label_false) ]
+    yield orelse
+    yield Label(label_end)
+
 # Compile into return registers
-def compile_expr(ex: Expression) -> CODE:
+def compile_expr(ex: Expression) -> NESTED_CODE:
+    lineno = _state.lineno(ex)
     match ex:
         case Name():
-            return read_var_at(get_var_offset(ex))
+            yield from read_var(ex)
         case ConstLiteral():
-            return [ mov(RVAL, Const(ex.val())), mov(RTYPE, op_type(ex.type())) ]
+            yield from [ mov(RVAL, Const(ex.val())), mov(RTYPE, op_type(ex.type())) ]
         case StringLiteral(data_label=data_label):
-            return [ lea(RVAL, MemRel(Symbol(unwrap(data_label)), size=WordSize.NONE)), mov(RTYPE, op_type(PrimType.STRING)) ]
+            yield from [ lea(RVAL, MemRel(Symbol(unwrap(data_label)), size=WordSize.NONE)), mov(RTYPE, op_type(PrimType.STRING)) ]
         case GetType(ex=ex):
-            return [ *compile_expr(ex), mov(RVAL, RTYPE), mov(RTYPE, op_type(PrimType.TYPE)) ]
-        case Prim1(op=op, ex1=inside, span=SourceSpan(lineno=lineno)):
-            return call_runtime_func(op.symbol(), False, [Direct(Const(lineno)), imm2arg(inside)])
-        case Prim2(op=op, left=left, right=right, span=SourceSpan(lineno=lineno)):
-            return call_runtime_func(op.symbol(), False, [Direct(Const(lineno)), *imms2args([left, right])])
-        case Print(args=args, span=SourceSpan(lineno=lineno)):
-            return call_runtime_func(PRINT_VARARGS, True, [Direct(Const(lineno)), Direct(Const(len(args))), *imms2args(args)])
-        case Input(args=args, span=SourceSpan(lineno=lineno)):
-            return call_runtime_func(INPUT, False, [Direct(Const(lineno)), imm2arg(args[0]) if args else NULL_ARG])
-        case RuntimeCall(args=args, span=SourceSpan(lineno=lineno)):
-            return call_runtime_func(ex.func_name(), ex.is_variadic(), [Direct(Const(lineno)), *imms2args(args)])
+            yield compile_expr(ex)
+            yield from [ mov(RVAL, RTYPE), mov(RTYPE, op_type(PrimType.TYPE)) ]
+        case Prim1(op=op, ex1=inside):
+            slow = call_runtime_func(op.symbol(), False, [Direct(Const(lineno)), imm2arg(inside)])
+            if op in INLINE_ARITH1:
+                yield from compile_int_arith(INLINE_ARITH1[op], [inside], Const(1), slow)
+            elif op == UnaryOp.NOT and inside.static_type == PrimType.BOOL:
+                yield from [ mov(RVAL, imm_val_op(inside)), xor(RVAL, Const(1)), mov(RTYPE, op_type(PrimType.BOOL)) ]
+            else:
+                yield from slow
+        case Prim2(op=op, left=left, right=right):
+            slow = call_runtime_func(op.symbol(), False, [Direct(Const(lineno)), *imms2args([left, right])])
+            if op in INLINE_ARITH2:
+                yield from compile_int_arith(INLINE_ARITH2[op], [left, right], imm_val_op(right), slow)
+            else:
+                yield from slow
+        case Print(args=args):
+            yield from call_runtime_func(PRINT_VARARGS, True, [Direct(Const(lineno)), Direct(Const(len(args))), *imms2args(args)])
+        case Input(args=args):
+            yield from call_runtime_func(INPUT, False, [Direct(Const(lineno)), imm2arg(args[0]) if args else NULL_ARG])
+        case RuntimeCall(args=args):
+            yield from call_runtime_func(ex.func_name(), ex.is_variadic(), [Direct(Const(lineno)), *imms2args(args)])
         case ExprScope(scope=scope):
-            return compile_scope(scope)
-        case IfExpr(test=test, body=body, orelse=orelse, span=SourceSpan(lineno=lineno)):
-            return compile_if_common(
-                compile_expr(test),
-                compile_expr(body),
-                compile_expr(orelse),
-                lineno)
+            # Part of the statement that contains it, which was already counted
+            yield compile_scope(scope, count_lines=False)
+        case IfExpr(test=test, body=body, orelse=orelse):
+            yield compile_if_common(test, compile_expr(body), compile_expr(orelse), lineno)
         case _: # pragma: no cover
             assert False, f'Unhandled expression: {type(ex)}'
 
-def compile_while(stmt: While) -> CODE:
+def compile_while(stmt: While) -> NESTED_CODE:
     label_start = _state.new_label()
     label_cond = _state.new_label()
-    return [
-        jmp(Symbol(label_cond)),
-        Label(label_start),
-        *compile_scope(stmt.body),
-        Label(label_cond),
-        *compile_expr(stmt.test),
-        *extract_bool(stmt.span.lineno),
-        cmp(RVAL, Const(0)),
-        jne(Symbol(label_start)),
-    ]
+    yield from [ jmp(Symbol(label_cond)), Label(label_start) ]
+    yield compile_scope(stmt.body)
+    yield Label(label_cond)
+    yield from _state.mark_line(_state.lineno(stmt))
+    # Counted on every test of the condition
+    yield from _state.count_line(_state.lineno(stmt))
+    yield compile_branch(stmt.test, label_start, True, _state.lineno(stmt))
 
 # TODO: accept return label as second arg for compile_scope and compile_statement
-def compile_statement(st: Statement) -> CODE:
+def compile_statement(st: Statement) -> NESTED_CODE:
     match st:
         case EvalExpr(expr=ex):
-            yield from compile_expr(ex)
+            yield compile_expr(ex)
         case Assignment(info=info, src=src_expr):
-            yield from compile_expr(src_expr)
+            yield compile_expr(src_expr)
             yield from assign(unwrap(info))
         case Binding(info=info, init_val=src_expr):
-            yield from compile_expr(src_expr)
+            yield compile_expr(src_expr)
             yield from assign(unwrap(info))
         case NoOp():
             pass
         case NewScope(body=scope):
-            yield from compile_scope(scope)
-        case IfStmt(test=test, body=body, orelse=orelse, span=SourceSpan(lineno=lineno)):
-            yield from compile_if_common(
-                compile_expr(test),
-                compile_scope(body),
-                compile_scope(orelse),
-                lineno)
+            yield compile_scope(scope)
+        case IfStmt(test=test, body=body, orelse=orelse):
+            yield compile_if_common(test, compile_scope(body), compile_scope(orelse), _state.lineno(st))
         case While():
-            yield from compile_while(st)
+            yield compile_while(st)
         case _: # pragma: no cover
             assert False, f'Unhandled statement: {type(st)}'
 
-def compile_scope(scope: Scope) -> CODE:
+def compile_scope(scope: Scope, count_lines: bool = True) -> NESTED_CODE:
+    counted = None
     for st in scope.statements:
-        yield from compile_statement(st)
+        if not isinstance(st, (NoOp, NewScope)):
+            yield from _state.mark_line(_state.lineno(st))
+        # Once for consecutive statements of the same line
+        if count_lines and not isinstance(st, (NoOp, NewScope, While)) and _state.lineno(st) != counted:
+            counted = _state.lineno(st)
+            yield from _state.count_line(counted)
+        yield compile_statement(st)
 
-def compile_func(func: CompiledFunction) -> CODE:
-    stack_space = unwrap(func.stack_usage, 'Stack space not computed before compile')
-    return [
-        Label(func.symbol),
-        push(Reg.RBP),
-        mov(Reg.RBP, Reg.RSP),
-        sub(Reg.RSP, Const(stack_space)),
-        # TODO: pass return label as second arg, with None if compiling outside declaration where return is not allowed (should handle this in checker)
-        *compile_scope(func.body),
-        *load_none(), # 'return None' when slipping off the end of function
-        # TODO: allocate and insert a "function end" label here (generate label from a mutable state object) to allow returns
+# The code of the whole program is appended to a single buffer
+@dataclass
+class Emitter:
+    lines: list[AsmLine] = field(default_factory=list)
+
+    def emit(self, line: AsmLine):
+        self.lines.append(line)
+
+    def emit_all(self, lines: CODE):
+        self.lines.extend(lines)
+
+    def emit_nested(self, code: NESTED_CODE):
+        trampoline(code, self.lines.append)
+
+def compile_func(func: CompiledFunction, out: Emitter):
+    _state.frame_base = unwrap(func.stack_usage, 'Stack space not computed before compile')
+    _state.scratch_slots = 0
+    saved = func.saved_regs
+    # The prologue belongs to the first line of the body
+    first = next((st for st in func.body.statements if not isinstance(st, (NoOp, NewScope))), None)
+    if first is not None:
+        out.emit_all(_state.mark_line(_state.lineno(first)))
+    out.emit_all([ Label(func.symbol), push(Reg.RBP), mov(Reg.RBP, Reg.RSP), *(push(reg) for reg in saved) ])
+    # The scratch slots are only known after compiling the body
+    reserve = sub(Reg.RSP, Const(0))
+    out.emit(reserve)
+    # TODO: pass return label as second arg, with None if compiling outside declaration where return is not allowed (should handle this in checker)
+    out.emit_nested(compile_scope(func.body))
+    out.emit_all(load_none()) # 'return None' when slipping off the end of function
+    # TODO: allocate and insert a "function end" label here (generate label from a mutable state object) to allow returns
+    # Pushed callee-saved registers are included in the stack usage
+    stack_space = _state.frame_base + SIZE_UNTYPED * _state.scratch_slots - REG_SIZE * len(saved)
+    reserve.operands[1] = Const(stack_space)
+    out.emit_all([
         add(Reg.RSP, Const(stack_space)),
+        *(pop(reg) for reg in reversed(saved)),
         pop(Reg.RBP),
         ret(),
-    ]
+        *_state.take_cold(),
+    ])
 
-def compile_prog_iter(info: CompilerInfo, funcs: list[CompiledFunction]) -> CODE:
+def compile_prog(info: CompilerInfo, funcs: list[CompiledFunction]) -> list[AsmLine]:
     global _state
-    _state = CodegenState()
-    yield from [
+    _state = CodegenState(info.options, info.state.spans, src_path=info.src_path)
+    out = Emitter()
+    out.emit_all([
         global_(MAIN),
-        *(extern(op.symbol()) for op in UnaryOp),
-        *(extern(op.symbol()) for op in BinOp),
-        extern(EXTRACT_BOOL),
-        extern(PRINT_VARARGS),
-        extern(INPUT),
-        *(extern(sym) for sym in RUNTIME_SYMBOLS),
         section('.rodata'),
-        *info.state.string_pool.to_asm(),
         *info.state.const_pool.to_asm(),
+        *info.state.string_pool.to_asm(),
         section('.text'),
-    ]
-    for func in funcs:
-        yield from compile_func(func)
-
-def compile_prog(info: CompilerInfo, funcs: list[CompiledFunction]) -> List[AsmLine]:
-    return list(compile_prog_iter(info, funcs))
+    ])
+    # The emitted lines form no reference cycles, but the collector would keep rescanning them as the buffer grows
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for func in funcs:
+            compile_func(func, out)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    # After the global, once the calls are known
+    out.lines[1:1] = [ extern(sym) for sym in sorted(_state.externs) ]
+    if info.options.profile_lines:
+        lines = _state.last_counted_line + 1
+        out.emit_all([
+            global_(LINE_COUNTS_SIZE),
+            global_(LINE_COUNTS),
+            section('.rodata'),
+            Label(LINE_COUNTS_SIZE),
+            dq(Const(lines)),
+            section('.bss'),
+            Label(LINE_COUNTS),
+            resq(Const(lines * LINE_COUNT_SIZE // 8)),
+        ])
+    return out.lines
@@ -1,11 +1,13 @@
+from array import array
 from enum import Enum
-from functools import reduce
-from dataclasses import dataclass
-from typing import TYPE_CHECKING, Iterable, TextIO, TypeVar
+from dataclasses import dataclass, field
+from types import GeneratorType
+from typing import TYPE_CHECKING, Any, Callable, Generator, TextIO, TypeVar
 
 
 
 if TYPE_CHECKING:
+    import compy.asm
     import compy.state
     import compy.syntax
 
@@ -14,11 +16,56 @@ class UserError(Exception):
 
 ID = str
 
+# What is recorded about each pass of the compiler (--time-passes and related options)
+@dataclass
+class PassTimingOptions:
+    enabled: bool = False # Wall and CPU time, and size of the result
+    json_path: str | None = None # A JSON report is appended there, one line per compilation
+    trace_memory: bool = False # Peak memory with tracemalloc, which slows down the compiler
+    profile_dir: str | None = None # A cProfile dump of each pass is written there
+
 @dataclass
 class DebugFlags:
     pipeline: bool
     asm: bool # *.nasm
     obj: bool # *.o
+    peephole: bool = False # Hit count of each peephole rule
+    timing: PassTimingOptions = field(default_factory=PassTimingOptions)
+
+    def any(self) -> bool:
+        return self.pipeline or self.asm or self.obj or self.peephole or self.timing.enabled
+
+# How objects are passed to runtime functions
+class RuntimeAbi(Enum):
+    POINTER = 'pointer' # Address of the object in memory
+    REG = 'reg' # Value and type words in two registers, through the `*_r` wrappers
+
+# How the assembly is turned into an object file
+class AssemblerKind(Enum):
+    BUILTIN = 'builtin' # compy.encoder
+    NASM = 'nasm'
+    COMPARE = 'compare' # Use nasm, but fail if the built-in assembler disagrees with it
+
+# How the runtime linked into the executable is built (see runtime/Makefile)
+class RuntimeProfile(Enum):
+    DEBUG = 'debug'
+    RELEASE = 'release' # -O2
+    AMALGAMATION = 'amalgamation' # -O2 on all the runtime sources as one translation unit
+
+# How the executable is linked with the runtime and libc
+class LinkMode(Enum):
+    DYNAMIC = 'dynamic'
+    STATIC = 'static' # Without the dynamic loader, and only the runtime functions the program calls
+
+# Options affecting the generated code and how it is built
+@dataclass
+class CompileOptions:
+    runtime_abi: RuntimeAbi = RuntimeAbi.POINTER
+    assembler: AssemblerKind = AssemblerKind.BUILTIN
+    runtime_profile: RuntimeProfile = RuntimeProfile.DEBUG
+    profile_lines: bool = False # Count the executions of each line (see runtime/profile.c)
+    debug_info: bool = False # Map the code to the lines of the source (DWARF)
+    link: LinkMode = LinkMode.DYNAMIC
 
 @dataclass
 class CompilerInfo:
@@ -29,6 +76,7 @@ class CompilerInfo:
     stdout: TextIO
     stderr: TextIO
     state: 'compy.state.CompilerState'
+    options: CompileOptions = field(default_factory=CompileOptions)
 
     def print(self, msg: str = ''):
         print(msg, file=self.stdout)
@@ -44,6 +92,8 @@ class CompiledFunction:
     id: int
     stack_usage: int | None = None
     # id should originate from the function declaration node in the AST
+    # Callee-saved registers holding variables, saved in the prologue
+    saved_regs: list['compy.asm.Reg'] = field(default_factory=list)
 
 # TODO: make keyword lookup automatic by encoding both string and type code here
 # Instead of using keywords.py
@@ -57,7 +107,7 @@ class PrimType(Enum):
     def code(self) -> int:
         return self.value
 
-@dataclass
+@dataclass(slots=True)
 class SourceSpan:
     lineno: int
     end_lineno: int | None
@@ -67,37 +117,63 @@ class SourceSpan:
     def __repr__(self) -> str:
         return f'"{self.lineno}:{self.col_offset}-{self.end_lineno}:{self.end_col_offset}"'
 
+SpanId = int # Index into the SpanTable of the compilation
+
+NO_POSITION = -1 # Stands for None in the SpanTable
+
+# Source spans of all AST nodes, stored flat (4 integers each) instead of one object per node
+class SpanTable:
+    def __init__(self) -> None:
+        self.data = array('q')
+
+    def add(self, lineno: int, end_lineno: int | None, col_offset: int, end_col_offset: int | None) -> SpanId:
+        span = len(self.data) // 4
+        self.data.extend((lineno, NO_POSITION if end_lineno is None else end_lineno,
+                          col_offset, NO_POSITION if end_col_offset is None else end_col_offset))
+        return span
+
+    def lineno(self, span: SpanId) -> int:
+        return self.data[4 * span]
+
+    def __getitem__(self, span: SpanId) -> SourceSpan:
+        lineno, end_lineno, col_offset, end_col_offset = self.data[4 * span:4 * span + 4]
+        return SourceSpan(lineno, None if end_lineno == NO_POSITION else end_lineno,
+                          col_offset, None if end_col_offset == NO_POSITION else end_col_offset)
+
+    def __len__(self) -> int:
+        return len(self.data) // 4
+
 @dataclass
 class CompileError(UserError):
     msg: str
-    span: SourceSpan
+    span: SpanId
 
     def __post_init__(self):
         super().__init__('Aborted due to compile error')
 
 class IntegerOOB(CompileError):
-    def __init__(self, val: int, span: SourceSpan):
+    def __init__(self, val: int, span: SpanId):
         super().__init__(f'Integer constant {val} is out of bounds for type `int`', span)
 
 class UnboundVarError(CompileError):
-    def __init__(self, var: ID, span: SourceSpan):
+    def __init__(self, var: ID, span: SpanId):
         super().__init__(f"Unbound variable '{var}'", span)
 
 class ImmutableVarError(CompileError):
-    def __init__(self, var: ID, span: SourceSpan):
+    def __init__(self, var: ID, span: SpanId):
         super().__init__(f"Assignment to read-only variable (val or let) '{var}'", span)
 
 class FuncArgsError(CompileError):
-    def __init__(self, msg: str, span: SourceSpan):
+    def __init__(self, msg: str, span: SpanId):
         super().__init__(msg, span) 
 
 class MutableClosureVarError(CompileError):
-    def __init__(self, var: ID, span: SourceSpan):
+    def __init__(self, var: ID, span: SpanId):
         super().__init__(f"Variable defined outside closure must be immutable (val or let): '{var}' is mutable (var)", span)
 
 def report_error(info: CompilerInfo, code: str, ce: CompileError): # pragma: no cover
     lines = code.splitlines()
-    span = ce.span
+    span = info.state.spans[ce.span]
     error = info.error
     error(f'{info.src_path}:{span.lineno}:{span.col_offset + 1}: {ce.msg}')
     if span.lineno == span.end_lineno:
@@ -111,9 +187,6 @@ def report_error(info: CompilerInfo, code: str, ce: CompileError): # pragma: no
         error('<Multiline error>')
 
 T = TypeVar('T')
-def concat(tss: Iterable[list[T]]) -> list[T]:
-    emp: list[T] = []
-    return reduce(lambda x, y: x + y, tss, emp)
 
 O = TypeVar('O')
 def unwrap(i: O | None, msg: str | None = None) -> O:
@@ -123,4 +196,28 @@ def unwrap(i: O | None, msg: str | None = None) -> O:
         assert i is not None, msg
     return i
 
+# A recursive computation written as a generator: instead of calling itself, it yields
+# the generators of its recursive calls and receives their results, so that trampoline()
+# can run arbitrarily deep recursions on an explicit stack instead of the Python call stack.
+# Anything else it yields is passed to `emit` (Ex. the instructions of codegen).
+Walk = Generator[Any, Any, T]
+
+def trampoline(walk: Walk[T], emit: Callable[[Any], None] | None = None) -> T:
+    stack: list[Walk[Any]] = [walk]
+    result: Any = None
+    while stack:
+        try:
+            item = stack[-1].send(result)
+        except StopIteration as stop:
+            stack.pop()
+            result = stop.value
+            continue
+        result = None
+        if isinstance(item, GeneratorType):
+            stack.append(item)
+        else:
+            assert emit is not None, f'Unexpected value from a walk: {item}'
+            emit(item)
+    return result
+
 MAIN = 'compy_main'
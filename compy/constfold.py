@@ -0,0 +1,146 @@
+# Constant folding and propagation over the ANF AST
+# Operations that would panic at runtime (overflow, division by zero, type errors) are left unfolded
+# so that the panic still happens at the right line
+
+from dataclasses import dataclass, field
+import operator
+from typing import Callable
+
+from compy.checker import MAX_INT, MIN_INT
+from compy.common import CompiledFunction, PrimType, Walk, trampoline, unwrap
+from compy.constpool import CR, to_literal
+from compy.state import CompilerState
+from compy.syntax import (Binding, BinOp, ConstLiteral, EvalExpr, ExprScope, GetType, IfExpr,
+                          IfStmt, ImmConstLiteral, Name, NewScope, Node, NoOp, Prim1, Prim2, Scope,
+                          UnaryOp, While)
+
+def fold(comp_state: CompilerState, funcs: list[CompiledFunction]):
+    for func in funcs:
+        trampoline(ConstantFolder(comp_state).visit(func.body))
+
+# Division and remainder truncate toward zero like in C
+def c_div(x: int, y: int) -> int:
+    q = abs(x) // abs(y)
+    return q if (x < 0) == (y < 0) else -q
+
+def c_mod(x: int, y: int) -> int:
+    return x - y * c_div(x, y)
+
+ARITH_OPS: dict[BinOp, Callable[[int, int], int]] = {
+    BinOp.ADD: operator.add,
+    BinOp.SUB: operator.sub,
+    BinOp.MUL: operator.mul,
+    BinOp.DIV: c_div,
+    BinOp.MOD: c_mod,
+}
+CMP_OPS: dict[BinOp, Callable[[int, int], bool]] = {
+    BinOp.LT: operator.lt,
+    BinOp.GT: operator.gt,
+    BinOp.LE: operator.le,
+    BinOp.GE: operator.ge,
+}
+LOGIC_OPS: dict[BinOp, Callable[[int, int], bool]] = {
+    BinOp.AND: lambda x, y: bool(x and y),
+    BinOp.OR: lambda x, y: bool(x or y),
+}
+ARITH_UNARY_OPS: dict[UnaryOp, Callable[[int], int]] = {
+    UnaryOp.NEGATE: operator.neg,
+    UnaryOp.ADD1: lambda x: x + 1,
+    UnaryOp.SUB1: lambda x: x - 1,
+}
+
+def int_result(value: int) -> CR | None:
+    return (PrimType.INT, value) if MIN_INT <= value <= MAX_INT else None
+
+def bool_result(value: bool) -> CR:
+    return (PrimType.BOOL, int(value))
+
+def fold_prim1(op: UnaryOp, x: CR) -> CR | None:
+    match x:
+        case (PrimType.INT, v) if op in ARITH_UNARY_OPS:
+            return int_result(ARITH_UNARY_OPS[op](v))
+        case (PrimType.BOOL, v) if op == UnaryOp.NOT:
+            return bool_result(not v)
+        case _:
+            return None
+
+def fold_prim2(op: BinOp, x: CR, y: CR) -> CR | None:
+    match x, y:
+        case _ if op in {BinOp.IS, BinOp.EQ}:
+            # Same representation (see is_identical in the runtime)
+            return bool_result(x == y)
+        case (PrimType.INT, lv), (PrimType.INT, rv) if op in ARITH_OPS:
+            if op in {BinOp.DIV, BinOp.MOD} and rv == 0:
+                return None
+            return int_result(ARITH_OPS[op](lv, rv))
+        case (PrimType.INT, lv), (PrimType.INT, rv) if op in CMP_OPS:
+            return bool_result(CMP_OPS[op](lv, rv))
+        case (PrimType.BOOL, lv), (PrimType.BOOL, rv) if op in LOGIC_OPS:
+            return bool_result(LOGIC_OPS[op](lv, rv))
+        case _:
+            return None
+
+@dataclass
+class ConstantFolder:
+    comp_state: CompilerState
+    # Immutable variables bound to constants (by var_id)
+    consts: dict[int, CR] = field(default_factory=dict)
+
+    def const_of(self, ex: Node) -> CR | None:
+        match ex:
+            case ConstLiteral():
+                return (ex.type(), ex.val())
+            case ImmConstLiteral():
+                return self.comp_state.const_pool.lookup(ex)
+            case _:
+                return None
+
+    def visit(self, node: Node) -> Walk[Node]:
+        def process(cnode: Node, need_imm: bool) -> Walk[Node]:
+            cnode = yield self.visit(cnode)
+            if need_imm and isinstance(cnode, ConstLiteral):
+                return self.comp_state.const_pool.pool(cnode)
+            return cnode
+        yield from node.rewrite_children(process)
+        if isinstance(node, Scope):
+            # Drop bindings propagated into their uses
+            node.statements = [stmt for stmt in node.statements if not isinstance(stmt, NoOp)]
+        return self.fold(node)
+
+    def fold(self, node: Node) -> Node:
+        match node:
+            case Name(info=info) if unwrap(info).var_id in self.consts:
+                return to_literal(node.span, self.consts[unwrap(info).var_id])
+            case Binding(mutable=False, info=info, init_val=init) if (value := self.const_of(init)) is not None:
+                self.consts[unwrap(info).var_id] = value
+                return NoOp(span=node.span)
+            case Prim1(op=op, ex1=ex1) if (x := self.const_of(ex1)) is not None:
+                if (result := fold_prim1(op, x)) is not None:
+                    return to_literal(node.span, result)
+            case Prim2(op=op, left=left, right=right) if (x := self.const_of(left)) is not None:
+                if (y := self.const_of(right)) is not None and (result := fold_prim2(op, x, y)) is not None:
+                    return to_literal(node.span, result)
+            case GetType(ex=ex):
+                if (x := self.const_of(ex)) is not None:
+                    return to_literal(node.span, (PrimType.TYPE, x[0].code()))
+                if isinstance(ex, Name) and ex.static_type is not None: # Reading a variable has no side effects
+                    return to_literal(node.span, (PrimType.TYPE, ex.static_type.code()))
+            case IfExpr(test=test, body=body, orelse=orelse):
+                match self.const_of(test):
+                    case (PrimType.BOOL, v):
+                        return body if v else orelse
+                    case _:
+                        pass
+            case IfStmt(test=test, body=body, orelse=orelse):
+                match self.const_of(test):
+                    case (PrimType.BOOL, v):
+                        return NewScope(span=node.span, body=body if v else orelse)
+                    case _:
+                        pass
+            case While(test=test) if self.const_of(test) == (PrimType.BOOL, 0):
+                return NoOp(span=node.span)
+            case ExprScope(scope=Scope(statements=[EvalExpr(expr=last)])):
+                return last # Nothing left to bind
+            case _:
+                pass
+        return node
@@ -1,9 +1,9 @@
 from dataclasses import dataclass, field
 from typing import Iterable
 from compy.asm import AsmLine, Const, Label, dq
-from compy.common import PrimType
+from compy.common import PrimType, SpanId
 
-from compy.syntax import ConstLiteral, ImmConstLiteral
+from compy.syntax import Boolean, ConstLiteral, ImmConstLiteral, Integer, TypeLiteral, Unit
 
 
 CR = tuple[PrimType, int] # Constant record
@@ -11,6 +11,7 @@ CR = tuple[PrimType, int] # Constant record
 @dataclass
 class ConstPool:
     symbols: dict[CR, str] = field(default_factory=dict)
+    records: dict[str, CR] = field(default_factory=dict) # Reverse of `symbols`
     const_num: int = 0
 
     def gen_symbol(self) -> str:
@@ -21,11 +22,32 @@ class ConstPool:
         record = (literal.type(), literal.val())
         if record not in self.symbols:
             self.symbols[record] = self.gen_symbol()
-        return ImmConstLiteral(span=literal.span, symbol=self.symbols[record])
+            self.records[self.symbols[record]] = record
+        return ImmConstLiteral(span=literal.span, symbol=self.symbols[record], static_type=literal.type())
     
+    def lookup(self, imm: ImmConstLiteral) -> CR:
+        return self.records[imm.symbol]
+
     # Put in in some .rodata section
     def to_asm(self) -> Iterable[AsmLine]:
         for (ty, val), symbol in self.symbols.items():
             yield Label(symbol)
             yield dq(Const(val))
             yield dq(Const(ty.code()))
+
+# Inverse of pooling
+def to_literal(span: SpanId, record: CR) -> ConstLiteral:
+    ty, val = record
+    match ty:
+        case PrimType.INT:
+            literal = Integer(span, val)
+        case PrimType.BOOL:
+            literal = Boolean(span, bool(val))
+        case PrimType.TYPE:
+            literal = TypeLiteral(span, PrimType(val))
+        case PrimType.NONE:
+            literal = Unit(span)
+        case PrimType.STRING: # pragma: no cover
+            assert False, 'Strings are not pooled as constants'
+    literal.static_type = ty
+    return literal
@@ -0,0 +1,132 @@
+# Minimal DWARF 4 debug info for the built-in assembler (--debug-info):
+# one compile unit covering .text, with a line table mapping addresses to source lines
+
+import os
+import struct
+
+from compy.elf import R_X86_64_32, R_X86_64_64, Relocation, Section
+
+DW_TAG_compile_unit = 0x11
+DW_CHILDREN_no = 0
+DW_AT_name = 0x03
+DW_AT_stmt_list = 0x10
+DW_AT_low_pc = 0x11
+DW_AT_high_pc = 0x12
+DW_AT_language = 0x13
+DW_AT_comp_dir = 0x1b
+DW_AT_producer = 0x25
+DW_FORM_addr = 0x01
+DW_FORM_data2 = 0x05
+DW_FORM_data8 = 0x07
+DW_FORM_string = 0x08
+DW_FORM_sec_offset = 0x17
+DW_LANG_Mips_Assembler = 0x8001 # What nasm reports too
+
+DW_LNS_copy = 1
+DW_LNS_advance_pc = 2
+DW_LNS_advance_line = 3
+DW_LNE_end_sequence = 1
+DW_LNE_set_address = 2
+
+VERSION = 4
+ADDRESS_SIZE = 8
+# Parameters of the special opcodes of the line program
+LINE_BASE = -5
+LINE_RANGE = 14
+OPCODE_BASE = 13
+STANDARD_OPCODE_LENGTHS = bytes([0, 1, 1, 1, 1, 0, 0, 0, 1, 0, 0, 1])
+
+PRODUCER = 'compy'
+
+def uleb128(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def sleb128(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if (value == 0 and not byte & 0x40) or (value == -1 and byte & 0x40):
+            out.append(byte)
+            return bytes(out)
+        out.append(byte | 0x80)
+
+def cstring(text: str) -> bytes:
+    return text.encode() + b'\0'
+
+# With the length of the unit before it
+def unit(body: bytes) -> bytes:
+    return struct.pack('<I', len(body)) + body
+
+def abbrev_section() -> Section:
+    attributes = [
+        (DW_AT_name, DW_FORM_string),
+        (DW_AT_comp_dir, DW_FORM_string),
+        (DW_AT_producer, DW_FORM_string),
+        (DW_AT_language, DW_FORM_data2),
+        (DW_AT_low_pc, DW_FORM_addr),
+        (DW_AT_high_pc, DW_FORM_data8), # The size of the code
+        (DW_AT_stmt_list, DW_FORM_sec_offset),
+    ]
+    data = uleb128(1) + uleb128(DW_TAG_compile_unit) + bytes([DW_CHILDREN_no])
+    data += b''.join(uleb128(name) + uleb128(form) for name, form in attributes)
+    data += bytes(2) + bytes(1) # End of the attributes, then of the abbreviations
+    return Section('.debug_abbrev', data, align=1)
+
+def info_section(path: str, text_size: int) -> Section:
+    # After unit_length, version, debug_abbrev_offset and address_size
+    header_size = 4 + 2 + 4 + 1
+    die = uleb128(1) + cstring(path) + cstring(os.getcwd()) + cstring(PRODUCER) + struct.pack('<H', DW_LANG_Mips_Assembler)
+    low_pc = header_size + len(die)
+    die += bytes(ADDRESS_SIZE) + struct.pack('<Q', text_size)
+    stmt_list = header_size + len(die)
+    die += bytes(4)
+    data = unit(struct.pack('<HIB', VERSION, 0, ADDRESS_SIZE) + die)
+    return Section('.debug_info', data, align=1, relocations=[
+        Relocation(4 + 2, '.debug_abbrev', R_X86_64_32, 0),
+        Relocation(low_pc, '.text', R_X86_64_64, 0),
+        Relocation(stmt_list, '.debug_line', R_X86_64_32, 0),
+    ])
+
+# `rows` are (offset in .text, line), in the order of the offsets
+def line_program(rows: list[tuple[int, int]], text_size: int) -> bytes:
+    program = bytearray()
+    address, line = 0, 1
+    for offset, lineno in rows:
+        address_delta, line_delta = offset - address, lineno - line
+        opcode = (line_delta - LINE_BASE) + LINE_RANGE * address_delta + OPCODE_BASE
+        if LINE_BASE <= line_delta < LINE_BASE + LINE_RANGE and opcode <= 0xff:
+            program.append(opcode)
+        else:
+            if address_delta:
+                program += bytes([DW_LNS_advance_pc]) + uleb128(address_delta)
+            if line_delta:
+                program += bytes([DW_LNS_advance_line]) + sleb128(line_delta)
+            program.append(DW_LNS_copy)
+        address, line = offset, lineno
+    program += bytes([DW_LNS_advance_pc]) + uleb128(text_size - address)
+    program += bytes([0]) + uleb128(1) + bytes([DW_LNE_end_sequence])
+    return bytes(program)
+
+def line_section(path: str, rows: list[tuple[int, int]], text_size: int) -> Section:
+    directory, name = os.path.split(os.path.abspath(path))
+    header = struct.pack('<BBBbBB', 1, 1, 1, LINE_BASE, LINE_RANGE, OPCODE_BASE) + STANDARD_OPCODE_LENGTHS
+    header += cstring(directory) + b'\0' # Include directories
+    header += cstring(name) + uleb128(1) + uleb128(0) + uleb128(0) + b'\0' # Files (in the first directory)
+    set_address = bytes([0]) + uleb128(1 + ADDRESS_SIZE) + bytes([DW_LNE_set_address])
+    body = struct.pack('<H', VERSION) + unit(header) + set_address
+    # After unit_length and the body so far
+    address = 4 + len(body)
+    body += bytes(ADDRESS_SIZE) + line_program(rows, text_size)
+    return Section('.debug_line', unit(body), align=1, relocations=[Relocation(address, '.text', R_X86_64_64, 0)])
+
+def debug_sections(path: str, rows: list[tuple[int, int]], text_size: int) -> list[Section]:
+    return [abbrev_section(), info_section(path, text_size), line_section(path, rows, text_size)]
@@ -0,0 +1,199 @@
+# Minimal reader and writer of ELF64 relocatable objects (x86-64 only)
+
+from dataclasses import dataclass, field
+import struct
+
+ELF_HEADER = struct.Struct('<16sHHIQQQIHHHHHH')
+SECTION_HEADER = struct.Struct('<IIQQQQIIQQ')
+SYMBOL = struct.Struct('<IBBHQQ')
+RELA = struct.Struct('<QQq')
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+EV_CURRENT = 1
+ET_REL = 1
+EM_X86_64 = 62
+
+SHT_NULL = 0
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_RELA = 4
+SHT_NOBITS = 8
+
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHF_INFO_LINK = 0x40
+
+SHN_UNDEF = 0
+
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STT_NOTYPE = 0
+STT_SECTION = 3
+
+R_X86_64_64 = 1
+R_X86_64_PC32 = 2
+R_X86_64_PLT32 = 4
+R_X86_64_32 = 10
+
+# Flags of the sections the assembler can emit
+SECTION_FLAGS = {
+    '.text': SHF_ALLOC | SHF_EXECINSTR,
+    '.rodata': SHF_ALLOC,
+    '.data': SHF_ALLOC | SHF_WRITE,
+    '.bss': SHF_ALLOC | SHF_WRITE,
+    # Not loaded, see compy/dwarf.py
+    '.debug_abbrev': 0,
+    '.debug_info': 0,
+    '.debug_line': 0,
+}
+
+@dataclass
+class Relocation:
+    offset: int
+    symbol: str # A symbol name, or a section name for section symbols
+    type: int
+    addend: int
+
+@dataclass
+class Section:
+    name: str
+    data: bytes = b''
+    size: int = 0 # Only used by .bss (no data in the file)
+    align: int = 16
+    relocations: list[Relocation] = field(default_factory=list)
+
+    def nobits(self) -> bool:
+        return self.name == '.bss'
+
+@dataclass
+class Symbol:
+    name: str
+    section: str | None # None if undefined
+    value: int = 0
+    is_global: bool = False
+
+@dataclass
+class ElfObject:
+    sections: list[Section] = field(default_factory=list)
+    symbols: list[Symbol] = field(default_factory=list)
+
+    def section(self, name: str) -> Section | None:
+        return next((sec for sec in self.sections if sec.name == name), None)
+
+class StringTable:
+    def __init__(self) -> None:
+        self.data = bytearray(b'\0')
+        self.offsets: dict[str, int] = {'': 0}
+
+    def add(self, name: str) -> int:
+        if name not in self.offsets:
+            self.offsets[name] = len(self.data)
+            self.data += name.encode() + b'\0'
+        return self.offsets[name]
+
+def align_to(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+def write_elf(obj: ElfObject) -> bytes:
+    shstrtab = StringTable()
+    strtab = StringTable()
+    # (name, type, flags, data, size, link, info, align, entsize)
+    headers: list[tuple[str, int, int, bytes, int, int, int, int, int]] = []
+
+    section_index = {sec.name: i + 1 for i, sec in enumerate(obj.sections)}
+    for sec in obj.sections:
+        sh_type = SHT_NOBITS if sec.nobits() else SHT_PROGBITS
+        headers.append((sec.name, sh_type, SECTION_FLAGS.get(sec.name, SHF_ALLOC), sec.data, sec.size or len(sec.data), 0, 0, sec.align, 0))
+    # The stack does not need to be executable
+    headers.append(('.note.GNU-stack', SHT_PROGBITS, 0, b'', 0, 0, 0, 1, 0))
+
+    # Locals must come before globals
+    symtab = bytearray(SYMBOL.size)
+    symbol_index: dict[str, int] = {}
+    for sec in obj.sections:
+        symbol_index[sec.name] = len(symtab) // SYMBOL.size
+        symtab += SYMBOL.pack(0, STB_LOCAL << 4 | STT_SECTION, 0, section_index[sec.name], 0, 0)
+    ordered = [sym for sym in obj.symbols if not sym.is_global] + [sym for sym in obj.symbols if sym.is_global]
+    first_global = len(symtab) // SYMBOL.size + sum(not sym.is_global for sym in obj.symbols)
+    for sym in ordered:
+        symbol_index[sym.name] = len(symtab) // SYMBOL.size
+        bind = STB_GLOBAL if sym.is_global else STB_LOCAL
+        shndx = section_index[sym.section] if sym.section is not None else SHN_UNDEF
+        symtab += SYMBOL.pack(strtab.add(sym.name), bind << 4 | STT_NOTYPE, 0, shndx, sym.value, 0)
+
+    symtab_index = len(obj.sections) + 2 + sum(bool(sec.relocations) for sec in obj.sections)
+    for sec in obj.sections:
+        if sec.relocations:
+            rela = b''.join(RELA.pack(rel.offset, symbol_index[rel.symbol] << 32 | rel.type, rel.addend)
+                            for rel in sec.relocations)
+            headers.append(('.rela' + sec.name, SHT_RELA, SHF_INFO_LINK, rela, len(rela),
+                            symtab_index, section_index[sec.name], 8, RELA.size))
+    headers.append(('.symtab', SHT_SYMTAB, 0, bytes(symtab), len(symtab), symtab_index + 1, first_global, 8, SYMBOL.size))
+    headers.append(('.strtab', SHT_STRTAB, 0, bytes(strtab.data), len(strtab.data), 0, 0, 1, 0))
+    for name, *_ in headers:
+        shstrtab.add(name)
+    shstrtab.add('.shstrtab')
+    headers.append(('.shstrtab', SHT_STRTAB, 0, bytes(shstrtab.data), len(shstrtab.data), 0, 0, 1, 0))
+
+    body = bytearray()
+    offsets: list[int] = []
+    for _, sh_type, _, data, _, _, _, align, _ in headers:
+        if sh_type != SHT_NOBITS:
+            body += bytes(align_to(ELF_HEADER.size + len(body), align) - ELF_HEADER.size - len(body))
+        offsets.append(ELF_HEADER.size + len(body))
+        if sh_type != SHT_NOBITS:
+            body += data
+    shoff = align_to(ELF_HEADER.size + len(body), 8)
+    body += bytes(shoff - ELF_HEADER.size - len(body))
+
+    section_headers = bytearray(SECTION_HEADER.size) # Null section
+    for (name, sh_type, flags, _, size, link, info, align, entsize), offset in zip(headers, offsets):
+        section_headers += SECTION_HEADER.pack(shstrtab.add(name), sh_type, flags, 0, offset, size, link, info, align, entsize)
+
+    ident = ELF_MAGIC + bytes([ELFCLASS64, ELFDATA2LSB, EV_CURRENT]) + bytes(9)
+    header = ELF_HEADER.pack(ident, ET_REL, EM_X86_64, EV_CURRENT, 0, 0, shoff, 0,
+                             ELF_HEADER.size, 0, 0, SECTION_HEADER.size, len(headers) + 1, len(headers))
+    return header + bytes(body) + bytes(section_headers)
+
+def read_elf(data: bytes) -> ElfObject:
+    (ident, _, machine, _, _, _, shoff, _, _, _, _, _, shnum, shstrndx) = ELF_HEADER.unpack_from(data)
+    assert ident[:4] == ELF_MAGIC and machine == EM_X86_64, 'Not an x86-64 ELF object'
+    raw = [SECTION_HEADER.unpack_from(data, shoff + i * SECTION_HEADER.size) for i in range(shnum)]
+    def contents(i: int) -> bytes:
+        _, sh_type, _, _, offset, size, *_ = raw[i]
+        return b'' if sh_type == SHT_NOBITS else data[offset:offset + size]
+    def string(table: bytes, offset: int) -> str:
+        return table[offset:table.index(b'\0', offset)].decode()
+    names = [string(contents(shstrndx), header[0]) for header in raw]
+
+    obj = ElfObject()
+    sections: dict[int, Section] = {}
+    for i, (_, sh_type, _, _, _, size, _, _, align, _) in enumerate(raw):
+        if sh_type in {SHT_PROGBITS, SHT_NOBITS} and names[i] in SECTION_FLAGS:
+            sections[i] = Section(names[i], contents(i), size if sh_type == SHT_NOBITS else 0, align)
+            obj.sections.append(sections[i])
+
+    symbol_names: list[str] = []
+    for i, (_, sh_type, _, _, _, _, link, _, _, entsize) in enumerate(raw):
+        if sh_type == SHT_SYMTAB:
+            table = contents(i)
+            for j in range(len(table) // entsize):
+                name, info, _, shndx, value, _ = SYMBOL.unpack_from(table, j * entsize)
+                if info & 0xf == STT_SECTION:
+                    symbol_names.append(names[shndx])
+                    continue
+                symbol_names.append(string(contents(link), name))
+                if j and info & 0xf == STT_NOTYPE:
+                    section = sections[shndx].name if shndx in sections else None
+                    obj.symbols.append(Symbol(symbol_names[-1], section, value, info >> 4 == STB_GLOBAL))
+    for i, (_, sh_type, _, _, _, _, _, info, _, entsize) in enumerate(raw):
+        if sh_type == SHT_RELA and info in sections:
+            table = contents(i)
+            for j in range(len(table) // entsize):
+                offset, rel_info, addend = RELA.unpack_from(table, j * entsize)
+                sections[info].relocations.append(Relocation(offset, symbol_names[rel_info >> 32], rel_info & 0xffffffff, addend))
+    return obj
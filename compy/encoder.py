@@ -0,0 +1,316 @@
+# Built-in assembler: encodes the instruction subset of compy.asm into an ELF64 relocatable object
+
+from dataclasses import dataclass, field
+import struct
+
+from compy.asm import (AsmLine, Const, Directive, Instruction, Label, LineMarker, MemOperand, MemRegOffset, MemRel,
+                       Operand, Reg, Symbol)
+from compy.dwarf import debug_sections
+from compy.elf import R_X86_64_PC32, R_X86_64_PLT32, ElfObject, Relocation, Section
+from compy.elf import Symbol as ElfSymbol
+
+REG_CODES = {
+    Reg.RAX: 0, Reg.RCX: 1, Reg.RDX: 2, Reg.RBX: 3, Reg.RSP: 4, Reg.RBP: 5, Reg.RSI: 6, Reg.RDI: 7,
+    Reg.R8: 8, Reg.R9: 9, Reg.R10: 10, Reg.R11: 11, Reg.R12: 12, Reg.R13: 13, Reg.R14: 14, Reg.R15: 15,
+}
+
+# Opcodes of arithmetic instructions: (r/m <- reg, reg <- r/m, RAX <- imm32, ModRM extension for immediates)
+ALU_OPCODES = {
+    'add': (0x01, 0x03, 0x05, 0),
+    'sub': (0x29, 0x2b, 0x2d, 5),
+    'xor': (0x31, 0x33, 0x35, 6),
+    'cmp': (0x39, 0x3b, 0x3d, 7),
+}
+# Condition codes of conditional jumps
+JCC_CODES = {'jo': 0x0, 'je': 0x4, 'jne': 0x5, 'jl': 0xc, 'jge': 0xd, 'jle': 0xe, 'jg': 0xf}
+
+def fits_i8(value: int) -> bool:
+    return -0x80 <= value < 0x80
+
+def fits_i32(value: int) -> bool:
+    return -0x8000_0000 <= value < 0x8000_0000
+
+def imm8(value: int) -> bytes:
+    return struct.pack('<b', value)
+
+def imm32(value: int) -> bytes:
+    return struct.pack('<i', value)
+
+# A 32-bit PC-relative reference to a symbol, resolved at layout or by the linker
+@dataclass
+class Fixup:
+    pos: int # Offset of the 32-bit field in the instruction
+    symbol: str
+    addend: int
+    call: bool = False
+
+@dataclass
+class Encoded:
+    code: bytes
+    fixups: list[Fixup] = field(default_factory=list)
+
+def rex(w: bool, r: int, x: int, b: int) -> bytes:
+    bits = (w << 3) | ((r >> 3) << 2) | ((x >> 3) << 1) | (b >> 3)
+    return bytes([0x40 | bits]) if bits else b''
+
+# Instruction with a ModRM operand: `reg` is a register code or an opcode extension
+def encode_rm(opcode: bytes, reg: int, rm: Operand, imm: bytes = b'', *, w: bool = True) -> Encoded:
+    match rm:
+        case Reg():
+            code = REG_CODES[rm]
+            return Encoded(rex(w, reg, 0, code) + opcode + bytes([0xc0 | (reg & 7) << 3 | code & 7]) + imm)
+        case MemRegOffset(reg=base, offset=offset):
+            code = REG_CODES[base]
+            sib = b'\x24' if code & 7 == 4 else b'' # RSP/R12 base needs a SIB byte
+            if offset == 0 and code & 7 != 5: # RBP/R13 base always needs a displacement
+                mod, disp = 0, b''
+            elif fits_i8(offset):
+                mod, disp = 1, imm8(offset)
+            else:
+                mod, disp = 2, imm32(offset)
+            modrm = bytes([mod << 6 | (reg & 7) << 3 | code & 7])
+            return Encoded(rex(w, reg, 0, code) + opcode + modrm + sib + disp + imm)
+        case MemRel(sym=Symbol(name), offset=offset):
+            prefix = rex(w, reg, 0, 0) + opcode + bytes([(reg & 7) << 3 | 5]) # RIP-relative
+            # The displacement is relative to the end of the instruction
+            return Encoded(prefix + bytes(4) + imm, [Fixup(len(prefix), name, offset - 4 - len(imm))])
+        case _: # pragma: no cover
+            assert False, f'Cannot encode operand {rm}'
+
+def encode_alu(mnemonic: str, dst: Operand, src: Operand) -> Encoded:
+    rm_reg, reg_rm, acc_imm, ext = ALU_OPCODES[mnemonic]
+    match dst, src:
+        case _, Reg():
+            return encode_rm(bytes([rm_reg]), REG_CODES[src], dst)
+        case Reg(), MemOperand():
+            return encode_rm(bytes([reg_rm]), REG_CODES[dst], src)
+        case _, Const(value) if fits_i8(value):
+            return encode_rm(b'\x83', ext, dst, imm8(value))
+        case Reg.RAX, Const(value) if fits_i32(value):
+            return Encoded(rex(True, 0, 0, 0) + bytes([acc_imm]) + imm32(value))
+        case _, Const(value) if fits_i32(value):
+            return encode_rm(b'\x81', ext, dst, imm32(value))
+        case _: # pragma: no cover
+            assert False, f'Cannot encode {mnemonic} {dst}, {src}'
+
+def encode_mov(dst: Operand, src: Operand) -> Encoded:
+    match dst, src:
+        case _, Reg():
+            return encode_rm(b'\x89', REG_CODES[src], dst)
+        case Reg(), MemOperand():
+            return encode_rm(b'\x8b', REG_CODES[dst], src)
+        case Reg(), Const(value) if 0 <= value <= 0xffff_ffff:
+            # Writing the lower half zero extends, like nasm's optimization
+            code = REG_CODES[dst]
+            return Encoded(rex(False, 0, 0, code) + bytes([0xb8 | code & 7]) + struct.pack('<I', value))
+        case _, Const(value) if fits_i32(value):
+            return encode_rm(b'\xc7', 0, dst, imm32(value))
+        case Reg(), Const(value):
+            code = REG_CODES[dst]
+            return Encoded(rex(True, 0, 0, code) + bytes([0xb8 | code & 7]) + struct.pack('<q', value))
+        case _: # pragma: no cover
+            assert False, f'Cannot encode mov {dst}, {src}'
+
+def encode(instr: Instruction) -> Encoded:
+    match instr.mnemonic, instr.operands:
+        case 'mov', [dst, src]:
+            return encode_mov(dst, src)
+        case mnemonic, [dst, src] if mnemonic in ALU_OPCODES:
+            return encode_alu(mnemonic, dst, src)
+        case 'lea', [Reg() as dst, MemOperand() as src]:
+            return encode_rm(b'\x8d', REG_CODES[dst], src)
+        case 'imul', [Reg() as dst, src]:
+            return encode_rm(b'\x0f\xaf', REG_CODES[dst], src)
+        case 'neg', [dst]:
+            return encode_rm(b'\xf7', 3, dst)
+        case 'push', [Reg() as reg]:
+            return Encoded(rex(False, 0, 0, REG_CODES[reg]) + bytes([0x50 | REG_CODES[reg] & 7]))
+        case 'pop', [Reg() as reg]:
+            return Encoded(rex(False, 0, 0, REG_CODES[reg]) + bytes([0x58 | REG_CODES[reg] & 7]))
+        case 'ret', []:
+            return Encoded(b'\xc3')
+        case 'call', [Symbol(name)]:
+            return Encoded(b'\xe8' + bytes(4), [Fixup(1, name, -4, call=True)])
+        case 'dq', [Const(value)]:
+            return Encoded(struct.pack('<Q', value & 0xffff_ffff_ffff_ffff))
+        case 'db', values:
+            return Encoded(bytes(value.value & 0xff for value in values if isinstance(value, Const)))
+        case 'resq', [Const(count)]:
+            return Encoded(bytes(8 * count))
+        case _: # pragma: no cover
+            assert False, f'Cannot encode {instr.assemble()}'
+
+# A jump to a label, short (rel8) or near (rel32) depending on the distance
+@dataclass
+class Jump:
+    mnemonic: str
+    target: str
+    short: bool = True
+
+    def size(self) -> int:
+        if self.short:
+            return 2
+        return 5 if self.mnemonic == 'jmp' else 6
+
+    def encode(self, rel: int) -> bytes:
+        if self.mnemonic == 'jmp':
+            return b'\xeb' + imm8(rel) if self.short else b'\xe9' + imm32(rel)
+        cc = JCC_CODES[self.mnemonic]
+        return bytes([0x70 | cc]) + imm8(rel) if self.short else bytes([0x0f, 0x80 | cc]) + imm32(rel)
+
+Item = Label | LineMarker | Encoded | Jump
+
+@dataclass
+class SectionLayout:
+    name: str
+    items: list[Item] = field(default_factory=list)
+    labels: dict[str, int] = field(default_factory=dict)
+
+    def item_size(self, item: Item) -> int:
+        match item:
+            case Label() | LineMarker():
+                return 0
+            case Encoded(code=code):
+                return len(code)
+            case Jump():
+                return item.size()
+
+    # Lengthen jumps whose target is out of range of a short jump until the layout is stable
+    def relax(self) -> list[int]:
+        while True:
+            offsets: list[int] = []
+            pos = 0
+            for item in self.items:
+                offsets.append(pos)
+                if isinstance(item, Label):
+                    self.labels[item.label] = pos
+                pos += self.item_size(item)
+            changed = False
+            for item, offset in zip(self.items, offsets):
+                if isinstance(item, Jump) and item.short:
+                    assert item.target in self.labels, f'Jump to a label outside of {self.name}: {item.target}'
+                    if not fits_i8(self.labels[item.target] - (offset + item.size())):
+                        item.short = False
+                        changed = True
+            if not changed:
+                return offsets
+
+def to_item(line: Label | LineMarker | Instruction) -> Item:
+    match line:
+        case Instruction(mnemonic, [Symbol(target)]) if mnemonic == 'jmp' or mnemonic in JCC_CODES:
+            return Jump(mnemonic, target)
+        case Instruction():
+            return encode(line)
+        case _:
+            return line
+
+@dataclass
+class Assembler:
+    sections: dict[str, SectionLayout] = field(default_factory=dict)
+    globals: set[str] = field(default_factory=set)
+    externs: list[str] = field(default_factory=list)
+
+    def add_lines(self, lines: list[AsmLine]):
+        current: SectionLayout | None = None
+        for line in lines:
+            match line:
+                case Directive('global', sym):
+                    self.globals.add(sym)
+                case Directive('extern', sym):
+                    self.externs.append(sym)
+                case Directive('section', name):
+                    current = self.sections.setdefault(name, SectionLayout(name))
+                case Label() | LineMarker() | Instruction():
+                    assert current is not None, 'Code outside of a section'
+                    current.items.append(to_item(line))
+                case _: # pragma: no cover
+                    assert False, f'Cannot assemble {line.assemble()}'
+
+    def defined_in(self, symbol: str) -> SectionLayout | None:
+        return next((sec for sec in self.sections.values() if symbol in sec.labels), None)
+
+    def to_object(self) -> ElfObject:
+        obj = ElfObject()
+        layouts = list(self.sections.values())
+        all_offsets = [layout.relax() for layout in layouts]
+        # Offsets in .text of the lines of the source, with --debug-info
+        rows: list[tuple[int, int]] = []
+        path: str | None = None
+        for layout, offsets in zip(layouts, all_offsets):
+            data = bytearray()
+            relocations: list[Relocation] = []
+            for item, offset in zip(layout.items, offsets):
+                match item:
+                    case Jump(target=target):
+                        data += item.encode(layout.labels[target] - (offset + item.size()))
+                    case Encoded(code=code, fixups=fixups):
+                        code = bytearray(code)
+                        for fixup in fixups:
+                            place = offset + fixup.pos
+                            target_sec = self.defined_in(fixup.symbol)
+                            if target_sec is layout:
+                                code[fixup.pos:fixup.pos + 4] = imm32(layout.labels[fixup.symbol] + fixup.addend - place)
+                            elif target_sec is not None: # Local label of another section
+                                relocations.append(Relocation(place, target_sec.name, R_X86_64_PC32,
+                                                              target_sec.labels[fixup.symbol] + fixup.addend))
+                            else:
+                                relocations.append(Relocation(place, fixup.symbol,
+                                                              R_X86_64_PLT32 if fixup.call else R_X86_64_PC32, fixup.addend))
+                        data += code
+                    case LineMarker(lineno=lineno, path=path):
+                        rows.append((offset, lineno))
+                    case Label():
+                        pass
+            section = Section(layout.name, bytes(data), relocations=relocations)
+            if section.nobits(): # Only its size is in the object
+                section.data, section.size = b'', len(data)
+            obj.sections.append(section)
+        for layout in layouts:
+            for name, value in layout.labels.items():
+                obj.symbols.append(ElfSymbol(name, layout.name, value, name in self.globals))
+        obj.symbols += [ElfSymbol(name, None, is_global=True) for name in self.externs]
+        if path is not None:
+            text = obj.section('.text')
+            obj.sections += debug_sections(path, rows, len(text.data) if text is not None else 0)
+        return obj
+
+def assemble(lines: list[AsmLine]) -> ElfObject:
+    assembler = Assembler()
+    assembler.add_lines(lines)
+    return assembler.to_object()
+
+# Relocations by offset, with targets resolved to (section or external symbol, offset)
+# The relocation type is ignored (Ex. PLT32 and PC32 for calls are equivalent when linking statically)
+def resolved_relocations(obj: ElfObject, section: Section) -> dict[int, tuple[str, int]]:
+    defined = {sym.name: sym for sym in obj.symbols if sym.section is not None}
+    resolved: dict[int, tuple[str, int]] = {}
+    for rel in section.relocations:
+        if (sym := defined.get(rel.symbol)) is not None and sym.section is not None:
+            resolved[rel.offset] = (sym.section, sym.value + rel.addend)
+        else:
+            resolved[rel.offset] = (rel.symbol, rel.addend)
+    return resolved
+
+# Differences between two objects assembled from the same code, empty if equivalent
+def compare_objects(ours: ElfObject, theirs: ElfObject) -> list[str]:
+    diffs: list[str] = []
+    for name in sorted({sec.name for sec in ours.sections} | {sec.name for sec in theirs.sections}):
+        if name.startswith('.debug_'): # Produced differently by nasm
+            continue
+        # A missing section is the same as an empty one
+        our_sec, their_sec = ours.section(name) or Section(name), theirs.section(name) or Section(name)
+        if our_sec.size != their_sec.size:
+            diffs.append(f'{name}: size {our_sec.size} in built-in output vs {their_sec.size} in nasm output')
+        if our_sec.data != their_sec.data:
+            pos = next((i for i, (x, y) in enumerate(zip(our_sec.data, their_sec.data)) if x != y),
+                       min(len(our_sec.data), len(their_sec.data)))
+            labels = [sym for sym in theirs.symbols if sym.section == name and sym.value <= pos]
+            near = max(labels, key=lambda sym: sym.value).name if labels else name
+            diffs.append(f'{name}: contents differ at offset {pos:#x} (after {near}): '
+                         f'built-in {our_sec.data[pos:pos + 8].hex()} vs nasm {their_sec.data[pos:pos + 8].hex()}')
+        our_rels, their_rels = resolved_relocations(ours, our_sec), resolved_relocations(theirs, their_sec)
+        for offset in sorted(our_rels.keys() | their_rels.keys()):
+            if our_rels.get(offset) != their_rels.get(offset):
+                diffs.append(f'{name}: relocation at {offset:#x} differs: '
+                             f'built-in {our_rels.get(offset)} vs nasm {their_rels.get(offset)}')
+    return diffs
@@ -0,0 +1,104 @@
+# Flow-sensitive static type inference
+# Annotates expressions and variables (VarInfo) with their PrimType when it is known at compile time
+
+from dataclasses import dataclass, field
+from compy.common import CompiledFunction, PrimType, Walk, unwrap
+from compy.runtime import RUNTIME_RETURN_TYPES
+
+from compy.syntax import (Assignment, Binding, BinOp, ConstLiteral, EvalExpr, Expression,
+                          ExprScope, FixedArityCall, GetType, IfExpr, IfStmt, Input, Name, Node,
+                          NodeWalker, Prim1, Prim2, Print, StringLiteral, UnaryOp, VarInfo, While)
+
+# Known type of each variable (by var_id) at the current program point, None if unknown
+TypeEnv = dict[int, PrimType | None]
+
+BOOL_OPS = {BinOp.IS, BinOp.EQ, BinOp.LT, BinOp.GT, BinOp.LE, BinOp.GE, BinOp.AND, BinOp.OR}
+
+def infer(funcs: list[CompiledFunction]):
+    for func in funcs:
+        inferrer = TypeInferrer()
+        inferrer.run(func.body, {})
+        for info, types in inferrer.stores.values():
+            info.static_type = join_all(types)
+
+def join(t1: PrimType | None, t2: PrimType | None) -> PrimType | None:
+    return t1 if t1 == t2 else None
+
+def join_all(types: list[PrimType | None]) -> PrimType | None:
+    return types[0] if all(ty == types[0] for ty in types) else None
+
+# Join `other` into `env` (for variables in scope of both)
+def merge_into(env: TypeEnv, other: TypeEnv):
+    for var_id, ty in other.items():
+        if var_id in env:
+            env[var_id] = join(env[var_id], ty)
+
+def expr_type(ex: Expression) -> PrimType | None:
+    match ex:
+        case ConstLiteral():
+            return ex.type()
+        case StringLiteral():
+            return PrimType.STRING
+        case GetType():
+            return PrimType.TYPE
+        case Prim1(op=UnaryOp.NOT):
+            return PrimType.BOOL
+        case Prim1():
+            return PrimType.INT
+        case Prim2(op=op):
+            return PrimType.BOOL if op in BOOL_OPS else PrimType.INT
+        case Print():
+            return PrimType.NONE
+        case Input():
+            return None
+        case FixedArityCall(func_symbol=sym):
+            return RUNTIME_RETURN_TYPES.get(sym)
+        case IfExpr(body=body, orelse=orelse):
+            return join(body.static_type, orelse.static_type)
+        case ExprScope(scope=scope):
+            match scope.statements[-1]:
+                case EvalExpr(expr=last):
+                    return last.static_type
+                case _: # pragma: no cover
+                    return None
+        case _:
+            return ex.static_type
+
+@dataclass
+class TypeInferrer(NodeWalker[TypeEnv]):
+    # Every type stored to each variable (by var_id)
+    stores: dict[int, tuple[VarInfo, list[PrimType | None]]] = field(default_factory=dict)
+
+    def store(self, info: VarInfo, ty: PrimType | None, env: TypeEnv):
+        env[info.var_id] = ty
+        self.stores.setdefault(info.var_id, (info, []))[1].append(ty)
+
+    def walk(self, node: Node, ctx: TypeEnv) -> Walk[None]:
+        match node:
+            case IfStmt(test=test, body=body, orelse=orelse) | IfExpr(test=test, body=body, orelse=orelse):
+                yield self.walk(test, ctx)
+                ctx_else = dict(ctx)
+                yield self.walk(body, ctx)
+                yield self.walk(orelse, ctx_else)
+                merge_into(ctx, ctx_else)
+                if isinstance(node, IfExpr):
+                    node.static_type = expr_type(node)
+            case While(test=test, body=body):
+                # Iterate to a fixed point of the types at the loop head
+                while True:
+                    before = dict(ctx)
+                    yield self.walk(test, ctx)
+                    yield self.walk(body, ctx)
+                    merge_into(ctx, before)
+                    if all(ctx[var_id] == ty for var_id, ty in before.items()):
+                        break
+            case Binding(info=info, init_val=src) | Assignment(info=info, src=src):
+                yield from super().walk(node, ctx)
+                self.store(unwrap(info), src.static_type, ctx)
+            case Name(info=info):
+                node.static_type = ctx[unwrap(info).var_id]
+            case Expression():
+                yield from super().walk(node, ctx)
+                node.static_type = expr_type(node)
+            case _:
+                yield from super().walk(node, ctx)
@@ -0,0 +1,58 @@
+# Live ranges of variables over the code layout order of a function body (after ANF)
+
+from dataclasses import dataclass, field
+from compy.common import CompiledFunction, Walk, unwrap
+
+from compy.syntax import Assignment, Binding, Name, Node, NodeWalker, VarInfo, While
+
+# Each level of loop nesting multiplies the estimated execution count of a reference
+LOOP_WEIGHT = 8
+
+@dataclass
+class LiveRange:
+    info: VarInfo
+    start: int
+    end: int
+    weight: int = 0 # Estimated number of accesses, used to decide which variables to spill
+
+    def overlaps(self, other: 'LiveRange') -> bool:
+        return self.start <= other.end and other.start <= self.end
+
+# Context is the loop nesting depth
+@dataclass
+class LivenessWalker(NodeWalker[int]):
+    ranges: dict[int, LiveRange] = field(default_factory=dict) # Keyed by var_id
+    loops: list[tuple[int, int]] = field(default_factory=list) # Post-order (inner loops first)
+    point: int = 0
+
+    def reference(self, info: VarInfo, depth: int):
+        self.point += 1
+        if (live := self.ranges.get(info.var_id)) is None:
+            live = self.ranges[info.var_id] = LiveRange(info, self.point, self.point)
+        live.end = self.point
+        live.weight += LOOP_WEIGHT ** depth
+
+    def walk(self, node: Node, ctx: int) -> Walk[None]:
+        match node:
+            case Binding(info=info) | Assignment(info=info):
+                yield from super().walk(node, ctx)
+                self.reference(unwrap(info), ctx)
+            case Name(info=info):
+                self.reference(unwrap(info), ctx)
+            case While():
+                start = self.point + 1
+                yield from super().walk(node, ctx + 1)
+                self.loops.append((start, self.point))
+            case _:
+                yield from super().walk(node, ctx)
+
+# Sorted by start point
+def live_ranges(func: CompiledFunction) -> list[LiveRange]:
+    walker = LivenessWalker()
+    walker.run(func.body, 0)
+    for loop_start, loop_end in walker.loops:
+        for live in walker.ranges.values():
+            # Live when entering the loop: must survive until the back edge
+            if live.start < loop_start <= live.end:
+                live.end = max(live.end, loop_end)
+    return sorted(walker.ranges.values(), key=lambda live: live.start)
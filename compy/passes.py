@@ -0,0 +1,197 @@
+# Pass manager for the passes over the whole AST
+# A Visitor only handles single nodes of the types it declares, so the visitors that do not
+# depend on each other are fused: they all run in the same traversal of the tree.
+# Passes that need a context (Ex. the variables in scope) are Walkers, which traverse the tree by themselves.
+
+import cProfile
+from dataclasses import dataclass, field
+import fcntl
+import json
+import os
+import time
+import tracemalloc
+from typing import Any, Callable, ClassVar, TypeVar
+
+from compy.common import PassTimingOptions
+from compy.syntax import Node, Scope, count_nodes
+
+T = TypeVar('T')
+
+class Pass:
+    name: ClassVar[str]
+    # Names of the passes that must have completed before this one starts
+    after: ClassVar[tuple[str, ...]] = ()
+
+class Visitor(Pass):
+    # `enter` is called on the way down for nodes of the `enter_types`,
+    # and `leave` on the way up (after the children) for nodes of the `leave_types`
+    enter_types: ClassVar[tuple[type[Node], ...]] = ()
+    leave_types: ClassVar[tuple[type[Node], ...]] = ()
+
+    def enter(self, node: Node):
+        pass
+
+    def leave(self, node: Node):
+        pass
+
+class Walker(Pass):
+    def apply(self, top: Scope): # pragma: no cover
+        raise NotImplementedError
+
+# Passes run by the same traversal: either fused visitors or a single walker
+Group = list[Visitor] | Walker
+
+def schedule(passes: list[Pass]) -> list[Group]:
+    groups: list[Group] = []
+    done: set[str] = set()
+    current: list[Visitor] = []
+    for pas in passes:
+        missing = set(pas.after) - done - {visitor.name for visitor in current}
+        assert not missing, f'{pas.name} runs before the passes it depends on: {", ".join(sorted(missing))}'
+        # A visitor cannot see the effects of a visitor of the same traversal on the nodes below
+        if current and (isinstance(pas, Walker) or any(visitor.name in pas.after for visitor in current)):
+            groups.append(current)
+            current = []
+        match pas:
+            case Visitor():
+                current.append(pas)
+            case Walker():
+                groups.append(pas)
+            case _: # pragma: no cover
+                assert False, f'Unknown kind of pass: {type(pas)}'
+        done.add(pas.name)
+    if current:
+        groups.append(current)
+    return groups
+
+def group_name(group: Group) -> str:
+    match group:
+        case Walker():
+            return group.name
+        case _:
+            return ' + '.join(visitor.name for visitor in group)
+
+# Runs the visitors in one pre/post-order traversal, with an explicit stack so that depth is not limited
+def visit(top: Node, visitors: list[Visitor]):
+    enters: dict[type, list[Callable[[Node], None]]] = {}
+    leaves: dict[type, list[Callable[[Node], None]]] = {}
+    def hooks(clz: type) -> tuple[list[Callable[[Node], None]], list[Callable[[Node], None]]]:
+        if clz not in enters:
+            enters[clz] = [visitor.enter for visitor in visitors if issubclass(clz, visitor.enter_types)]
+            leaves[clz] = [visitor.leave for visitor in visitors if issubclass(clz, visitor.leave_types)]
+        return enters[clz], leaves[clz]
+    stack: list[tuple[Node, bool]] = [(top, False)]
+    while stack:
+        node, leaving = stack.pop()
+        on_enter, on_leave = hooks(type(node))
+        if leaving:
+            for leave in on_leave:
+                leave(node)
+            continue
+        for enter in on_enter:
+            enter(node)
+        if on_leave:
+            stack.append((node, True))
+        stack.extend((child, False) for child in reversed(list(node.children())))
+
+# Includes the subprocesses waited for (Ex. nasm and the linker)
+def cpu_time() -> float:
+    children = os.times()
+    return time.process_time() + children.children_user + children.children_system
+
+@dataclass
+class PassTiming:
+    name: str
+    seconds: float # Wall time
+    cpu_seconds: float
+    size: int | None = None # Of the result of the pass, in `unit`
+    unit: str | None = None
+    peak_memory: int | None = None # Bytes traced by tracemalloc during the pass (including earlier data still alive)
+
+    def to_json(self) -> dict[str, Any]:
+        return {'name': self.name, 'wall_seconds': self.seconds, 'cpu_seconds': self.cpu_seconds,
+                'size': self.size, 'unit': self.unit, 'peak_memory_bytes': self.peak_memory}
+
+@dataclass
+class PassManager:
+    options: PassTimingOptions = field(default_factory=PassTimingOptions)
+    # Of the names of the profile dumps, Ex. the name of the source
+    profile_prefix: str = ''
+    # In the order the passes ran
+    timings: list[PassTiming] = field(default_factory=list)
+    started_tracing: bool = False
+
+    # `size` measures the result of the action, only when the passes are timed since it may be costly
+    def time(self, name: str, action: Callable[[], T], size: Callable[[T], int] | None = None, unit: str = 'nodes') -> T:
+        profiler = cProfile.Profile() if self.options.profile_dir is not None else None
+        if self.options.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            tracemalloc.reset_peak()
+        start, start_cpu = time.perf_counter(), cpu_time()
+        try:
+            result = action() if profiler is None else profiler.runcall(action)
+        finally:
+            timing = PassTiming(name, time.perf_counter() - start, cpu_time() - start_cpu)
+            self.timings.append(timing)
+            if self.options.trace_memory:
+                timing.peak_memory = tracemalloc.get_traced_memory()[1]
+            if profiler is not None:
+                self.dump_profile(profiler, name)
+        if size is not None and self.options.enabled:
+            timing.size, timing.unit = size(result), unit
+        return result
+
+    def dump_profile(self, profiler: cProfile.Profile, name: str):
+        directory = self.options.profile_dir
+        assert directory is not None
+        os.makedirs(directory, exist_ok=True)
+        file_name = f'{self.profile_prefix}{len(self.timings):02}-{name.replace(" + ", "+")}.prof'
+        profiler.dump_stats(os.path.join(directory, file_name))
+
+    def run(self, top: Scope, passes: list[Pass]):
+        for group in schedule(passes):
+            match group:
+                case Walker() as walker:
+                    self.time(walker.name, lambda: walker.apply(top), lambda _: count_nodes(top))
+                case _:
+                    visitors = group # Narrowed for the lambda
+                    self.time(group_name(visitors), lambda: visit(top, visitors), lambda _: count_nodes(top))
+
+    def close(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def report(self) -> str:
+        width = max([len('total'), *(len(timing.name) for timing in self.timings)]) + 2
+        memory = self.options.trace_memory
+        def row(name: str, seconds: float, cpu_seconds: float, size: str, peak_memory: int | None) -> str:
+            line = f'{name:<{width}}{seconds * 1000:10.2f}{cpu_seconds * 1000:10.2f}{size:>16}'
+            if memory and peak_memory is not None:
+                line += f'{peak_memory / 2**20:10.1f}'
+            return line
+        lines = [f'{"pass":<{width}}{"wall ms":>10}{"cpu ms":>10}{"size":>16}' + (f'{"peak MiB":>10}' if memory else '')]
+        for timing in self.timings:
+            size = f'{timing.size} {timing.unit}' if timing.size is not None else ''
+            lines.append(row(timing.name, timing.seconds, timing.cpu_seconds, size, timing.peak_memory))
+        peaks = [timing.peak_memory for timing in self.timings if timing.peak_memory is not None]
+        lines.append(row('total', sum(timing.seconds for timing in self.timings),
+                         sum(timing.cpu_seconds for timing in self.timings), '', max(peaks, default=None)))
+        return '\n'.join(lines)
+
+    def to_json(self, source: str, completed: bool) -> dict[str, Any]:
+        return {
+            'source': source,
+            'completed': completed, # False when the compilation failed
+            'wall_seconds': sum(timing.seconds for timing in self.timings),
+            'cpu_seconds': sum(timing.cpu_seconds for timing in self.timings),
+            'passes': [timing.to_json() for timing in self.timings],
+        }
+
+    # One line per compilation, so that many compilations (Ex. with --batch) can report to the same file
+    def append_json(self, path: str, source: str, completed: bool):
+        with open(path, 'a') as report:
+            fcntl.flock(report, fcntl.LOCK_EX)
+            report.write(json.dumps(self.to_json(source, completed)) + '\n')
@@ -1,19 +1,41 @@
+import ast
+import os
 from pprint import pprint
 from typing import Callable
 
 import compy.asm
 import compy.checker
 import compy.codegen
+import compy.constfold
+import compy.inference
 import compy.parser
+from compy.passes import PassManager
+import compy.regalloc
 import compy.strliteral
 import compy.stack
 import compy.tagger
 import compy.anf
 from compy.common import CompileError, CompilerInfo, report_error
+from compy.syntax import count_nodes
 
 DEBUG_HEADER_WIDTH = 50
 
 def run(info: CompilerInfo):
+    timing = info.debug_flags.timing
+    passes = PassManager(timing, os.path.basename(info.src_prefix) + '.')
+    completed = False
+    try:
+        run_passes(info, passes)
+        completed = True
+    finally:
+        passes.close()
+        if timing.enabled:
+            info.print('Passes:')
+            info.print(passes.report())
+            if timing.json_path is not None:
+                passes.append_json(timing.json_path, info.src_path, completed)
+
+def run_passes(info: CompilerInfo, passes: PassManager):
     oprint = info.print
     def debug(step_name: str, action: Callable[[], None]):
         if info.debug_flags.pipeline: # pragma: no cover
@@ -26,15 +48,22 @@ def run(info: CompilerInfo):
     
     with open(info.src_path) as src:
         code = src.read()
+    module = passes.time('parse', lambda: compy.parser.parse_python(code, info.src_path),
+                         lambda module: sum(1 for _ in ast.walk(module)))
     try:
-        top = compy.parser.parse(code, info.src_path)
+        top = passes.time('convert', lambda: compy.parser.convert(module, info.state.spans), count_nodes)
     except CompileError as ce:
         report_error(info, code, ce)
         raise ce
-    compy.checker.check(info.state, top)
     debug('Bare AST', lambda: pprint(top))
-    compy.strliteral.process_str(info.state, top)
-    funcs = compy.tagger.tag(info.state, top)
+    # Visitors next to each other share one traversal (see compy.passes)
+    passes.run(top, [
+        compy.checker.Checker(info.state),
+        compy.strliteral.StringTagger(info.state),
+        compy.tagger.FunctionTagger(info.state),
+        compy.tagger.VariableTagger(info.state),
+    ])
+    funcs = compy.tagger.tagged_functions(top)
     debug('Tagged AST', lambda: pprint(top))
 
     # Process diagnostics
@@ -45,10 +74,20 @@ def run(info: CompilerInfo):
     # TODO: report warnings but don't terminate
 
     # All steps starting now SHOULD NOT fail!
-    compy.anf.anf(info.state, funcs)
+    ast_size = lambda _: count_nodes(top)
+    passes.time('inference', lambda: compy.inference.infer(funcs), ast_size)
+    passes.time('anf', lambda: compy.anf.anf(info.state, funcs), ast_size)
     debug('ANF AST', lambda: pprint(top))
-    compy.stack.allocate_stack(funcs)
+    passes.time('constfold', lambda: compy.constfold.fold(info.state, funcs), ast_size)
+    debug('Folded AST', lambda: pprint(top))
+    passes.time('regalloc', lambda: compy.regalloc.allocate_registers(funcs), ast_size)
+    passes.time('stack', lambda: compy.stack.allocate_stack(funcs), ast_size)
     debug('Post stack processing', lambda: pprint(top))
-    lines = compy.codegen.compile_prog(info, funcs)
-    compy.asm.build(info, lines)
+    lines = passes.time('codegen', lambda: compy.codegen.compile_prog(info, funcs), len, 'lines')
+    peephole = compy.asm.Peephole()
+    lines = passes.time('peephole', lambda: peephole.run(lines), len, 'lines')
+    if info.debug_flags.peephole: # pragma: no cover
+        oprint('Peephole rule hits:')
+        oprint(peephole.report())
+    compy.asm.build(info, lines, passes)
     oprint('Build successful!')
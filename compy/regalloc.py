@@ -0,0 +1,47 @@
+# Linear scan register allocation of variables into callee-saved registers
+# Variables that do not get registers are spilled to the stack by compy.stack
+
+from compy.asm import Reg
+from compy.common import CompiledFunction
+from compy.liveness import LiveRange, live_ranges
+from compy.syntax import VarInfo
+
+# Callee-saved in the System V ABI, so values survive calls into the runtime
+ALLOCATABLE = [Reg.RBX, Reg.R12, Reg.R13, Reg.R14, Reg.R15]
+
+def regs_needed(info: VarInfo) -> int:
+    # Value and type words, the type is a constant if statically known
+    return 1 if info.static_type is not None else 2
+
+def allocate_registers(funcs: list[CompiledFunction]):
+    for func in funcs:
+        ranges = live_ranges(func)
+        linear_scan(ranges)
+        used = {reg for live in ranges for reg in live.info.regs or ()}
+        func.saved_regs = [reg for reg in ALLOCATABLE if reg in used]
+
+def linear_scan(ranges: list[LiveRange]):
+    free = list(ALLOCATABLE)
+    active: list[LiveRange] = []
+    def release(live: LiveRange):
+        active.remove(live)
+        free.extend(live.info.regs or ())
+    for current in ranges:
+        for live in [live for live in active if live.end < current.start]:
+            release(live)
+        needed = regs_needed(current.info)
+        # Evict colder variables to make room for hotter ones, only if that frees enough registers
+        victims: list[LiveRange] = []
+        freed = len(free)
+        for live in sorted(active, key=lambda live: live.weight):
+            if freed >= needed or live.weight >= current.weight:
+                break
+            victims.append(live)
+            freed += len(live.info.regs or ())
+        if freed >= needed:
+            for victim in victims:
+                release(victim)
+                victim.info.regs = None
+        if len(free) >= needed:
+            current.info.regs = tuple(free.pop(0) for _ in range(needed))
+            active.append(current)
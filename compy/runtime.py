@@ -1,7 +1,17 @@
+from compy.common import PrimType
+
 FIXED_ARITY_FUNCS: dict[str, tuple[str, int]] = {
     'time_int': ('compy_time_int', 0),
     'sleep': ('compy_sleep', 1),
     'exit': ('compy_exit', 1),
 }
 
-RUNTIME_SYMBOLS = {sym for (sym, _) in FIXED_ARITY_FUNCS.values()}
+# Runtime functions (besides unary and binary operators) with a wrapper taking objects in registers
+REGPASS_SYMBOLS = {'compy_sleep', 'compy_exit'}
+REGPASS_SUFFIX = '_r'
+
+RUNTIME_RETURN_TYPES: dict[str, PrimType] = {
+    'compy_time_int': PrimType.INT,
+    'compy_sleep': PrimType.NONE,
+    'compy_exit': PrimType.NONE,
+}
@@ -0,0 +1,64 @@
+# Builds of the C runtime (runtime/), one per profile
+# Each build has its own directory, named after the profile and a hash of everything that goes into it
+# (the sources, the Makefile and the make variables), so make only runs when one of them changed.
+
+import fcntl
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+
+from compy.common import RuntimeProfile, UserError
+
+RUNTIME_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'runtime'))
+BUILD_DIR = os.path.join(RUNTIME_DIR, 'build')
+RUNTIME_OBJ = 'runtime.o'
+# Same warnings as errors as bin/strict-build-runtime
+MAKE_VARIABLES = ['ERROR=-Werror -Wno-error=unused-parameter']
+# Read by the Makefile from the environment
+ENV_VARIABLES = ['CFLAGS', 'LD']
+
+def runtime_sources() -> list[str]:
+    return sorted(glob.glob(os.path.join(RUNTIME_DIR, '*.[ch]'))) + [os.path.join(RUNTIME_DIR, 'Makefile')]
+
+def runtime_key(profile: RuntimeProfile) -> str:
+    digest = hashlib.sha256()
+    for part in [profile.value, *MAKE_VARIABLES, *(f'{name}={os.environ.get(name, "")}' for name in ENV_VARIABLES)]:
+        digest.update(part.encode() + b'\0')
+    for path in runtime_sources():
+        with open(path, 'rb') as src:
+            digest.update(os.path.basename(path).encode() + b'\0' + hashlib.sha256(src.read()).digest())
+    return digest.hexdigest()[:16]
+
+def build_path(profile: RuntimeProfile) -> str:
+    return os.path.join(BUILD_DIR, f'{profile.value}-{runtime_key(profile)}')
+
+# Builds the runtime on first use
+def runtime_obj_path(profile: RuntimeProfile) -> str:
+    directory = build_path(profile)
+    obj_path = os.path.join(directory, RUNTIME_OBJ)
+    if not os.path.exists(obj_path):
+        build_runtime(profile, directory)
+    return obj_path
+
+def build_runtime(profile: RuntimeProfile, directory: str):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    with open(os.path.join(BUILD_DIR, profile.value + '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(directory): # By a concurrent compilation
+            return
+        # Built aside then renamed, so that a build is never seen half done
+        tmp_dir = tempfile.mkdtemp(dir=BUILD_DIR, prefix=profile.value + '.tmp')
+        try:
+            subprocess.run(['make', '-s', '-C', RUNTIME_DIR, f'PROFILE={profile.value}', f'BUILD={tmp_dir}', *MAKE_VARIABLES],
+                           stdout=subprocess.DEVNULL, check=True)
+        except subprocess.CalledProcessError:
+            shutil.rmtree(tmp_dir)
+            raise UserError(f'Failed to build the {profile.value} runtime')
+        os.rename(tmp_dir, directory)
+        # Builds of older sources of the same profile
+        for old in glob.glob(os.path.join(BUILD_DIR, profile.value + '-*')):
+            if old != directory:
+                shutil.rmtree(old, ignore_errors=True)
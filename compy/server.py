@@ -0,0 +1,125 @@
+# Long-lived compile server on a Unix socket (see bin/compy-server and bin/compy-client)
+# The compiler is imported once, and every request is handled in a forked child,
+# so compilations cannot leak state into each other.
+#
+# Protocol: the client sends one JSON request and shuts down its write side,
+# the server answers with one JSON response and closes the connection.
+#   request:  {"argv": [...], "cwd": "...", "env": {...}} (only the variables of FORWARDED_ENV)
+#   response: {"stdout": "...", "stderr": "...", "exit": int, "run": path | null, "fallback": bool}
+# "fallback" tells the client to compile by itself, Ex. when the compiler sources changed.
+#
+# The socket is in a directory only accessible by its user, and both sides check that the
+# other end of the connection runs as the same user (SO_PEERCRED).
+
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+import traceback
+from typing import Any, cast
+
+import compy
+import compy.cache
+from compy.cache import CACHE_DIR_ENV, CACHE_SIZE_ENV
+from compy.common import RuntimeProfile, UserError
+from compy.runtime_build import runtime_obj_path
+
+SOCKET_ENV = 'COMPY_SERVER_SOCKET'
+SOCKET_NAME = 'compy.sock'
+# The variables read by a compilation: tools and their flags, temporary files and the executable cache
+FORWARDED_ENV = ['PATH', 'HOME', 'TMPDIR', 'CFLAGS', 'LD', 'XDG_CACHE_HOME', CACHE_DIR_ENV, CACHE_SIZE_ENV]
+
+def default_socket_path() -> str:
+    if (path := os.environ.get(SOCKET_ENV)):
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    directory = os.path.join(runtime_dir, 'compy') if runtime_dir else f'/tmp/compy-{os.getuid()}'
+    return os.path.join(directory, SOCKET_NAME)
+
+# Creates the directory of the socket if needed, and fails unless only the current user can access it
+def make_private_dir(directory: str):
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise UserError(f'Refusing to put the server socket in {directory}: not a directory private to the current user')
+
+def peer_uid(sock: socket.socket) -> int:
+    _, uid, _ = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+    return uid
+
+class CompileHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        if peer_uid(self.request) != os.getuid():
+            return
+        request = json.loads(self.rfile.read())
+        self.wfile.write(json.dumps(cast(CompileServer, self.server).compile(request)).encode())
+
+class CompileServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    stale = False # The compiler sources changed since the server started
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.compiler_hash = compy.cache.compiler_hash()
+        runtime_obj_path(RuntimeProfile.DEBUG) # So that the first request does not wait for it
+        make_private_dir(os.path.dirname(os.path.abspath(socket_path)))
+        try:
+            os.unlink(socket_path) # Left over by a server that was killed
+        except FileNotFoundError:
+            pass
+        super().__init__(socket_path, CompileHandler)
+
+    # Runs in the server process before forking, so the checks are not repeated by every child
+    def process_request(self, request: Any, client_address: Any):
+        if compy.cache.compute_compiler_hash() != self.compiler_hash:
+            self.stale = True
+            threading.Thread(target=self.shutdown).start()
+        super().process_request(request, client_address)
+
+    # Runs in the forked child
+    def compile(self, request: dict[str, Any]) -> dict[str, Any]:
+        if self.stale:
+            return {'stdout': '', 'stderr': '', 'exit': 0, 'run': None, 'fallback': True}
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update({name: value for name, value in request['env'].items() if name in FORWARDED_ENV})
+        stdout, stderr = io.StringIO(), io.StringIO()
+        sys.stdout, sys.stderr = stdout, stderr # argparse prints there directly
+        run_path: list[str] = []
+        try:
+            compy.main(request['argv'], stdout, stderr, run_executable=run_path.append)
+            code = 0
+        except (UserError, OSError) as e:
+            print(f'Error: {e}', file=stderr)
+            code = 1
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            traceback.print_exc(file=stderr)
+            code = 1
+        return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'exit': code,
+                'run': run_path[0] if run_path else None, 'fallback': False}
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+def serve(socket_path: str | None = None): # pragma: no cover
+    with CompileServer(socket_path or default_socket_path()) as server:
+        print(f'compy server listening on {server.socket_path}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        if server.stale:
+            print('compy server: compiler sources changed, exiting', file=sys.stderr)
@@ -1,8 +1,10 @@
+from collections import defaultdict
 from dataclasses import dataclass
 from compy.asm import MemRegOffset, Reg, WordSize
 from compy.common import CompiledFunction
+from compy.liveness import LiveRange, live_ranges
 
-from compy.syntax import Binding, Node, NodeWalker, Scope
+from compy.syntax import VarInfo
 
 
 # x86-64 System V ABI requires 16-byte alignment of the stack
@@ -20,42 +22,41 @@ class StackPosition:
     
     def stack_requirement(self) -> int:
         return -(self.pos - self.pos % STACK_ALIGNMENT)
-    
-    # Shallow copy with same allocator but separate position
-    def fork(self) -> 'StackPosition':
-        return StackPosition(self.alloc, self.pos)
 
 class StackAllocator:
     space: int = 0
-    def __init__(self) -> None:
-        self.root = StackPosition(self) # The root scope position
+    def __init__(self, reserved: int = 0) -> None:
+        self.root = StackPosition(self, -reserved) # The root scope position
+        self.require_minimum_space(self.root.stack_requirement())
     
     def require_minimum_space(self, minimum: int):
         self.space = max(self.space, minimum)
 
 SIZE_UNTYPED = 16
+SIZE_TYPED = 8 # Only the value word, the type is a constant
+REG_SIZE = 8
+
+def slot_size(info: VarInfo) -> int:
+    return SIZE_UNTYPED if info.static_type is None else SIZE_TYPED
 
-class AllocationWalker(NodeWalker[StackPosition]):
-    def walk(self, node: Node, ctx: StackPosition):
-        match node:
-            case Scope(info=info):
-                assert info != None, 'Untagged scope'
-                assert info.funcs == [], 'TBD: support function closure as variable names'
-                # TODO: allocate space for function closure names as well
-                super().walk(node, ctx.fork())
-            case Binding(info=info):
-                assert info != None, 'Untagged binding'
-                super().walk(node, ctx)
-                # For now, assume everything is untyped
-                info.stack_offset = ctx.allocate(SIZE_UNTYPED)
-            # TODO: avoid descending down a function declaration (keep everything under one function)
-            case _:
-                super().walk(node, ctx)
+# Assign stack slots to the variables spilled by the register allocator
+# Variables whose live ranges do not overlap share a slot
+def color_slots(ranges: list[LiveRange], alloc: StackAllocator):
+    free: dict[int, list[int]] = defaultdict(list) # Free slot offsets by size
+    active: list[LiveRange] = []
+    for current in ranges:
+        for live in [live for live in active if live.end < current.start]:
+            active.remove(live)
+            free[slot_size(live.info)].append(live.info.get_stack_offset())
+        size = slot_size(current.info)
+        current.info.stack_offset = free[size].pop() if free[size] else alloc.root.allocate(size)
+        active.append(current)
 
 def allocate_stack(funcs: list[CompiledFunction]):
     for func in funcs:
-        alloc = StackAllocator()
-        AllocationWalker().walk(func.body, alloc.root)
+        # Callee-saved registers are pushed right below the saved RBP
+        alloc = StackAllocator(REG_SIZE * len(func.saved_regs))
+        color_slots([live for live in live_ranges(func) if live.info.regs is None], alloc)
         func.stack_usage = alloc.space
 
 # Return a memory operand that can be used to access the stack variable at `stack_pos` at offset `offset`
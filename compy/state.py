@@ -1,6 +1,6 @@
 from dataclasses import dataclass, field
 
-from compy.common import CompileError
+from compy.common import CompileError, SpanTable
 from compy.constpool import ConstPool
 from compy.strpool import StringPool
 
@@ -10,5 +10,6 @@ class CompilerState:
     errors: list[CompileError] = field(default_factory=list)
     const_pool: ConstPool = field(default_factory=lambda: ConstPool())
     string_pool: StringPool = field(default_factory=lambda: StringPool())
+    spans: SpanTable = field(default_factory=SpanTable)
     def err(self, error: 'CompileError'):
         self.errors.append(error)
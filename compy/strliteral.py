@@ -1,18 +1,14 @@
 from dataclasses import dataclass
+from compy.passes import Visitor
 from compy.state import CompilerState
-from compy.syntax import Node, NodeWalker, Scope, StringLiteral
+from compy.syntax import Node, StringLiteral
 
 
-def process_str(state: CompilerState, top: Scope):
-    StringTagger(state).walk(top, None)
-
 @dataclass
-class StringTagger(NodeWalker[None]):
+class StringTagger(Visitor):
+    name = 'strings'
+    enter_types = (StringLiteral,)
     state: CompilerState
-    def walk(self, node: Node, ctx: None):
-        match node:
-            case StringLiteral():
-                self.state.string_pool.process(node)
-            case _:
-                pass
-        super().walk(node, None)
+    def enter(self, node: Node):
+        assert isinstance(node, StringLiteral)
+        self.state.string_pool.process(node)
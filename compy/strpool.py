@@ -1,10 +1,11 @@
 from dataclasses import dataclass, field
-import itertools
 from typing import Iterable
-from compy.asm import AsmLine, Const, Label, db_s
+from compy.asm import AsmLine, Const, Label, db_s, dq
 
 from compy.syntax import StringLiteral
 
+# Entries are padded to it, so that the length of each entry is aligned
+ENTRY_ALIGN = 8
 
 @dataclass
 class StringPool:
@@ -21,8 +22,12 @@ class StringPool:
         sl.data_label = self.symbols[sl.content]
     
     # Put in in some .rodata section
+    # Each entry is the length in bytes (str_t in runtime/common.h), then the UTF-8 bytes without a terminator
     def to_asm(self) -> Iterable[AsmLine]:
         for literal, symbol in self.symbols.items():
+            data = literal.encode()
             yield Label(symbol)
-            # For now, null terminate everything as we don't have separate fields for string legth
-            yield db_s(itertools.chain((Const(i) for i in literal.encode()), [Const(0)]))
+            yield dq(Const(len(data)))
+            data += bytes(-len(data) % ENTRY_ALIGN)
+            if data:
+                yield db_s(Const(byte) for byte in data)
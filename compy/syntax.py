@@ -1,10 +1,13 @@
 from dataclasses import dataclass, field, fields
 from enum import Enum
 import sys
-from typing import (Annotated, Any, Generic, Iterable, TypeVar, get_args,
+from typing import (TYPE_CHECKING, Annotated, Any, Callable, Generic, Iterable, TypeVar, get_args,
                     get_origin, get_type_hints)
 
-from compy.common import ID, SourceSpan, PrimType, unwrap
+from compy.common import ID, SpanId, PrimType, Walk, trampoline, unwrap
+
+if TYPE_CHECKING:
+    from compy.asm import Reg
 
 ## Type annotations
 
@@ -21,22 +24,26 @@ def gen_var_id() -> int:
     next_var_id += 1
     return next_var_id
 
-@dataclass
+@dataclass(slots=True)
 class VarInfo:
     # The originating function ID, used to decide whether an occurence is a closure free variable
     # or -1 for ANF variables that can never be free (never cross function boundaries)
     origin_function_id: int
     mutable: bool
-    # Add type of variable, etc.
+    # Type of every value ever stored to this variable, if statically known
+    static_type: PrimType | None = None
     # WARNING: this stack offset is relative to the frame of the orignating function
     stack_offset: int | None = None # From RBP
+    # Registers holding the (value, type) words if the variable lives in registers instead of the stack
+    # Only the value register if static_type is known
+    regs: 'tuple[Reg, ...] | None' = None
     # *** DEBUG INFORMATION ***
     var_id: int = field(default_factory=gen_var_id)
 
     def get_stack_offset(self, fail_msg: str = 'Stack offset not computed yet!'):
         return unwrap(self.stack_offset, fail_msg)
 
-@dataclass
+@dataclass(slots=True)
 class FuncInfo:
     symbol_name: str # Could be mangled
     # Add type of function, arity, etc. to aid in closure construction at the start of the scope
@@ -47,17 +54,22 @@ class FuncInfo:
 INFO_ID = VarInfo
 # INFO_ID = VarInfo | FuncInfo
 
-@dataclass
+@dataclass(slots=True)
 class ScopeInformation:
     funcs: list[FuncInfo] = field(default_factory=list)
 
 ## Abstract AST types
 
-@dataclass
+@dataclass(slots=True)
 class Node: # Base class of everythingd
+    if TYPE_CHECKING:
+        # Declared for the type checker only: a field of Statement and Expression, read by the passes
+        # that look up the span of any node (Scope has none, so there is no slot for it at runtime)
+        span: SpanId = field(default=-1, compare=False, kw_only=True)
     def child_fields(self) -> Iterable['Field']:
         for fld_name, fld_type, imm in child_fields(type(self)):
             yield Field(obj=self, attr_name=fld_name, ty=fld_type, need_imm=imm)
+    # Both are replaced on each subclass by generate_traversals
     def children(self) -> Iterable['Node']:
         for fld in self.child_fields():
             val = fld.get()
@@ -66,17 +78,30 @@ class Node: # Base class of everythingd
                     yield val
                 case _:
                     yield from val
+    # Replace every child with the result of the walk rewrite(child, need_imm) (see trampoline)
+    def rewrite_children(self, rewrite: Callable[['Node', bool], Walk['Node']]) -> Walk[None]:
+        for fld in self.child_fields():
+            match fld.get():
+                case Node() as child:
+                    fld.set((yield rewrite(child, fld.need_imm)))
+                case nodes:
+                    rewritten: list[Node] = []
+                    for child in nodes:
+                        rewritten.append((yield rewrite(child, fld.need_imm)))
+                    fld.set(rewritten)
 
 
-@dataclass
+@dataclass(slots=True)
 class Statement(Node):
-    span: SourceSpan = field(compare=False)
+    span: SpanId = field(compare=False)
 
-@dataclass
+@dataclass(slots=True)
 class Expression(Node):
-    span: SourceSpan = field(compare=False)
+    span: SpanId = field(compare=False)
+    # Type of the value at this point of evaluation, if statically known
+    static_type: PrimType | None = field(default=None, compare=False, kw_only=True)
 
-@dataclass
+@dataclass(slots=True)
 class EvalExpr(Statement): # Evaluate an expression for its side effects only, ignoring its value
     expr: Expression
 
@@ -145,69 +170,113 @@ def _child_fields(clz: type[Node]) -> Iterable[CLASS_FIELD]:
         name = field.name
         ty = types[name]
         full_type = types_annot[name]
-        match ty:
-            case type():
-                current_ty = ty
-                if get_origin(ty) == list:
-                    (inner_type,) = get_args(ty)
-                    if not isinstance(inner_type, type): # pragma: no cover
-                        report_unknown_type(name, inner_type, extra_msg=' (Inside list[...])')
-                        continue
-                    current_ty = inner_type
-                if issubclass(current_ty, Node):
-                    imm = bool(get_origin(full_type) == Annotated) and NeedImmediate() in get_args(full_type)
-                    if imm:
-                        assert issubclass(current_ty, Expression), 'Cannot make immediate a non-expression'
-                    yield name, ty, imm
-            case _:
-                report_unknown_type(name, ty)
-                pass
+        # Note: list[...] is not an instance of type since Python 3.11
+        current_ty = ty
+        if get_origin(ty) == list:
+            (current_ty,) = get_args(ty)
+            if not isinstance(current_ty, type): # pragma: no cover
+                report_unknown_type(name, current_ty, extra_msg=' (Inside list[...])')
+                continue
+        elif not isinstance(ty, type):
+            report_unknown_type(name, ty)
+            continue
+        if issubclass(current_ty, Node):
+            imm = bool(get_origin(full_type) == Annotated) and NeedImmediate() in get_args(full_type)
+            if imm:
+                assert issubclass(current_ty, Expression), 'Cannot make immediate a non-expression'
+            yield name, ty, imm
+
+## Generated traversal methods
+# Each Node class gets its own `children` and `rewrite_children`, specialized to its fields,
+# so that passes do not pay for the reflection in child_fields on every visit
+
+def _traversal_source(clz: type[Node]) -> str:
+    flds = list(child_fields(clz))
+    def child_expr(name: str, ty: type) -> str:
+        return f'*self.{name}' if get_origin(ty) == list else f'self.{name}'
+    match flds:
+        case []:
+            children = 'return ()'
+        case [(name, ty, _)] if get_origin(ty) == list:
+            children = f'return self.{name}'
+        case _:
+            children = 'return (' + ''.join(child_expr(name, ty) + ', ' for name, ty, _ in flds) + ')'
+    # Loops since yield is not allowed in comprehensions
+    rewrites: list[str] = []
+    for name, ty, imm in flds:
+        if get_origin(ty) == list:
+            rewrites += ['rewritten = []',
+                         f'for child in self.{name}:',
+                         f'{_TAB}rewritten.append((yield rewrite(child, {imm})))',
+                         f'self.{name} = rewritten']
+        else:
+            rewrites.append(f'self.{name} = yield rewrite(self.{name}, {imm})')
+    if not rewrites:
+        rewrites.append('yield from () # Still a generator')
+    return (f'def children(self):\n{_TAB}{children}\n'
+            f'def rewrite_children(self, rewrite):\n{_TAB}' + f'\n{_TAB}'.join(rewrites) + '\n')
+
+def generate_traversal(clz: type[Node]):
+    namespace: dict[str, Any] = {}
+    exec(compile(_traversal_source(clz), f'<traversal of {clz.__name__}>', 'exec'), namespace)
+    clz.children = namespace['children']
+    clz.rewrite_children = namespace['rewrite_children']
+
+def generate_traversals(root: type[Node]):
+    for clz in root.__subclasses__():
+        generate_traversal(clz)
+        generate_traversals(clz)
+
+# Redo the generation at runtime, Ex. to print the children lists with debug_ast_children
+def regenerate_traversals():
+    FIELDS_CACHE.clear()
+    generate_traversals(Node)
 
 ## A scope contains a list of statements
 
-@dataclass
+@dataclass(slots=True)
 class Scope(Node):
     statements: list[Statement]
     info: ScopeInformation | None = None
 
 ## Begin concrete AST statements
 
-@dataclass
+@dataclass(slots=True)
 class Binding(Statement):
     mutable: bool
     name: ID
     init_val: Expression
     info: VarInfo | None = None
 
-@dataclass
+@dataclass(slots=True)
 class Assignment(Statement):
     name: ID
     src: Expression
-    target_span: SourceSpan
+    target_span: SpanId
     info: INFO_ID | None = None
 
-@dataclass
+@dataclass(slots=True)
 class NoOp(Statement):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class NewScope(Statement):
     body: Scope
 
-@dataclass
+@dataclass(slots=True)
 class IfStmt(Statement):
     test: Expression
     body: Scope
     orelse: Scope
 
-@dataclass
+@dataclass(slots=True)
 class While(Statement):
     test: Expression
     body: Scope
 
 ## Begin abstract AST expressions
 
-@dataclass
+@dataclass(slots=True)
 class RuntimeCall(Expression):
     args: IMM_EXPRS
     
@@ -223,6 +292,8 @@ class RuntimeCall(Expression):
         raise NotImplementedError
 
 class ConstLiteral(Expression):
+    __slots__ = ()
+
     def type(self) -> PrimType:
         raise NotImplementedError
     def val(self) -> int: # Underlying representation
@@ -230,7 +301,7 @@ class ConstLiteral(Expression):
 
 ## Begin concrete AST expressions
 
-@dataclass
+@dataclass(slots=True)
 class FixedArityCall(RuntimeCall):
     func_symbol: str # As in C
     arity: int
@@ -243,18 +314,18 @@ class FixedArityCall(RuntimeCall):
     def check(self) -> str | None:
         return None if len(self.args) == self.arity else f'expected {self.arity} argument(s) but given {len(self.args)}'
 
-@dataclass
+@dataclass(slots=True)
 class ImmConstLiteral(Expression):
     symbol: str
 
-@dataclass
+@dataclass(slots=True)
 class Name(Expression):
     name: ID
     info: INFO_ID | None = None
     # TODO: add additional information on how to access this variable
     # Stack offset in the CURRENT function (can be different from info.stack_offset when it is a closure free variable)
 
-@dataclass
+@dataclass(slots=True)
 class Integer(ConstLiteral):
     value: int
     def type(self) -> PrimType:
@@ -262,7 +333,7 @@ class Integer(ConstLiteral):
     def val(self) -> int:
         return self.value
 
-@dataclass
+@dataclass(slots=True)
 class Boolean(ConstLiteral):
     value: bool
     def type(self) -> PrimType:
@@ -270,7 +341,7 @@ class Boolean(ConstLiteral):
     def val(self) -> int:
         return int(self.value)
 
-@dataclass
+@dataclass(slots=True)
 class TypeLiteral(ConstLiteral):
     ty: PrimType
     def type(self) -> PrimType:
@@ -278,23 +349,23 @@ class TypeLiteral(ConstLiteral):
     def val(self) -> int:
         return self.ty.code()
 
-@dataclass
+@dataclass(slots=True)
 class Unit(ConstLiteral): # The only instance of 'None'
     def type(self) -> PrimType:
         return PrimType.NONE
     def val(self) -> int:
         return 0
 
-@dataclass
+@dataclass(slots=True)
 class StringLiteral(Expression):
     content: str
     data_label: str | None = None # Label in assembly to its data
 
-@dataclass
+@dataclass(slots=True)
 class GetType(Expression): # Could be a Prim1, but do not need ex to be immediate for ANF
     ex: Expression
 
-@dataclass
+@dataclass(slots=True)
 class IfExpr(Expression):
     test: Expression
     body: Expression
@@ -330,44 +401,61 @@ class BinOp(Enum):
     def symbol(self) -> str:
         return self.value
 
-@dataclass
+@dataclass(slots=True)
 class Prim1(Expression):
     op: UnaryOp
     ex1: IMM_EXPR
 
-@dataclass
+@dataclass(slots=True)
 class Prim2(Expression):
     op: BinOp
     left: IMM_EXPR
     right: IMM_EXPR
 
-@dataclass
+@dataclass(slots=True)
 class Print(Expression):
     args: IMM_EXPRS
 
-@dataclass
+@dataclass(slots=True)
 class Input(Expression):
     args: IMM_EXPRS
 
-@dataclass
+@dataclass(slots=True)
 class ExprScope(Expression):
     scope: Scope
 
-def mk_exprscope(span: SourceSpan, ss: list[Statement], expr: Expression, info: ScopeInformation | None = None) -> ExprScope:
+def mk_exprscope(span: SpanId, ss: list[Statement], expr: Expression, info: ScopeInformation | None = None) -> ExprScope:
     return ExprScope(span=span, scope=Scope(ss + [EvalExpr(span=expr.span, expr=expr)], info=info))
 
 # TODO: add function expr AST node that generates a unique ID upon instantiation
 # TODO: add class that encloses Scope inside Expression to allow ANF-transforms/let-bindings
 
 ## AST Node walker, will aid in tagging nodes
+# Walks are run by trampoline(), so that deeply nested programs do not hit the recursion limit
 
 C = TypeVar('C')
 
 class NodeWalker(Generic[C]):
     # Overrider decide the order of traversal (pre-order, in-order, post-order, etc.)
-    def walk(self, node: Node, ctx: C):
+    # Children are walked with `yield self.walk(child, ctx)`, and `yield from super().walk(node, ctx)`
+    def walk(self, node: Node, ctx: C) -> Walk[None]:
         for child in node.children():
-            self.walk(child, ctx)
+            yield self.walk(child, ctx)
+
+    def run(self, node: Node, ctx: C):
+        trampoline(self.walk(node, ctx))
+
+def count_nodes(top: Node) -> int:
+    count = 0
+    stack = [top]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children())
+    return count
+
+# All Node classes are defined in this module
+generate_traversals(Node)
 
 ## Users should import ID from common, not syntax since this is a foward reference
 del ID
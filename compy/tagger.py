@@ -2,43 +2,33 @@ from dataclasses import dataclass, field
 
 from compy.common import (ID, MAIN, CompiledFunction,
                           ImmutableVarError, MutableClosureVarError,
-                          SourceSpan, UnboundVarError)
+                          SpanId, UnboundVarError, Walk)
+from compy.passes import Visitor, Walker
 from compy.state import CompilerState
 from compy.syntax import (Assignment, Binding, Name, Node, NodeWalker, Scope,
                           ScopeInformation, VarInfo)
 
 MAIN_ID = 1
 
-def tag(state: CompilerState, top: Scope) -> list[CompiledFunction]:
-    funcs = tag_functions(state, top)
-    tag_variables(state, top)
-    return funcs
-
-# First pass, tag scopes with list of functions
-def tag_functions(state: CompilerState, top: Scope) -> list[CompiledFunction]:
-    FunctionTagger(state).walk(top, None)
+# Functions found by FunctionTagger
+def tagged_functions(top: Scope) -> list[CompiledFunction]:
     # TODO: extract functions discovered from instance variables
     return [CompiledFunction(symbol=MAIN, body=top, id=MAIN_ID)]
 
-# Second pass
-def tag_variables(state: CompilerState, top: Scope):
-    VariableTagger(state).walk(top, VariableContext(current_func_id=MAIN_ID))
-
 # Errors to check
 # Duplicate function names
 
+# First pass, tag scopes with list of functions
+# Post-order traversal (since functions are declared as children of scopes)
 @dataclass
-class FunctionTagger(NodeWalker[None]):
+class FunctionTagger(Visitor):
+    name = 'functions'
+    leave_types = (Scope,)
     state: CompilerState
-    def walk(self, node: Node, ctx: None):
-        match node:
-            case Scope():
-                super().walk(node, ctx)
-                # TODO: for now, assume no functions
-                node.info = ScopeInformation([])
-                # Post-order traversal (since functions are declared as children of scopes)
-            case _:
-                super().walk(node, ctx)
+    def leave(self, node: Node):
+        assert isinstance(node, Scope)
+        # TODO: for now, assume no functions
+        node.info = ScopeInformation([])
 
 @dataclass
 class VariableContext:
@@ -48,12 +38,18 @@ class VariableContext:
     def clone(self):
         return VariableContext(current_func_id=self.current_func_id, bindings=dict(self.bindings))
 
+# Second pass, needs the scopes in the context so it walks the tree by itself
 @dataclass
-class VariableTagger(NodeWalker[VariableContext]):
+class VariableTagger(NodeWalker[VariableContext], Walker):
+    name = 'variables'
+    after = ('functions',)
     state: CompilerState
+    def apply(self, top: Scope):
+        self.run(top, VariableContext(current_func_id=MAIN_ID))
+
     # TODO: keep track of current funct
-    def walk(self, node: Node, ctx: VariableContext):
-        def reference_name(name: ID, span: SourceSpan) -> VarInfo | None:
+    def walk(self, node: Node, ctx: VariableContext) -> Walk[None]:
+        def reference_name(name: ID, span: SpanId) -> VarInfo | None:
             if name not in ctx.bindings:
                 self.state.err(UnboundVarError(name, span))
                 return None
@@ -65,9 +61,9 @@ class VariableTagger(NodeWalker[VariableContext]):
             case Scope(info=info):
                 assert info != None, 'Untagged scope found'
                 assert info.funcs == [] # TODO: add function bindings to ctx as variables
-                super().walk(node, ctx.clone())
+                yield from super().walk(node, ctx.clone())
             case Binding(mutable=mutable, name=name):
-                super().walk(node, ctx)
+                yield from super().walk(node, ctx)
                 info = VarInfo(origin_function_id=ctx.current_func_id, mutable=mutable)
                 node.info = info
                 # TODO: issue shadowing warning here if name in ctx.bindings
@@ -77,7 +73,7 @@ class VariableTagger(NodeWalker[VariableContext]):
                     node.info = info
                 # Name is a leaf so no need to super().walk
             case Assignment(name=name, target_span=span):
-                super().walk(node, ctx)
+                yield from super().walk(node, ctx)
                 if (info := reference_name(name, span)) is None:
                     return
                 node.info = info
@@ -85,4 +81,4 @@ class VariableTagger(NodeWalker[VariableContext]):
                     self.state.err(ImmutableVarError(name, span))
             # TODO: case <function definition>: clone and change ctx.current_func_id
             case _:
-                super().walk(node, ctx)
+                yield from super().walk(node, ctx)
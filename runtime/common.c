@@ -1,5 +1,4 @@
 #include "common.h"
-#include "string.h"
 
 typedef const char * const const_str_t;
 
@@ -17,12 +16,3 @@ const char *to_typename(type_t type) {
     assertm(type < NUM_TYPES, "to_typename: Invalid type code");
     return type_names[type];
 }
-
-type_t from_typename(const char *name) {
-    for (type_t t = 0; t < NUM_TYPES; t++) {
-        if (!strcmp(type_names[t], name)) {
-            return t;
-        }
-    }
-    return TYPE_INVALID;
-}
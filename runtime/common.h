@@ -6,15 +6,23 @@
 // Macros
 #define assertm(exp, msg) assert(((void)msg, exp)) // assert with message
 #define UNUSED __attribute__((unused))
+#define UNLIKELY(exp) __builtin_expect(!!(exp), 0)
 
 // Types
 typedef unsigned long type_t;
+typedef long location_t; // for debug information
+
+// The pooled string literals: their length, then their bytes, which may include NUL and are not terminated by it
+typedef struct {
+    unsigned long len;
+    char chars[];
+} str_t;
 
 typedef union {
     signed long si_int; // signed int
     unsigned long un_int; // unsigned int
     double flt; // floating point
-    const char *str; // string literal
+    const str_t *str; // string literal
     type_t type;
 } value_t;
 
@@ -42,6 +50,13 @@ typedef const obj_t* arg_t;
 
 // Declarations
 const char *to_typename(type_t type);
-type_t from_typename(const char *name);
+void type_error(location_t location, const char* operation, type_t required_type, type_t found_type)
+    __attribute__ ((noreturn, cold));
+
+// Inlined into every operation, only the failure is a call
+static inline void assert_type(location_t location, const char* operation, arg_t arg, type_t required_type) {
+    if (UNLIKELY(arg->type != required_type))
+        type_error(location, operation, required_type, arg->type);
+}
 
 #endif /* COMPY_COMMON_H */
@@ -0,0 +1,97 @@
+#include <errno.h>
+#include <stdbool.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include "common.h"
+#include "input.h"
+#include "panic.h"
+
+static char input_block[IN_BUFFER_SIZE];
+// The unread part of the input is input_data[input_pos..input_size), either in `input_block` or in the mapping of stdin
+static const char *input_data = input_block;
+static size_t input_size = 0;
+static size_t input_pos = 0;
+static bool input_initialized = false;
+static bool input_mapped = false;
+
+// Reused by every line
+static char *line_buffer = NULL;
+static size_t line_buffer_capacity = 0;
+
+static void input_error(location_t location, int error) {
+    panic(location, IO_ERROR, "Error reading line: %s", strerror(error));
+}
+
+// Maps the rest of stdin when it is a regular file, from its current offset
+static void in_init(void) {
+    input_initialized = true;
+    struct stat st;
+    if (fstat(STDIN_FILENO, &st) || !S_ISREG(st.st_mode))
+        return;
+    off_t offset = lseek(STDIN_FILENO, 0, SEEK_CUR);
+    if (offset < 0 || offset >= st.st_size) // Ex. files like /proc/* that report a size of 0
+        return;
+    void *mapping = mmap(NULL, (size_t) st.st_size, PROT_READ, MAP_PRIVATE, STDIN_FILENO, 0);
+    if (mapping == MAP_FAILED)
+        return;
+    madvise(mapping, (size_t) st.st_size, MADV_SEQUENTIAL);
+    input_data = mapping;
+    input_size = (size_t) st.st_size;
+    input_pos = (size_t) offset;
+    input_mapped = true;
+}
+
+// Returns false at the end of the input
+static bool input_fill(location_t location) {
+    if (input_mapped)
+        return false;
+    ssize_t nread;
+    while ((nread = read(STDIN_FILENO, input_block, IN_BUFFER_SIZE)) < 0) {
+        if (errno != EINTR)
+            input_error(location, errno);
+    }
+    input_size = (size_t) nread;
+    input_pos = 0;
+    return nread > 0;
+}
+
+static void line_append(location_t location, size_t *len, const char *chars, size_t count) {
+    if (*len + count + 1 > line_buffer_capacity) {
+        size_t capacity = line_buffer_capacity ? line_buffer_capacity : 128;
+        while (*len + count + 1 > capacity)
+            capacity *= 2;
+        char *grown = realloc(line_buffer, capacity);
+        if (!grown)
+            input_error(location, ENOMEM);
+        line_buffer = grown;
+        line_buffer_capacity = capacity;
+    }
+    memcpy(line_buffer + *len, chars, count);
+    *len += count;
+}
+
+const char *in_line(location_t location) {
+    if (!input_initialized)
+        in_init();
+    size_t len = 0;
+    bool any = false; // The last line may not end with a newline
+    while (input_pos < input_size || input_fill(location)) {
+        any = true;
+        const char *start = input_data + input_pos;
+        const char *newline = memchr(start, '\n', input_size - input_pos);
+        size_t count = newline ? (size_t) (newline - start) : input_size - input_pos;
+        line_append(location, &len, start, count);
+        input_pos += count;
+        if (newline) {
+            input_pos++;
+            break;
+        }
+    }
+    if (!any)
+        return NULL;
+    line_buffer[len] = '\0';
+    return line_buffer;
+}
@@ -0,0 +1,15 @@
+#ifndef COMPY_INPUT_H
+#define COMPY_INPUT_H
+
+#include "common.h"
+
+// Buffered standard input, used instead of stdio to read lines
+// Stdin is mapped when it is a regular file, and otherwise read in blocks of IN_BUFFER_SIZE
+
+#define IN_BUFFER_SIZE (1 << 16)
+
+// The next line without its newline, or NULL at the end of the input
+// Owned by the input layer, valid until the next call
+const char *in_line(location_t location);
+
+#endif /* COMPY_INPUT_H */
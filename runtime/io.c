@@ -4,6 +4,7 @@
 #include <stdlib.h>
 #include "common.h"
 #include "panic.h"
+#include "regpass.h"
 // I/O utilities
 
 obj_t compy_time_int(UNUSED location_t dbg) {
@@ -32,3 +33,6 @@ obj_t compy_exit(location_t dbg, arg_t exit_code) {
     exit((int) code); // truncate to int (eventually actually & 0xff)
     // Never returns
 }
+
+REGPASS_PRIM1(compy_sleep)
+REGPASS_PRIM1(compy_exit)
@@ -1,6 +1,8 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include "panic.h"
+#include "output.h"
+#include "profile.h"
 
 // External references
 extern void compy_main(void);
@@ -8,6 +10,8 @@ extern void compy_main(void);
 // Main
 int main(void) {
     panic_dumpfile = getenv("COMPY_PANIC_DUMPFILE");
+    out_init();
+    profile_init();
     compy_main();
     return 0;
 }
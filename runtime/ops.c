@@ -7,17 +7,13 @@
 #include <string.h>
 #include <errno.h>
 #include "common.h"
+#include "input.h"
 #include "panic.h"
+#include "output.h"
+#include "regpass.h"
 
 const obj_t one = INT_VAL(1);
 
-// Support code that passes argument via registers (instead of pointers)
-/*
-#define REGPASS_PRIM1(name) obj_t name##_(location_t debug_info, obj_t o) { \
-                                return name(debug_info, &o); \
-                            }
-*/
-
 #define ARITH_OP(op_name, op_str) \
 obj_t compy_##op_name(location_t debug_info, arg_t x, arg_t y) { \
     assert_type(debug_info, op_str, x, TYPE_INT); \
@@ -51,7 +47,7 @@ obj_t compy_##op_name(location_t debug_info, arg_t left, arg_t right) { \
         panic(debug_info, DIV_BY_ZERO, "Division by zero"); \
     } \
     if ((lv == LONG_MIN) && (rv == -1L)) { \
-        panic(debug_info, ARITH_OVERFLOW, "Overflow on " #op_sym); \
+        panic(debug_info, ARITH_OVERFLOW, "Overflow on %s", #op_sym); \
     } \
     return INT_VAL(lv op_sym rv); \
 }
@@ -60,19 +56,19 @@ static void print_val(arg_t o) {
     // Print value without newlines
     switch (o->type) {
     case TYPE_INT:
-        printf("%ld", o->val.si_int);
+        out_long(o->val.si_int);
         break;
     case TYPE_NONE:
-        printf("None");
+        out_str("None");
         break;
     case TYPE_TYPE:
-        printf("%s", to_typename(o->val.type));
+        out_str(to_typename(o->val.type));
         break;
     case TYPE_BOOL:
-        printf(o->val.un_int ? "True" : "False");
+        out_str(o->val.un_int ? "True" : "False");
         break;
     case TYPE_STRING:
-        printf("%s", o->val.str);
+        out_write(o->val.str->chars, o->val.str->len);
         break;
     
     default:
@@ -80,31 +76,79 @@ static void print_val(arg_t o) {
     }
 }
 
-static obj_t eval(location_t loc, const char *expr) {
-    type_t type = from_typename(expr);
-    if (type != TYPE_INVALID)
-        return TYPE_VAL(type);
-    char *endptr;
-    if (!strcmp("True", expr)) {
-        return BOOL_VAL(1);
-    } else if (!strcmp("False", expr)) {
-        return BOOL_VAL(0);
-    } else if (!strcmp("None", expr)) {
-        return NONE_VAL;
+// What input() recognizes besides integers, placed by a perfect hash of the first two characters and the length
+typedef struct {
+    const char *name;
+    size_t len;
+    obj_t value;
+} keyword_t;
+
+#define KEYWORDS_SIZE (16)
+#define KEYWORD_HASH(name, len) (((unsigned long) (name)[0] + 2 * (unsigned long) (name)[1] + 2 * (len)) % KEYWORDS_SIZE)
+#define KEYWORD_LEN_MIN (3)
+#define KEYWORD_LEN_MAX (8)
+
+static const keyword_t keywords[KEYWORDS_SIZE] = {
+    [0] = {"True", 4, BOOL_VAL(1)},
+    [1] = {"str", 3, TYPE_VAL(TYPE_STRING)},
+    [2] = {"False", 5, BOOL_VAL(0)},
+    [4] = {"None", 4, NONE_VAL},
+    [8] = {"bool", 4, TYPE_VAL(TYPE_BOOL)},
+    [11] = {"int", 3, TYPE_VAL(TYPE_INT)},
+    [12] = {"NoneType", 8, TYPE_VAL(TYPE_NONE)},
+    [14] = {"type", 4, TYPE_VAL(TYPE_TYPE)},
+};
+
+static const keyword_t *find_keyword(const char *expr) {
+    size_t len = strlen(expr);
+    if (len < KEYWORD_LEN_MIN || len > KEYWORD_LEN_MAX)
+        return NULL;
+    const keyword_t *keyword = &keywords[KEYWORD_HASH(expr, len)];
+    if (keyword->len != len || memcmp(keyword->name, expr, len))
+        return NULL;
+    return keyword;
+}
+
+// Accepts the same integers as strtol in base 10, with the same errors
+static obj_t eval_int(location_t loc, const char *expr) {
+    const char *p = expr;
+    while (*p == ' ' || (*p >= '\t' && *p <= '\r'))
+        p++;
+    bool negative = *p == '-';
+    if (*p == '-' || *p == '+')
+        p++;
+    // The magnitude of LONG_MIN is one more than LONG_MAX
+    unsigned long limit = (unsigned long) LONG_MAX + negative;
+    unsigned long magnitude = 0;
+    bool overflow = false;
+    const char *digits = p;
+    for (; *p >= '0' && *p <= '9'; p++) {
+        unsigned long digit = (unsigned long) (*p - '0');
+        if (magnitude > (limit - digit) / 10)
+            overflow = true;
+        else
+            magnitude = magnitude * 10 + digit;
     }
-    errno = 0;
-    long ival = strtol(expr, &endptr, 10);
-    if (errno) {
+    if (overflow) {
         // TODO: introduce a new syntax error for evaluation
-        panic(loc, EVAL_SYNTAX, "Bad integer %s: %s", expr, strerror(errno));
+        panic(loc, EVAL_SYNTAX, "Bad integer %s: %s", expr, strerror(ERANGE));
     }
-    if (endptr == expr) {
+    if (p == digits) {
         panic(loc, EVAL_SYNTAX, "Bad expression '%s'", expr);
     }
-    if (*endptr != '\0') { // Disallow things like 1j for now
-        panic(loc, EVAL_SYNTAX, "Integer with trailing suffix '%s' not allowed: %s", endptr, expr);
+    if (*p != '\0') { // Disallow things like 1j for now
+        panic(loc, EVAL_SYNTAX, "Integer with trailing suffix '%s' not allowed: %s", p, expr);
+    }
+    return INT_VAL(negative ? (long) (0 - magnitude) : (long) magnitude);
+}
+
+static obj_t eval(location_t loc, const char *expr) {
+    if ((*expr >= 'A' && *expr <= 'Z') || (*expr >= 'a' && *expr <= 'z')) {
+        const keyword_t *keyword = find_keyword(expr);
+        if (keyword)
+            return keyword->value;
     }
-    return INT_VAL(ival);
+    return eval_int(loc, expr);
 }
 
 /////////////////////
@@ -113,19 +157,19 @@ static obj_t eval(location_t loc, const char *expr) {
 
 // Misc
 
-#define SEP " " // TODO: allow customizing this value later on
-#define END "\n"
+#define SEP ' ' // TODO: allow customizing this value later on
+#define END '\n'
 
 obj_t print_variadic(UNUSED location_t debug_info, int nargs, ...) {
     va_list args;
     va_start(args, nargs);
     for (int i = 0; i < nargs; i++) {
         if (i)
-            printf("%s", SEP);
+            out_char(SEP);
         print_val(va_arg(args, arg_t));
     }
     va_end(args);
-    printf("%s", END);
+    out_char(END);
     return NONE_VAL;
 }
 
@@ -136,37 +180,21 @@ obj_t print_variadic(UNUSED location_t debug_info, int nargs, ...) {
 
 // Arithmetic
 
-// Caller MUST free the returned line after use (transfer ownership of pointer to caller)
-static char *input_line(location_t debug_info, arg_t prompt) {
+static const char *input_line(location_t debug_info, arg_t prompt) {
     if (prompt) { // Not NULL
         print_val(prompt);
-        fflush(stdout);
-    }
-    char *line = NULL;
-    size_t len = 0;
-    ssize_t nread;
-
-    if ((nread = getline(&line, &len, stdin)) == -1) {
-        if (feof(stdin)) {
-            panic(debug_info, IO_ERROR, "Reached EOF when reading a line");
-        }
-        panic(debug_info, IO_ERROR, "Error reading line: %s", strerror(errno));
+        out_flush();
     }
-
-    // Strip ending newline
-    if (nread && line[nread - 1] == '\n') {
-        line[nread - 1] = '\0';
+    const char *line = in_line(debug_info);
+    if (!line) {
+        panic(debug_info, IO_ERROR, "Reached EOF when reading a line");
     }
-
     return line;
 }
 
 // The Python 2 input()
 obj_t eval_input(location_t debug_info, arg_t prompt) {
-    char *line = input_line(debug_info, prompt); // TODO: ignore starting and trailing newlines
-    obj_t res = eval(debug_info, line);
-    free(line);
-    return res;
+    return eval(debug_info, input_line(debug_info, prompt)); // TODO: ignore starting and trailing newlines
 }
 
 obj_t negate(location_t debug_info, arg_t x) {
@@ -250,3 +278,24 @@ CMP_OP(is_lt, <)
 CMP_OP(is_gt, >)
 CMP_OP(is_le, <=)
 CMP_OP(is_ge, >=)
+
+// Register ABI wrappers (see regpass.h)
+
+REGPASS_PRIM1(negate)
+REGPASS_PRIM1(add1)
+REGPASS_PRIM1(sub1)
+REGPASS_PRIM1(boolean_not)
+
+REGPASS_PRIM2(compy_add)
+REGPASS_PRIM2(compy_sub)
+REGPASS_PRIM2(compy_mul)
+REGPASS_PRIM2(compy_div)
+REGPASS_PRIM2(compy_mod)
+REGPASS_PRIM2(is_identical)
+REGPASS_PRIM2(is_eq)
+REGPASS_PRIM2(is_lt)
+REGPASS_PRIM2(is_gt)
+REGPASS_PRIM2(is_le)
+REGPASS_PRIM2(is_ge)
+REGPASS_PRIM2(boolean_and)
+REGPASS_PRIM2(boolean_or)
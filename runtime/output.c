@@ -0,0 +1,95 @@
+#include <errno.h>
+#include <stdbool.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include "common.h"
+#include "output.h"
+
+static char buffer[OUT_BUFFER_SIZE];
+static size_t used = 0;
+static bool line_buffered = false;
+
+static const char DIGIT_PAIRS[] =
+    "00010203040506070809"
+    "10111213141516171819"
+    "20212223242526272829"
+    "30313233343536373839"
+    "40414243444546474849"
+    "50515253545556575859"
+    "60616263646566676869"
+    "70717273747576777879"
+    "80818283848586878889"
+    "90919293949596979899";
+
+// Longest decimal representation of a long, with the sign
+#define LONG_DIGITS_MAX (20)
+
+void out_init(void) {
+    const char *env = getenv(LINE_BUFFERED_ENV);
+    line_buffered = env ? strcmp(env, "0") != 0 : isatty(STDOUT_FILENO);
+    atexit(out_flush);
+}
+
+static void write_all(const char *data, size_t len) {
+    while (len) {
+        ssize_t written = write(STDOUT_FILENO, data, len);
+        if (written < 0) {
+            if (errno == EINTR)
+                continue;
+            return; // Like stdio, output errors are not reported
+        }
+        data += written;
+        len -= (size_t) written;
+    }
+}
+
+void out_flush(void) {
+    write_all(buffer, used);
+    used = 0;
+}
+
+void out_write(const char *data, size_t len) {
+    if (len > OUT_BUFFER_SIZE - used) {
+        out_flush();
+        if (len >= OUT_BUFFER_SIZE) { // Too large to be worth copying
+            write_all(data, len);
+            return;
+        }
+    }
+    memcpy(buffer + used, data, len);
+    used += len;
+    if (line_buffered && memchr(data, '\n', len))
+        out_flush();
+}
+
+void out_str(const char *str) {
+    out_write(str, strlen(str));
+}
+
+void out_char(char c) {
+    out_write(&c, 1);
+}
+
+void out_long(long value) {
+    char digits[LONG_DIGITS_MAX];
+    char *start = digits + LONG_DIGITS_MAX;
+    // Negate as unsigned so that LONG_MIN does not overflow
+    unsigned long magnitude = value < 0 ? -(unsigned long) value : (unsigned long) value;
+    while (magnitude >= 100) {
+        const char *pair = DIGIT_PAIRS + 2 * (magnitude % 100);
+        magnitude /= 100;
+        *--start = pair[1];
+        *--start = pair[0];
+    }
+    if (magnitude >= 10) {
+        const char *pair = DIGIT_PAIRS + 2 * magnitude;
+        *--start = pair[1];
+        *--start = pair[0];
+    } else {
+        *--start = (char) ('0' + magnitude);
+    }
+    if (value < 0)
+        *--start = '-';
+    out_write(start, (size_t) (digits + LONG_DIGITS_MAX - start));
+}
@@ -0,0 +1,19 @@
+#ifndef COMPY_OUTPUT_H
+#define COMPY_OUTPUT_H
+
+#include <stddef.h>
+
+// Buffered standard output, used instead of stdio to print values
+// Fully buffered unless stdout is a TTY or COMPY_LINE_BUFFERED is set (to anything but "0")
+
+#define LINE_BUFFERED_ENV "COMPY_LINE_BUFFERED"
+#define OUT_BUFFER_SIZE (1 << 16)
+
+void out_init(void);
+void out_write(const char *data, size_t len);
+void out_str(const char *str);
+void out_char(char c);
+void out_long(long value);
+void out_flush(void);
+
+#endif /* COMPY_OUTPUT_H */
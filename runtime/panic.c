@@ -3,6 +3,7 @@
 #include <stdarg.h>
 #include "common.h"
 #include "panic.h"
+#include "output.h"
 
 const char* panic_dumpfile; // Used to facilitate testing
 
@@ -29,19 +30,20 @@ void dump_panic_reason(const char* reason) {
 
 void panic(location_t location, reason_t reason, const char *fmt, ...) {
     const char* reason_str = str_reason(reason);
+    out_flush(); // Output printed before the panic comes first
     fprintf(stderr, "[!] Panic (%s) at line %ld: ", reason_str, location);
     va_list args;
     va_start(args, fmt);
     vfprintf(stderr, fmt, args);
     va_end(args);
-    putchar('\n');
+    out_char('\n');
+    out_flush();
     dump_panic_reason(reason_str);
     exit(PANIC_EXIT_CODE);
 }
 
-// TODO: inline this
-void assert_type(location_t location, const char* operation, arg_t arg, type_t required_type) {
-    if (arg->type != required_type)
-        panic(location, TYPE_ERROR, "%s expected type %s, but %s found",
-            operation, to_typename(required_type), to_typename(arg->type));
+// The slow path of assert_type (common.h)
+void type_error(location_t location, const char* operation, type_t required_type, type_t found_type) {
+    panic(location, TYPE_ERROR, "%s expected type %s, but %s found",
+        operation, to_typename(required_type), to_typename(found_type));
 }
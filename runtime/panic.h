@@ -6,8 +6,6 @@
 // Same choice as Rust, help distinguish between the common programmatic exit(1)
 #define PANIC_EXIT_CODE (101)
 
-typedef long location_t; // for debug information
-
 // Add panic reasons here
 #define FOREACH_REASON(FUNC) \
     FUNC(TYPE_ERROR) \
@@ -26,7 +24,6 @@ typedef enum {
 
 extern const char* panic_dumpfile;
 
-void panic(location_t location, reason_t reason, const char *fmt, ...) __attribute__ ((noreturn));
-void assert_type(location_t location, const char* operation, arg_t arg, type_t required_type);
+void panic(location_t location, reason_t reason, const char *fmt, ...) __attribute__ ((noreturn, cold, format (printf, 3, 4)));
 
 #endif /* COMPY_PANIC_H */
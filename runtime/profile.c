@@ -0,0 +1,56 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include "common.h"
+#include "profile.h"
+
+// One per line of the source (see LINE_COUNTS in compy/codegen.py)
+typedef struct {
+    unsigned long executions;
+    unsigned long calls; // Of runtime functions
+} line_count_t;
+
+// Defined by the generated code with --profile-lines only, NULL otherwise
+extern line_count_t compy_line_counts[] __attribute__((weak));
+extern const unsigned long compy_line_counts_size __attribute__((weak));
+
+static const char *profile_path;
+
+static int hotter(const void *a, const void *b) {
+    const line_count_t *x = &compy_line_counts[*(const unsigned long *) a];
+    const line_count_t *y = &compy_line_counts[*(const unsigned long *) b];
+    if (x->executions != y->executions)
+        return x->executions < y->executions ? 1 : -1;
+    if (x->calls != y->calls)
+        return x->calls < y->calls ? 1 : -1;
+    return *(const unsigned long *) a < *(const unsigned long *) b ? -1 : 1;
+}
+
+static void profile_dump(void) {
+    unsigned long size = compy_line_counts_size;
+    unsigned long *lines = malloc(size * sizeof(unsigned long));
+    FILE *report = fopen(profile_path, "w");
+    if (!lines || !report) {
+        perror("Failed to write the line profile");
+        free(lines);
+        return;
+    }
+    unsigned long hot = 0;
+    for (unsigned long line = 0; line < size; line++) {
+        if (compy_line_counts[line].executions || compy_line_counts[line].calls)
+            lines[hot++] = line;
+    }
+    qsort(lines, hot, sizeof(unsigned long), hotter);
+    fprintf(report, "line executions calls\n");
+    for (unsigned long i = 0; i < hot; i++) {
+        const line_count_t *count = &compy_line_counts[lines[i]];
+        fprintf(report, "%lu %lu %lu\n", lines[i], count->executions, count->calls);
+    }
+    fclose(report);
+    free(lines);
+}
+
+void profile_init(void) {
+    profile_path = getenv(PROFILE_ENV);
+    if (profile_path && compy_line_counts)
+        atexit(profile_dump);
+}
@@ -0,0 +1,11 @@
+#ifndef COMPY_PROFILE_H
+#define COMPY_PROFILE_H
+
+// Line counts of programs compiled with --profile-lines, written at exit
+// to the file named by COMPY_PROFILE, hottest lines first
+
+#define PROFILE_ENV "COMPY_PROFILE"
+
+void profile_init(void);
+
+#endif /* COMPY_PROFILE_H */
@@ -0,0 +1,31 @@
+#ifndef COMPY_REGPASS_H
+#define COMPY_REGPASS_H
+
+#include "common.h"
+#include "panic.h"
+
+// Wrappers taking each object as a (value, type) register pair instead of a pointer
+// Used by the register runtime ABI (--runtime-abi=reg), named after the wrapped function with a `_r` suffix
+
+#define REGPASS_OBJ(n) const obj_t o##n = {.val = {.un_int = v##n}, .type = t##n}
+
+#define REGPASS_PRIM1(name) \
+obj_t name##_r(location_t debug_info, unsigned long v1, type_t t1) { \
+    REGPASS_OBJ(1); \
+    return name(debug_info, &o1); \
+}
+
+#define REGPASS_PRIM2(name) \
+obj_t name##_r(location_t debug_info, unsigned long v1, type_t t1, unsigned long v2, type_t t2) { \
+    REGPASS_OBJ(1); \
+    REGPASS_OBJ(2); \
+    return name(debug_info, &o1, &o2); \
+}
+
+// Sample expansion:
+// obj_t add1_r(location_t debug_info, unsigned long v1, type_t t1) {
+//     const obj_t o1 = {.val = {.un_int = v1}, .type = t1};
+//     return add1(debug_info, &o1);
+// }
+
+#endif /* COMPY_REGPASS_H */
@@ -0,0 +1,73 @@
+# Time and peak memory of codegen, peephole and assembly output as the program grows,
+# which should all stay linear in the size of the program
+# Usage: python3 -m tests.bench_codegen [number of statements]
+
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import compy.anf
+import compy.asm
+import compy.checker
+import compy.codegen
+import compy.constfold
+import compy.inference
+import compy.parser
+import compy.regalloc
+import compy.stack
+import compy.strliteral
+import compy.tagger
+from compy.common import CompiledFunction, CompileOptions, CompilerInfo, DebugFlags
+from compy.passes import PassManager
+from compy.state import CompilerState
+from tests.bench_traversal import make_source
+
+def front_end(source: str) -> tuple[CompilerInfo, list[CompiledFunction]]:
+    state = CompilerState()
+    info = CompilerInfo('<bench>', '<bench>', '<bench>', DebugFlags(False, False, False),
+                        io.StringIO(), io.StringIO(), state, CompileOptions())
+    top = compy.parser.parse(source, state.spans, '<bench>')
+    PassManager().run(top, [
+        compy.checker.Checker(state),
+        compy.strliteral.StringTagger(state),
+        compy.tagger.FunctionTagger(state),
+        compy.tagger.VariableTagger(state),
+    ])
+    funcs = compy.tagger.tagged_functions(top)
+    compy.inference.infer(funcs)
+    compy.anf.anf(state, funcs)
+    compy.constfold.fold(state, funcs)
+    compy.regalloc.allocate_registers(funcs)
+    compy.stack.allocate_stack(funcs)
+    return info, funcs
+
+def back_end(info: CompilerInfo, funcs: list[CompiledFunction], nasm_path: str) -> int:
+    lines = compy.asm.Peephole().run(compy.codegen.compile_prog(info, funcs))
+    with open(nasm_path, 'w') as nasm:
+        compy.asm.output(nasm, lines)
+    return len(lines)
+
+def main():
+    statements = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for scale in [1, 2, 4]:
+            source = make_source(statements * scale)
+            nasm_path = os.path.join(tmpdir, 'bench.nasm')
+            info, funcs = front_end(source)
+            start = time.perf_counter()
+            count = back_end(info, funcs, nasm_path)
+            elapsed = time.perf_counter() - start
+            # Separately, since tracing slows down everything
+            info, funcs = front_end(source)
+            tracemalloc.start()
+            back_end(info, funcs, nasm_path)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'{count:8} lines in {elapsed:6.2f} s ({elapsed / count * 1e6:5.1f} us/line), '
+                  f'peak {peak / 2**20:7.1f} MiB ({peak / count:4.0f} bytes/line)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+# Memory used by the AST of a large generated program, as measured by tracemalloc
+# Usage: python3 -m tests.bench_memory [number of nodes]
+
+import sys
+import time
+import tracemalloc
+
+import compy.parser
+from compy.common import SpanTable
+from compy.syntax import count_nodes
+from tests.bench_traversal import make_source
+
+NODES_PER_STATEMENT = 26 # Of make_source, on average
+
+def main():
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    source = make_source(nodes // NODES_PER_STATEMENT)
+    tracemalloc.start()
+    start = time.perf_counter()
+    top = compy.parser.parse(source, SpanTable(), '<bench>')
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = count_nodes(top)
+    print(f'{count} nodes parsed in {elapsed:.1f} s')
+    print(f'AST: {current / 2**20:.1f} MiB ({current / count:.0f} bytes/node), peak during parsing: {peak / 2**20:.1f} MiB')
+
+if __name__ == '__main__':
+    main()
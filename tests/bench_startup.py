@@ -0,0 +1,38 @@
+# Startup latency of the executables in each link mode: the time from spawning a program whose main
+# exits right away to its exit, which is mostly exec, the dynamic loader and libc initialization
+# Usage: python3 -m tests.bench_startup [number of runs]
+
+import io
+import os
+import sys
+import tempfile
+import time
+
+import compy
+from compy.common import LinkMode
+
+SOURCE = 'exit(0)\n'
+
+def spawn_time(path: str, runs: int) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        pid = os.posix_spawn(path, [path], os.environ)
+        os.waitpid(pid, 0)
+    return (time.perf_counter() - start) / runs
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src_path = os.path.join(tmpdir, 'startup' + compy.SUFFIX)
+        with open(src_path, 'w') as src:
+            src.write(SOURCE)
+        for mode in LinkMode:
+            out_path = os.path.join(tmpdir, mode.value)
+            compy.main([src_path, '--no-cache', '--runtime-profile', 'release', '--link', mode.value, '-o', out_path],
+                       stdout=io.StringIO(), stderr=io.StringIO())
+            spawn_time(out_path, 10) # Warm up the page cache
+            elapsed = spawn_time(out_path, runs)
+            print(f'{mode.value:8} {elapsed * 1e6:7.1f} us/run, {os.path.getsize(out_path) / 1024:6.0f} KiB')
+
+if __name__ == '__main__':
+    main()
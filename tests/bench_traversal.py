@@ -0,0 +1,48 @@
+# Microbenchmark of AST traversal: reflective Node.children/rewrite_children
+# against the per-class generated versions
+# Usage: python3 -m tests.bench_traversal [number of statements]
+
+import sys
+import timeit
+
+import compy.parser
+from compy.common import SpanTable, Walk, trampoline
+from compy.syntax import Node
+
+REPEAT = 5
+
+def make_source(statements: int) -> str:
+    lines = ['var(x := 1)', 'val(y := 2)']
+    for i in range(statements):
+        lines.append(f'x = add1(x) + y * {i} - (x if x < {i} else -y)')
+        lines.append(f'print(x, y, x == {i}, not (x < y))')
+    return '\n'.join(lines) + '\n'
+
+def walk(node: Node, children) -> int:
+    count = 1
+    for child in children(node):
+        count += walk(child, children)
+    return count
+
+def rewrite(node: Node, rewrite_children) -> Walk[Node]:
+    yield from rewrite_children(node, lambda child, _: rewrite(child, rewrite_children))
+    return node
+
+def bench(name: str, action) -> float:
+    best = min(timeit.repeat(action, number=1, repeat=REPEAT))
+    print(f'{name:<30}{best * 1000:10.2f} ms')
+    return best
+
+def main():
+    statements = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    top = compy.parser.parse(make_source(statements), SpanTable(), '<bench>')
+    print(f'{walk(top, lambda node: node.children())} nodes')
+    reflective = bench('children (reflective)', lambda: walk(top, Node.children))
+    generated = bench('children (generated)', lambda: walk(top, lambda node: node.children()))
+    print(f'speedup: {reflective / generated:.1f}x')
+    reflective = bench('rewrite_children (reflective)', lambda: trampoline(rewrite(top, Node.rewrite_children)))
+    generated = bench('rewrite_children (generated)', lambda: trampoline(rewrite(top, lambda node, fn: node.rewrite_children(fn))))
+    print(f'speedup: {reflective / generated:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,10 @@ from enum import Enum, auto
 import io
 import os
 import subprocess
+import tempfile
 from typing import Any, Type
 import unittest, compy
+from compy.cache import CACHE_DIR_ENV
 from compy.common import CompileError
 
 PATH_SPEC = str | list[str]
@@ -14,6 +16,11 @@ TESTCASE_DIR = './testcases/'
 TEMP_OUTPUT = './testexe.out'
 DUMPFILE = '.compy_panic'
 DUMP_ENV = 'COMPY_PANIC_DUMPFILE'
+PROFILE_ENV = 'COMPY_PROFILE'
+
+# Keep test compilations out of the user's executable cache, removed at exit
+TEST_CACHE = tempfile.TemporaryDirectory(prefix='compy-test-cache-')
+os.environ[CACHE_DIR_ENV] = TEST_CACHE.name
 
 class AutoName(Enum):
     @staticmethod
@@ -35,6 +42,10 @@ class CompyTestCase(unittest.TestCase):
     # Can override to change the prefix path to test cases
     def prefix(self) -> list[str]:
         return []
+
+    # Can override to rerun test cases with different compiler options
+    def compiler_args(self) -> list[str]:
+        return []
     
     def assertOutput(self, args: list[str], expected_stdout: bytes,
                     expected_stderr: bytes = b'', expected_exit: int = EXIT_SUCCESS,
@@ -60,7 +71,7 @@ class CompyTestCase(unittest.TestCase):
         assert src_path, 'src_path cannot be an empty list!'
         prog_path = TESTCASE_DIR + '/'.join(src_path) + compy.SUFFIX
         def run_compiler():
-            compy.main(args=[prog_path, '-o', TEMP_OUTPUT], stdout=io.StringIO(), stderr=io.StringIO())
+            compy.main(args=[prog_path, *self.compiler_args(), '-o', TEMP_OUTPUT], stdout=io.StringIO(), stderr=io.StringIO())
         match prog.expected_outcome:
             case Success(output=stdout, stderr=stderr, return_code=retcode):
                 run_compiler()
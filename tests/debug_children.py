@@ -1,11 +1,12 @@
 from pprint import pprint
 
-from compy.common import SourceSpan
+from compy.common import SpanTable
 from compy.syntax import *
 
-ss = SourceSpan(1, None, 1, None)
-ss2 = SourceSpan(2, None, 2, None)
-ss3 = SourceSpan(3, None, 3, None)
+spans = SpanTable()
+ss = spans.add(1, None, 1, None)
+ss2 = spans.add(2, None, 2, None)
+ss3 = spans.add(3, None, 3, None)
 
 def debug_children(n: Node):
     print(f'======CLASS {type(n)}======')
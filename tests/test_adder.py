@@ -71,6 +71,16 @@ class TestTypedAdder(common.CompyTestCase):
     def test_types_var(self):
         self.success_case('types-var', b'int\nNoneType\n')
 
+    def test_flow(self):
+        self.success_case('flow', FLOW_OUTPUT, stdin=b'5\n')
+        self.success_case('flow', FLOW_OUTPUT.replace(b'5 int', b'None NoneType'), stdin=b'None\n')
+
+    def test_flow_negative(self):
+        self.runtime_failure('flow-e', common.PanicReason.TYPE_ERROR)
+
+    def test_slots(self):
+        self.success_case('slots', b'3 4 12 9 13 26 int\n28 None False\n0 -18 12 9 NoneType\n', stdin=b'3\n4\nNone\n')
+
 STRESS_OUTPUT = b'''-123
 123
 6
@@ -134,6 +144,15 @@ VARS3_OUTPUT = b'''124
 -125
 '''
 
+FLOW_OUTPUT = b'''0 int
+None NoneType
+0 int
+None NoneType
+False True
+42 int
+5 int
+'''
+
 TYPES_OUTPUT = b'''NoneType
 int
 type
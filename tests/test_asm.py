@@ -0,0 +1,16 @@
+import unittest
+from compy.asm import AsmLine, MemRegOffset, Peephole, Reg, mov
+
+class TestPeephole(unittest.TestCase):
+    def optimize(self, lines: list[AsmLine]) -> list[AsmLine]:
+        return Peephole().run(lines)
+
+    def test_store_load(self):
+        slot = MemRegOffset(Reg.RBP, -8)
+        self.assertEqual([mov(slot, Reg.RAX)], self.optimize([mov(slot, Reg.RAX), mov(Reg.RAX, slot)]))
+
+    def test_load_through_own_base(self):
+        # The store goes to another address, after the load changed rax
+        field = MemRegOffset(Reg.RAX, 8)
+        lines = [mov(Reg.RAX, field), mov(field, Reg.RAX)]
+        self.assertEqual(lines, self.optimize(list(lines)))
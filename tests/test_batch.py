@@ -0,0 +1,56 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import compy
+from compy.common import UserError
+from tests import common
+
+class TestBatch(common.CompyTestCase):
+    def setUp(self):
+        self.src_dir = tempfile.TemporaryDirectory()
+        self.out_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.src_dir.cleanup()
+        self.out_dir.cleanup()
+
+    def copy_sources(self, names: list[str]):
+        for name in names:
+            shutil.copy(common.TESTCASE_DIR + name + compy.SUFFIX,
+                        os.path.join(self.src_dir.name, os.path.basename(name) + compy.SUFFIX))
+
+    def batch(self, *args: str):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        try:
+            compy.main(args=['--batch', self.src_dir.name, '-o', self.out_dir.name, '--no-cache', *args],
+                       stdout=stdout, stderr=stderr)
+        finally:
+            self.stdout, self.stderr = stdout.getvalue(), stderr.getvalue()
+
+    def exe(self, name: str) -> str:
+        return os.path.join(self.out_dir.name, os.path.basename(name) + '.out')
+
+    def test_batch(self):
+        self.copy_sources(['io/print-anf', 'adder/print1'])
+        self.batch('-j', '2')
+        self.assertIn('2 of 2 files compiled', self.stdout)
+        self.assertOutput([self.exe('print-anf')], b'5274 9 -25 4\n')
+        self.assertOutput([self.exe('print1')], b'2\n')
+
+    def test_batch_failure(self):
+        self.copy_sources(['io/print-anf', 'checker/int-bounds/big'])
+        with self.assertRaises(UserError):
+            self.batch()
+        self.assertIn('1 of 2 files compiled', self.stdout)
+        # The diagnostics of the failed file are reported, and the other file is still built
+        self.assertIn('big.compy:1:', self.stderr)
+        self.assertIn('FAILED', self.stderr)
+        self.assertOutput([self.exe('print-anf')], b'5274 9 -25 4\n')
+
+    def test_batch_run(self):
+        # argparse reports usage errors on sys.stderr
+        with contextlib.redirect_stderr(io.StringIO()) as usage, self.assertRaises(SystemExit):
+            self.batch('-r')
+        self.assertIn('--run cannot be used with --batch', usage.getvalue())
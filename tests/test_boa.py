@@ -1,8 +1,15 @@
+import io
+import subprocess
+import compy
 from compy.common import CompileError
 from tests import common
 
 
 BOA = 'boa'
+REG_ABI_ARGS = ['--runtime-abi', 'reg']
+RELEASE_ARGS = ['--runtime-profile', 'release']
+AMALGAMATION_ARGS = ['--runtime-profile', 'amalgamation']
+STATIC_ARGS = ['--link', 'static']
 
 class TestBoa(common.CompyTestCase):
     def prefix(self) -> list[str]:
@@ -22,6 +29,10 @@ class TestBoa(common.CompyTestCase):
         for i in range(1, 3+1):
             self.runtime_failure(f'mult-e-ovf{i}', common.PanicReason.ARITH_OVERFLOW)
 
+    def test_arith_e_ty(self):
+        for name in ['plus-e-ty', 'sub-e-ty', 'mult-e-ty']:
+            self.runtime_failure(name, common.PanicReason.TYPE_ERROR)
+
     def test_arith(self):
         self.success_case('arith', b'889\n-98\n8\n10\n221\n-30\n-30\n39\n84\n10000\n')
 
@@ -40,6 +51,14 @@ class TestBoa(common.CompyTestCase):
     def test_mod0(self):
         self.success_case('mod0', b'68392\n')
 
+    def test_fold(self):
+        self.success_case('fold', b'13 168 int -13 33 0 True True\nTrue 1\n9223372036854775806\n')
+
+    def test_fold_negative(self):
+        self.runtime_failure('fold-e-ovf', common.PanicReason.ARITH_OVERFLOW)
+        self.runtime_failure('fold-e-zero', common.PanicReason.DIV_BY_ZERO)
+        self.runtime_failure('fold-e-ty', common.PanicReason.TYPE_ERROR)
+
 class TestBoaBool(common.CompyTestCase):
     def prefix(self) -> list[str]:
         return [BOA, 'bool']
@@ -65,6 +84,58 @@ class TestBoaBool(common.CompyTestCase):
     def test_if1(self):
         self.success_case('if1', b'1\n20\n31\n30\n')
 
+    def test_branch(self):
+        self.success_case('branch', b'10 104\nsame\n2\n', stdin=b'10\nTrue\n')
+        self.success_case('branch', b'4 43\nsame\n1\n', stdin=b'4\nFalse\n')
+
+    def test_branch_negative(self):
+        self.runtime_failure('branch-e-ty', common.PanicReason.TYPE_ERROR, stdin=b'None\n')
+
+# Same test cases, passing objects to the runtime in registers
+class TestBoaRegAbi(TestBoa):
+    def compiler_args(self) -> list[str]:
+        return REG_ABI_ARGS
+
+class TestBoaBoolRegAbi(TestBoaBool):
+    def compiler_args(self) -> list[str]:
+        return REG_ABI_ARGS
+
+# Same test cases, against the optimized builds of the runtime
+class TestBoaRelease(TestBoa):
+    def compiler_args(self) -> list[str]:
+        return RELEASE_ARGS
+
+class TestBoaAmalgamation(TestBoa):
+    def compiler_args(self) -> list[str]:
+        return AMALGAMATION_ARGS
+
+# Same test cases, in static executables
+class TestBoaStatic(TestBoa):
+    def compiler_args(self) -> list[str]:
+        return STATIC_ARGS
+
+class TestBoaBoolStatic(TestBoaBool):
+    def compiler_args(self) -> list[str]:
+        return STATIC_ARGS
+
+class TestStaticLink(common.CompyTestCase):
+    # The functions defined in the executable
+    def functions(self, src_path: str) -> set[str]:
+        compy.main([common.TESTCASE_DIR + src_path + compy.SUFFIX, *STATIC_ARGS, '-o', common.TEMP_OUTPUT],
+                   stdout=io.StringIO(), stderr=io.StringIO())
+        symbols = subprocess.run(['nm', '--defined-only', common.TEMP_OUTPUT], capture_output=True, text=True, check=True)
+        return {fields[2] for fields in map(str.split, symbols.stdout.splitlines()) if fields[1] in 'tT'}
+
+    def test_unused_runtime_dropped(self):
+        functions = self.functions(BOA + '/plus0')
+        self.assertIn('print_variadic', functions)
+        self.assertNotIn('compy_sleep', functions)
+        self.assertNotIn('eval_input', functions)
+
+    def test_static_compare_needs_no_runtime(self):
+        # The loop condition compares ints known statically
+        self.assertNotIn('compy_lt', self.functions('loops/while/while0'))
+
 class TestLet(common.CompyTestCase):
     def prefix(self) -> list[str]:
         return [BOA, 'let']
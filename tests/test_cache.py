@@ -0,0 +1,60 @@
+import io
+import os
+import shutil
+import tempfile
+import compy
+from compy.cache import CACHE_DIR_ENV, CACHE_SIZE_ENV
+from tests import common
+
+PROG = common.TESTCASE_DIR + 'io/print-anf' + compy.SUFFIX
+PROG_OUT = b'5274 9 -25 4\n'
+
+class TestCache(common.CompyTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.old_env = os.environ[CACHE_DIR_ENV]
+        os.environ[CACHE_DIR_ENV] = self.cache_dir.name
+
+    def tearDown(self):
+        os.environ[CACHE_DIR_ENV] = self.old_env
+        os.environ.pop(CACHE_SIZE_ENV, None)
+        self.cache_dir.cleanup()
+
+    def compile(self, *args: str, src: str = PROG) -> str:
+        stdout = io.StringIO()
+        compy.main(args=[src, '-o', common.TEMP_OUTPUT, '--cache-stats', *args], stdout=stdout, stderr=io.StringIO())
+        return stdout.getvalue().splitlines()[-1]
+
+    def test_hit(self):
+        self.assertEqual(self.compile(), 'Cache hits: 0, misses: 1, entries: 1, size: ' + str(os.path.getsize(common.TEMP_OUTPUT)) + ' bytes')
+        self.assertTrue(self.compile().startswith('Cache hits: 1, misses: 1, entries: 1'))
+        self.assertOutput([common.TEMP_OUTPUT], PROG_OUT)
+
+    def test_options_in_key(self):
+        self.compile()
+        self.assertTrue(self.compile('--runtime-abi', 'reg').startswith('Cache hits: 0, misses: 2, entries: 2'))
+        self.assertOutput([common.TEMP_OUTPUT], PROG_OUT)
+
+    def test_runtime_profile_in_key(self):
+        self.compile()
+        self.assertTrue(self.compile('--runtime-profile', 'release').startswith('Cache hits: 0, misses: 2, entries: 2'))
+        self.assertOutput([common.TEMP_OUTPUT], PROG_OUT)
+
+    def test_debug_info_path_in_key(self):
+        # Same source elsewhere: the executable can be shared, unless its debug info names the source
+        copy = os.path.join(self.cache_dir.name, 'copy' + compy.SUFFIX)
+        shutil.copy(PROG, copy)
+        self.compile()
+        self.assertTrue(self.compile(src=copy).startswith('Cache hits: 1, misses: 1, entries: 1'))
+        self.compile('--debug-info')
+        self.assertTrue(self.compile('--debug-info', src=copy).startswith('Cache hits: 1, misses: 3, entries: 3'))
+        self.assertOutput([common.TEMP_OUTPUT], PROG_OUT)
+
+    def test_no_cache(self):
+        self.assertTrue(self.compile('--no-cache').startswith('Cache hits: 0, misses: 0, entries: 0'))
+        self.assertOutput([common.TEMP_OUTPUT], PROG_OUT)
+
+    def test_eviction(self):
+        os.environ[CACHE_SIZE_ENV] = '0'
+        self.assertTrue(self.compile().startswith('Cache hits: 0, misses: 1, entries: 0'))
+        self.assertOutput([common.TEMP_OUTPUT], PROG_OUT)
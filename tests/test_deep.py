@@ -0,0 +1,38 @@
+import io
+import os
+import sys
+import tempfile
+import compy
+from tests import common
+
+# Deeper than the default recursion limit of Python
+DEPTH = 12000
+
+class TestDeep(common.CompyTestCase):
+    def setUp(self):
+        self.src_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.src_dir.cleanup()
+
+    # Chains of `and`/`or` become IfExprs nested DEPTH deep
+    def compile_source(self, code: str):
+        src_path = os.path.join(self.src_dir.name, 'deep' + compy.SUFFIX)
+        with open(src_path, 'w') as f:
+            f.write(code)
+        limit = sys.getrecursionlimit()
+        compy.main(args=[src_path, '-o', common.TEMP_OUTPUT, '--no-cache'], stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(limit, sys.getrecursionlimit())
+
+    def test_deep_expr(self):
+        self.compile_source('val(t := True)\n'
+                            f'print({" and ".join(["t"] * DEPTH)}, {" or ".join(["not t"] * DEPTH)})\n')
+        self.assertOutput([common.TEMP_OUTPUT], b'True False\n')
+
+    def test_deep_condition(self):
+        self.compile_source('var(f := False)\n'
+                            f'if {" or ".join(["f"] * DEPTH)} or add1(1) == 2:\n'
+                            '    print(1)\n'
+                            'else:\n'
+                            '    print(2)\n')
+        self.assertOutput([common.TEMP_OUTPUT], b'1\n')
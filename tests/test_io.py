@@ -1,3 +1,7 @@
+import io
+import subprocess
+import tempfile
+import compy
 from compy.common import FuncArgsError
 from tests import common
 
@@ -16,15 +20,20 @@ class TestIO(common.CompyTestCase):
     def test_print_nargs(self):
         self.success_case('print-nargs', TEST_IO_OUT)
 
+    def test_print_many(self):
+        self.success_case('print-many', PRINT_MANY_OUT)
+
     def test_input0(self):
         self.success_case('input0', b'42\n', stdin=b'42\n')
         self.success_case('input0', b'42\n', stdin=b'42')
         self.success_case('input0', b'-123\n', stdin=b'-123')
-        # self.success_case('input0', b'None\n', stdin=b'None')
-        # self.success_case('input0', b'bool\n', stdin=b'bool')
-        # self.success_case('input0', b'type\n', stdin=b'type')
-        # self.success_case('input0', b'False\n', stdin=b'False')
-        # self.success_case('input0', b'True\n', stdin=b'True')
+        self.success_case('input0', b'None\n', stdin=b'None')
+        self.success_case('input0', b'bool\n', stdin=b'bool')
+        self.success_case('input0', b'type\n', stdin=b'type')
+        self.success_case('input0', b'False\n', stdin=b'False')
+        self.success_case('input0', b'True\n', stdin=b'True')
+        self.success_case('input0', b'str\n', stdin=b'str')
+        self.success_case('input0', b'7\n', stdin=b' +007\n')
 
     def test_input1(self):
         self.success_case('input1', stdout=b'type\nbool\n9999\n100\nTrue\nNoneType\n', stdin=b'type\nbool\n-1\nTrue\nint\nNone')
@@ -48,6 +57,21 @@ class TestIO(common.CompyTestCase):
         self.runtime_failure('input0', common.PanicReason.EVAL_SYNTAX, stdin=b'\n')
         self.runtime_failure('input0', common.PanicReason.EVAL_SYNTAX, stdin=b'bad')
         self.runtime_failure('input0', common.PanicReason.EVAL_SYNTAX, stdin=b'102z')
+        self.runtime_failure('input0', common.PanicReason.EVAL_SYNTAX, stdin=b'9223372036854775808')
+        self.runtime_failure('input0', common.PanicReason.EVAL_SYNTAX, stdin=b'-')
+        self.runtime_failure('input0', common.PanicReason.EVAL_SYNTAX, stdin=b'Tru')
+        self.runtime_failure('input0', common.PanicReason.EVAL_SYNTAX, stdin=b'NoneTypes')
+
+    # Stdin is read in blocks from a pipe, but mapped when it is a regular file
+    def test_input_lines(self):
+        line = b' ' * 100000 + b'5\n' # Longer than the input buffer
+        self.success_case('input3', b'5 5 -7\n', stdin=line * 2 + b'-7')
+        compy.main([common.TESTCASE_DIR + 'io/input3' + compy.SUFFIX, '-o', common.TEMP_OUTPUT], stdout=io.StringIO())
+        with tempfile.TemporaryFile() as stdin:
+            stdin.write(b'skipped\n' + line * 2 + b'-7')
+            stdin.seek(len(b'skipped\n')) # Read from the current offset
+            proc = subprocess.run([common.TEMP_OUTPUT], stdin=stdin, capture_output=True)
+        self.assertEqual(b'5 5 -7\n', proc.stdout)
     
 
 TEST_IO_OUT = b'''
@@ -61,12 +85,16 @@ None 11 None 12 None
 14 15 16 17 18 19 20 21
 '''
 
+PRINT_MANY_OUT = b''.join(b'%d %d %s None int\n' % (i, i * 1000003, b'True' if i < 0 else b'False') for i in range(-10000, 10000)) \
+    + b'-9223372036854775808 9223372036854775807 0\n'
+
 class TestRuntimeFuncs(common.CompyTestCase):
     def prefix(self) -> list[str]:
         return [IO_PREFIX, 'runtime']
 
     def test_exit(self):
         self.success_case('exit', stdout=b'', retcode=42)
+        self.success_case('exit-flush', stdout=b'1 flushed\n', retcode=3)
 
     def test_exit_e(self):
         self.compile_failure('exit-e', FuncArgsError)
@@ -82,3 +110,11 @@ class TestRuntimeFuncs(common.CompyTestCase):
 
     def test_sleep_e3(self):
         self.runtime_failure('sleep-e3', common.PanicReason.ARITH_OVERFLOW)
+
+class TestRuntimeFuncsRegAbi(TestRuntimeFuncs):
+    def compiler_args(self) -> list[str]:
+        return ['--runtime-abi', 'reg']
+
+class TestRuntimeFuncsStatic(TestRuntimeFuncs):
+    def compiler_args(self) -> list[str]:
+        return ['--link', 'static']
@@ -1,3 +1,10 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import compy
 from tests import common
 
 LOOP_PREFIX = 'loops'
@@ -21,6 +28,9 @@ class TestWhile(common.CompyTestCase):
     def test_truth_table(self):
         self.success_case('truth-table', TRUTH_TABLE_OUTPUT)
 
+    def test_nested_live(self):
+        self.success_case('nested-live', b'12 2 1 4 63 5\n')
+
 POW_OUTPUT = b'''1
 2
 4
@@ -56,3 +66,50 @@ a b c True False True a&b&c False a|b|c True
 a b c True True False a&b&c False a|b|c True
 a b c True True True a&b&c True a|b|c True
 '''
+
+# Same test cases, also checking that the built-in assembler agrees with nasm
+@unittest.skipUnless(shutil.which('nasm'), 'nasm is not installed')
+class TestWhileCompareAsm(TestWhile):
+    def compiler_args(self) -> list[str]:
+        return ['--assembler', 'compare']
+
+# Same test cases with line counters, which must not change the behavior
+class TestWhileProfileLines(TestWhile):
+    def compiler_args(self) -> list[str]:
+        return ['--profile-lines']
+
+class TestProfileLines(common.CompyTestCase):
+    def profile(self, src_path: str, stdin: bytes = b'') -> str:
+        compy.main([common.TESTCASE_DIR + src_path + compy.SUFFIX, '--profile-lines', '-o', common.TEMP_OUTPUT],
+                   stdout=io.StringIO(), stderr=io.StringIO())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            report_path = os.path.join(tmpdir, 'profile.txt')
+            subprocess.run([common.TEMP_OUTPUT], input=stdin, capture_output=True, env={**os.environ, common.PROFILE_ENV: report_path})
+            with open(report_path) as report:
+                return report.read()
+
+    def test_report(self):
+        # Hottest first: the loop condition, then the body (where print calls the runtime)
+        self.assertEqual('line executions calls\n2 8 0\n3 7 7\n4 7 0\n1 1 0\n', self.profile('loops/while/while0'))
+
+    def test_report_on_panic(self):
+        self.assertEqual('line executions calls\n1 1 1\n', self.profile('io/input0', stdin=b'bad'))
+
+# Same test cases with line markers, which must not change the behavior
+class TestWhileDebugInfo(TestWhile):
+    def compiler_args(self) -> list[str]:
+        return ['--debug-info']
+
+class TestDebugInfo(common.CompyTestCase):
+    # The lines of the source in the line table of the executable, in the order of the addresses
+    def line_table(self, src_path: str) -> list[int]:
+        compy.main([common.TESTCASE_DIR + src_path + compy.SUFFIX, '--debug-info', '-o', common.TEMP_OUTPUT],
+                   stdout=io.StringIO(), stderr=io.StringIO())
+        dump = subprocess.run(['objdump', '--dwarf=decodedline', common.TEMP_OUTPUT], capture_output=True, text=True, check=True)
+        name = os.path.basename(src_path) + compy.SUFFIX
+        return [int(fields[1]) for fields in map(str.split, dump.stdout.splitlines())
+                if len(fields) >= 3 and fields[0] == name and fields[1].isdigit()]
+
+    def test_line_table(self):
+        # The slow path of line 4 (overflow) comes after the loop, the comparison of ints on line 2 has none
+        self.assertEqual([1, 2, 3, 4, 2, 4], self.line_table('loops/while/while0'))
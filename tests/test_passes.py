@@ -0,0 +1,59 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import compy
+from compy.checker import Checker
+from compy.passes import Visitor, group_name, schedule
+from compy.state import CompilerState
+from compy.strliteral import StringTagger
+from compy.tagger import FunctionTagger, VariableTagger
+from tests import common
+
+PASSES = ['parse', 'convert', 'checker', 'variables', 'inference', 'anf', 'constfold',
+          'regalloc', 'stack', 'codegen', 'peephole', 'assemble', 'link']
+
+class ScopeCounter(Visitor):
+    name = 'scopes'
+    after = ('functions',)
+
+class TestPasses(unittest.TestCase):
+    def test_schedule(self):
+        state = CompilerState()
+        groups = schedule([Checker(state), StringTagger(state), FunctionTagger(state), VariableTagger(state)])
+        self.assertEqual(['checker + strings + functions', 'variables'], [group_name(group) for group in groups])
+        # Needs the effects of a visitor of the current traversal
+        groups = schedule([Checker(state), FunctionTagger(state), ScopeCounter(), StringTagger(state)])
+        self.assertEqual(['checker + functions', 'scopes + strings'], [group_name(group) for group in groups])
+
+    def test_dependency_order(self):
+        state = CompilerState()
+        with self.assertRaises(AssertionError):
+            schedule([VariableTagger(state), FunctionTagger(state)])
+
+    def compile_timed(self, *args: str) -> str:
+        stdout = io.StringIO()
+        compy.main([common.TESTCASE_DIR + 'io/print-anf' + compy.SUFFIX, *args, '-o', common.TEMP_OUTPUT],
+                   stdout=stdout, stderr=io.StringIO())
+        return stdout.getvalue()
+
+    def test_time_passes(self):
+        report = self.compile_timed('--time-passes').split('Passes:\n')[1].splitlines()
+        self.assertEqual(['pass', *PASSES, 'total'], [line.split()[0] for line in report])
+
+    def test_time_passes_json(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            json_path = os.path.join(tmpdir, 'passes.json')
+            self.compile_timed('--time-passes-json', json_path, '--trace-memory')
+            self.compile_timed('--time-passes-json', json_path)
+            with open(json_path) as f:
+                first, second = [json.loads(line) for line in f]
+        self.assertTrue(first['completed'])
+        self.assertEqual(PASSES, [timing['name'].split()[0] for timing in first['passes']])
+        self.assertTrue(all(timing['peak_memory_bytes'] > 0 for timing in first['passes']))
+        self.assertIsNone(second['passes'][0]['peak_memory_bytes'])
+        sizes = {timing['name']: (timing['size'], timing['unit']) for timing in second['passes']}
+        self.assertEqual('nodes', sizes['anf'][1])
+        self.assertEqual('lines', sizes['codegen'][1])
+        self.assertGreater(sizes['link'][0], 0)
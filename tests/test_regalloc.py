@@ -0,0 +1,24 @@
+import unittest
+from compy.common import PrimType
+from compy.liveness import LiveRange
+from compy.regalloc import ALLOCATABLE, linear_scan
+from compy.syntax import VarInfo
+
+def live(start: int, weight: int, static_type: PrimType | None = None) -> LiveRange:
+    return LiveRange(VarInfo(0, True, static_type), start, 100, weight)
+
+class TestLinearScan(unittest.TestCase):
+    def test_evict_colder(self):
+        ints = [live(i, 1, PrimType.INT) for i in range(len(ALLOCATABLE))]
+        hot = live(len(ints), 10, PrimType.INT)
+        linear_scan([*ints, hot])
+        self.assertIsNotNone(hot.info.regs)
+        self.assertEqual(1, sum(live.info.regs is None for live in ints))
+
+    def test_no_useless_eviction(self):
+        # Only one register held by a colder variable: not enough for the two of an untyped variable
+        ranges = [live(0, 1, PrimType.INT), *(live(i, 20, PrimType.INT) for i in range(1, len(ALLOCATABLE)))]
+        hot = live(len(ranges), 10)
+        linear_scan([*ranges, hot])
+        self.assertIsNone(hot.info.regs)
+        self.assertTrue(all(live.info.regs is not None for live in ranges))
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import tempfile
+import threading
+import compy
+from compy.common import UserError
+from compy.server import SOCKET_ENV, CompileServer
+from tests import common
+
+CLIENT = os.path.abspath('./bin/compy-client')
+
+class TestServer(common.CompyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.socket_dir = tempfile.TemporaryDirectory()
+        cls.server = CompileServer(os.path.join(cls.socket_dir.name, 'compy.sock'))
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.thread.join()
+        cls.server.server_close()
+        cls.socket_dir.cleanup()
+
+    def client(self, *args: str) -> subprocess.CompletedProcess[bytes]:
+        env = dict(os.environ, **{SOCKET_ENV: self.server.socket_path})
+        return subprocess.run([CLIENT, *args], capture_output=True, env=env)
+
+    def test_compile(self):
+        proc = self.client(common.TESTCASE_DIR + 'io/print-anf' + compy.SUFFIX, '-o', common.TEMP_OUTPUT)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertOutput([common.TEMP_OUTPUT], b'5274 9 -25 4\n')
+
+    def test_compile_error(self):
+        proc = self.client(common.TESTCASE_DIR + 'checker/int-bounds/big' + compy.SUFFIX, '-o', common.TEMP_OUTPUT)
+        self.assertEqual(proc.returncode, 1)
+        self.assertIn(b'big.compy:1:', proc.stderr)
+        self.assertIn(b'Error: Aborted due to compile error', proc.stderr)
+
+    def test_usage_error(self):
+        proc = self.client()
+        self.assertEqual(proc.returncode, 2)
+        self.assertIn(b'usage:', proc.stderr)
+
+    def test_untrusted_socket(self):
+        # The client compiles by itself rather than use a socket others could have replaced
+        os.chmod(self.socket_dir.name, 0o755)
+        try:
+            proc = self.client(common.TESTCASE_DIR + 'io/print-anf' + compy.SUFFIX, '-o', common.TEMP_OUTPUT)
+        finally:
+            os.chmod(self.socket_dir.name, 0o700)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertIn(b'not using the server', proc.stderr)
+        self.assertOutput([common.TEMP_OUTPUT], b'5274 9 -25 4\n')
+
+    def test_shared_socket_dir(self):
+        with tempfile.TemporaryDirectory() as shared:
+            os.chmod(shared, 0o1777)
+            with self.assertRaises(UserError):
+                CompileServer(os.path.join(shared, 'compy.sock'))
@@ -20,6 +20,9 @@ class TestStringLiterals(common.CompyTestCase):
     def test_unicode(self):
         self.success_case('unicode', 'I ❤️ compy!\n'.encode())
 
+    def test_nul(self):
+        self.success_case('nul', b'a\0b  12345678 \0\n a\0b\n')
+
     def test_eq(self):
         self.success_case('eq', EQ_OUTPUT)
 